@@ -39,6 +39,10 @@ class AppConfig(BaseModel):
     mcp_config_path: str = Field(default="mcpconfig.json")
     knowledge_base_path: str = Field(default="rag/knowledge_base")
     chroma_db_path: str = Field(default="rag/chroma_db")
+    query_cache_path: str = Field(default="rag/query_embeddings.npz")
+    tool_schema_cache_path: str = Field(default="data/tool_schema_cache.json")
+    alert_store_path: str = Field(default="data/alerts.db")
+    snapshot_store_path: str = Field(default="data/snapshots.db")
     log_level: str = Field(default="INFO")
 
 
@@ -120,6 +124,10 @@ class ConfigManager:
             mcp_config_path=str(self.project_root / "mcpconfig.json"),
             knowledge_base_path=str(self.project_root / "rag" / "knowledge_base"),
             chroma_db_path=str(self.project_root / "rag" / "chroma_db"),
+            query_cache_path=str(self.project_root / "rag" / "query_embeddings.npz"),
+            tool_schema_cache_path=str(self.project_root / "data" / "tool_schema_cache.json"),
+            alert_store_path=str(self.project_root / "data" / "alerts.db"),
+            snapshot_store_path=str(self.project_root / "data" / "snapshots.db"),
             log_level=os.getenv("RUST_LOG", "INFO")
         )
 
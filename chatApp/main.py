@@ -11,15 +11,21 @@ Wazuh Security Analyst - LangChain AgenticRAG 應用
 版本: 1.0.0
 """
 import asyncio
+import time
 from pathlib import Path
 from loguru import logger
 import sys
+from typing import Optional
 
 from config import get_config, get_config_manager
 from mcp.client import MCPClientManager
+from mcp.loop_bridge import get_loop_bridge
+from mcp.alert_store import AlertStore
+from mcp.snapshot_store import SnapshotStore
 from mcp.wazuh_tools import WazuhToolkit
 from rag.retriever import SecurityKnowledgeRetriever
 from tools.web_search import create_web_search_tool
+from tools.knowledge_base import create_knowledge_base_tool
 from tools.system_tools import calculator_tool, get_current_time, system_status
 from agents.security_agent import create_security_agent
 from ui.cli import run_interactive_cli
@@ -55,25 +61,35 @@ async def initialize_mcp_client() -> MCPClientManager:
 
     manager = MCPClientManager()
 
-    # 遍歷配置的 MCP 服務器
-    for server_name, server_config in mcp_config.get("mcpServers", {}).items():
-        logger.info(f"📡 連接 MCP 服務器: {server_name}")
-        success = await manager.add_server(server_name, server_config)
+    # 併發連接所有配置的 MCP 服務器
+    servers = mcp_config.get("mcpServers", {})
+    logger.info(f"📡 連接 MCP 服務器: {', '.join(servers) or '無'}")
+    results = await manager.add_servers(servers)
 
+    for server_name, success in results.items():
+        connect_ms = manager.timings.get(server_name, {}).get('connect', 0.0)
         if success:
-            logger.info(f"✅ {server_name} 連接成功")
+            logger.info(f"✅ {server_name} 連接成功 ({connect_ms:.0f} ms)")
         else:
-            logger.warning(f"⚠️  {server_name} 連接失敗")
+            logger.warning(f"⚠️  {server_name} 連接失敗 ({connect_ms:.0f} ms)")
 
     return manager
 
 
-def create_tools(mcp_manager: MCPClientManager) -> list:
+async def create_tools(
+    mcp_manager: MCPClientManager,
+    retriever: Optional[SecurityKnowledgeRetriever] = None,
+    alert_store: Optional[AlertStore] = None,
+    snapshot_store: Optional[SnapshotStore] = None
+) -> list:
     """
     創建所有工具
 
     Args:
         mcp_manager: MCP 客戶端管理器
+        retriever: 可選的知識庫檢索器，提供時添加知識庫檢索工具
+        alert_store: 可選的本地警報存儲，提供時添加本地警報查詢工具
+        snapshot_store: 可選的進程和端口快照存儲，提供時添加快照比較工具
 
     Returns:
         工具列表
@@ -85,7 +101,14 @@ def create_tools(mcp_manager: MCPClientManager) -> list:
     wazuh_client = mcp_manager.get_client("wazuh")
     if wazuh_client:
         logger.info("✅ 添加 Wazuh MCP 工具")
-        wazuh_toolkit = WazuhToolkit(wazuh_client)
+        config = get_config()
+        wazuh_toolkit = WazuhToolkit(
+            wazuh_client,
+            schema_cache_path=config.tool_schema_cache_path,
+            alert_store=alert_store,
+            snapshot_store=snapshot_store
+        )
+        await wazuh_toolkit.discover_tools()
         wazuh_tools = wazuh_toolkit.get_tools()
         tools.extend(wazuh_tools)
         logger.info(f"   - 已添加 {len(wazuh_tools)} 個 Wazuh 工具")
@@ -106,10 +129,32 @@ def create_tools(mcp_manager: MCPClientManager) -> list:
         system_status
     ])
 
+    # 4. 知識庫檢索工具
+    if retriever is not None:
+        logger.info("✅ 添加知識庫檢索工具")
+        tools.append(create_knowledge_base_tool(retriever))
+
     logger.info(f"🎉 總共創建了 {len(tools)} 個工具")
     return tools
 
 
+def log_startup_timings(timings: dict, retriever=None):
+    """
+    輸出啟動各階段耗時
+
+    Args:
+        timings: 階段名稱 -> 毫秒
+        retriever: 可選的知識庫檢索器，後台預熱尚未完成的階段標記為進行中
+    """
+    phases = [f"{name} {ms:.0f} ms" for name, ms in timings.items()]
+    if retriever is not None:
+        labels = {"embeddings": "嵌入模型", "vectorstore": "向量數據庫", "index": "知識庫索引"}
+        for phase, label in labels.items():
+            ms = retriever.timings.get(phase)
+            phases.append(f"{label} {ms:.0f} ms（後台）" if ms is not None else f"{label} 後台加載中")
+    logger.info(f"⏱️  啟動耗時: {' | '.join(phases)}")
+
+
 async def main():
     """主函數"""
     # 打印啟動信息
@@ -124,16 +169,40 @@ async def main():
     """
     logger.info(console_print)
 
+    mcp_manager = None
+    retriever = None
+    alert_store = None
+    snapshot_store = None
+    timings = {}
+
     try:
         # 1. 加載配置
         logger.info("⚙️  加載配置...")
+        start = time.perf_counter()
         config = get_config()
+        timings["配置"] = (time.perf_counter() - start) * 1000
         logger.info(f"✅ 配置加載成功")
         logger.info(f"   - LLM: {config.llm.model}")
         logger.info(f"   - Base URL: {config.llm.base_url}")
 
-        # 2. 初始化 MCP 客戶端
-        mcp_manager = await initialize_mcp_client()
+        # 2. 後台預熱 RAG 檢索器（可選），嵌入模型和向量數據庫與 MCP 連接並行加載
+        logger.info("📚 後台預熱知識庫檢索器...")
+        try:
+            retriever = SecurityKnowledgeRetriever(
+                config.chroma_db_path,
+                source_dir=config.knowledge_base_path,
+                query_cache_path=config.query_cache_path
+            )
+            retriever.warm_up()
+        except Exception as e:
+            logger.warning(f"⚠️  RAG 檢索器初始化失敗: {e}")
+            logger.info("   將繼續使用其他工具")
+
+        # 3. 初始化 MCP 客戶端
+        # 連接建立在後台事件循環上，同步的 agent.chat 也能共用這些連接
+        start = time.perf_counter()
+        mcp_manager = await get_loop_bridge().run_async(initialize_mcp_client())
+        timings["MCP 連接"] = (time.perf_counter() - start) * 1000
 
         if not mcp_manager.get_all_clients():
             logger.error("❌ 沒有成功連接任何 MCP 服務器，無法繼續")
@@ -141,17 +210,14 @@ async def main():
             logger.info("   在 mcp-server-wazuh 目錄下執行: cargo run")
             return
 
-        # 3. 創建工具集
-        tools = create_tools(mcp_manager)
-
-        # 4. 初始化 RAG 檢索器（可選）
-        logger.info("📚 初始化知識庫檢索器...")
-        try:
-            retriever = SecurityKnowledgeRetriever()
-            logger.info("✅ RAG 檢索器初始化成功")
-        except Exception as e:
-            logger.warning(f"⚠️  RAG 檢索器初始化失敗: {e}")
-            logger.info("   將繼續使用其他工具")
+        # 4. 創建工具集
+        start = time.perf_counter()
+        # 本地存儲只供 Wazuh 工具使用，在此創建以便退出時與 MCP 連接一起關閉
+        if mcp_manager.get_client("wazuh"):
+            alert_store = AlertStore(config.alert_store_path)
+            snapshot_store = SnapshotStore(config.snapshot_store_path)
+        tools = await create_tools(mcp_manager, retriever, alert_store, snapshot_store)
+        timings["工具集"] = (time.perf_counter() - start) * 1000
 
         # 5. 創建 Agent
         logger.info("🤖 創建安全分析 Agent...")
@@ -166,6 +232,8 @@ async def main():
         if len(tools_info) > 5:
             logger.info(f"   - 還有 {len(tools_info) - 5} 個工具...")
 
+        log_startup_timings(timings, retriever)
+
         # 6. 啟動 CLI
         logger.info("🚀 啟動交互式界面...\n")
         await run_interactive_cli(agent)
@@ -177,6 +245,15 @@ async def main():
         import traceback
         traceback.print_exc()
     finally:
+        if mcp_manager is not None:
+            await mcp_manager.close_all()
+        if alert_store is not None:
+            alert_store.close()
+        if snapshot_store is not None:
+            snapshot_store.close()
+        if retriever is not None:
+            retriever.close()
+        get_loop_bridge().stop()
         logger.info("🔚 程序結束")
 
 
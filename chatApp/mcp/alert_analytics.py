@@ -0,0 +1,307 @@
+"""
+警報向量化聚合
+把本地警報載入為列數組（時間戳、規則、級別、代理），用 NumPy 完成分組、直方圖、Top-K 和百分位統計
+"""
+from typing import Dict, Any, Optional, List, Iterable, Tuple
+import numpy as np
+from loguru import logger
+
+from .alert_store import AlertStore
+
+
+DIMENSIONS = ("rule", "agent", "level")
+
+
+class AlertColumns:
+    """
+    列式警報數據
+
+    規則和代理以整數編碼保存，標籤表只增不減，因此可以按批追加新警報而無需重新編碼。
+    缺失的級別記為 -1，缺失的規則或代理編碼為標籤 "(無)"。
+    """
+
+    MISSING = "(無)"
+
+    def __init__(self):
+        self.ts = np.empty(0, dtype=np.float64)
+        self.level = np.empty(0, dtype=np.int16)
+        self.rule = np.empty(0, dtype=np.int32)
+        self.agent = np.empty(0, dtype=np.int32)
+        self.labels: Dict[str, List[str]] = {"rule": [], "agent": []}
+        self._index: Dict[str, Dict[str, int]] = {"rule": {}, "agent": {}}
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def _encode(self, dimension: str, values: np.ndarray) -> np.ndarray:
+        """把字符串數組編碼為整數，新出現的值追加到標籤表"""
+        uniques, inverse = np.unique(values, return_inverse=True)
+        index = self._index[dimension]
+        labels = self.labels[dimension]
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques.tolist()):
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(labels)
+                labels.append(value)
+            mapping[i] = code
+        return mapping[inverse]
+
+    @classmethod
+    def _as_labels(cls, values: Iterable[Optional[str]]) -> np.ndarray:
+        """轉換為字符串數組，None 記為缺失標籤"""
+        if isinstance(values, np.ndarray) and values.dtype.kind == "U":
+            return values
+        values = np.array(list(values), dtype=object)
+        return np.where(values == None, cls.MISSING, values).astype(str)  # noqa: E711
+
+    def extend(
+        self,
+        ts: Iterable[float],
+        rule: Iterable[Optional[str]],
+        level: Iterable[Optional[int]],
+        agent: Iterable[Optional[str]]
+    ):
+        """
+        追加一批警報
+
+        Args:
+            ts: epoch 秒
+            rule: 規則 ID
+            level: 規則級別
+            agent: 代理 ID
+        """
+        ts = np.asarray(ts if isinstance(ts, np.ndarray) else list(ts), dtype=np.float64)
+        if len(ts) == 0:
+            return
+        rule = self._as_labels(rule)
+        agent = self._as_labels(agent)
+        if isinstance(level, np.ndarray) and level.dtype.kind in "iu":
+            level = level.astype(np.int16)
+        else:
+            level = np.array([value if value is not None else -1 for value in level], dtype=np.int16)
+
+        self.ts = np.concatenate([self.ts, ts])
+        self.level = np.concatenate([self.level, level])
+        self.rule = np.concatenate([self.rule, self._encode("rule", rule)])
+        self.agent = np.concatenate([self.agent, self._encode("agent", agent)])
+
+    def codes(self, dimension: str) -> Tuple[np.ndarray, List[str]]:
+        """
+        獲取某維度的整數編碼和標籤
+
+        Returns:
+            (編碼數組, 標籤列表)
+        """
+        if dimension == "level":
+            # 級別本身就是小整數，偏移 1 讓缺失值 -1 落在 0
+            size = max(17, int(self.level.max()) + 2 if len(self) else 0)
+            return self.level.astype(np.int32) + 1, [str(i - 1) if i else self.MISSING for i in range(size)]
+        if dimension not in self.labels:
+            raise ValueError(f"不支持的維度 {dimension}，可選: {', '.join(DIMENSIONS)}")
+        return getattr(self, dimension), self.labels[dimension]
+
+    def mask(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        min_level: Optional[int] = None,
+        agent_id: Optional[str] = None,
+        rule_id: Optional[str] = None
+    ) -> np.ndarray:
+        """
+        構建過濾條件的布爾掩碼
+
+        Returns:
+            與警報等長的布爾數組
+        """
+        selected = np.ones(len(self), dtype=bool)
+        if since is not None:
+            selected &= self.ts >= since
+        if until is not None:
+            selected &= self.ts < until
+        if min_level is not None:
+            selected &= self.level >= min_level
+        for dimension, value in (("agent", agent_id), ("rule", rule_id)):
+            if value is not None:
+                code = self._index[dimension].get(value)
+                if code is None:
+                    return np.zeros(len(self), dtype=bool)
+                selected &= getattr(self, dimension) == code
+        return selected
+
+    def group_counts(self, by: str, mask: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """
+        按維度統計數量和最高級別
+
+        Returns:
+            {"codes", "counts", "max_level"}，只包含數量大於 0 的分組
+        """
+        codes, labels = self.codes(by)
+        if mask is not None:
+            codes, level = codes[mask], self.level[mask]
+        else:
+            level = self.level
+
+        size = max(len(labels), int(codes.max()) + 1 if len(codes) else 0)
+        counts = np.bincount(codes, minlength=size)
+        max_level = np.full(size, -1, dtype=np.int16)
+        np.maximum.at(max_level, codes, level)
+
+        present = np.flatnonzero(counts)
+        return {"codes": present, "counts": counts[present], "max_level": max_level[present]}
+
+    def top_k(self, by: str, k: int = 10, mask: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """
+        數量最多的 k 個分組
+
+        Returns:
+            [{"key", "count", "max_level"}, ...]，按數量從多到少
+        """
+        groups = self.group_counts(by, mask)
+        counts = groups["counts"]
+        if len(counts) > k:
+            selected = np.argpartition(-counts, k - 1)[:k]
+        else:
+            selected = np.arange(len(counts))
+        selected = selected[np.lexsort((groups["codes"][selected], -counts[selected]))]
+
+        labels = self.codes(by)[1]
+        return [
+            {"key": labels[groups["codes"][i]], "count": int(counts[i]), "max_level": int(groups["max_level"][i])}
+            for i in selected
+        ]
+
+    def top_k_per_group(
+        self,
+        outer: str,
+        inner: str,
+        k: int = 3,
+        mask: Optional[np.ndarray] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        每個外層分組內數量最多的 k 個內層分組（例如每個代理觸發最多的規則）
+
+        Returns:
+            {外層標籤: [{"key", "count", "max_level"}, ...]}
+        """
+        outer_codes, outer_labels = self.codes(outer)
+        inner_codes, inner_labels = self.codes(inner)
+        level = self.level
+        if mask is not None:
+            outer_codes, inner_codes, level = outer_codes[mask], inner_codes[mask], level[mask]
+        if len(outer_codes) == 0:
+            return {}
+
+        width = int(inner_codes.max()) + 1
+        combined = outer_codes.astype(np.int64) * width + inner_codes
+        pairs, inverse, counts = np.unique(combined, return_inverse=True, return_counts=True)
+        max_level = np.full(len(pairs), -1, dtype=np.int16)
+        np.maximum.at(max_level, inverse, level)
+
+        pair_outer = pairs // width
+        pair_inner = pairs % width
+        # 外層升序、數量降序排列後，每組內的名次即 k 的截斷位置
+        order = np.lexsort((pair_inner, -counts, pair_outer))
+        sorted_outer = pair_outer[order]
+        starts = np.flatnonzero(np.r_[True, sorted_outer[1:] != sorted_outer[:-1]])
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        keep = order[rank < k]
+
+        result: Dict[str, List[Dict[str, Any]]] = {}
+        for i in keep:
+            result.setdefault(outer_labels[pair_outer[i]], []).append({
+                "key": inner_labels[pair_inner[i]],
+                "count": int(counts[i]),
+                "max_level": int(max_level[i]),
+            })
+        return result
+
+    def histogram(
+        self,
+        bucket_seconds: float,
+        mask: Optional[np.ndarray] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        按固定時間桶統計警報數
+
+        Returns:
+            (每個桶的起始 epoch 秒, 每個桶的警報數)
+        """
+        ts = self.ts[mask] if mask is not None else self.ts
+        if len(ts) == 0:
+            return np.empty(0), np.empty(0, dtype=np.int64)
+
+        start = since if since is not None else ts.min()
+        start = np.floor(start / bucket_seconds) * bucket_seconds
+        end = until if until is not None else ts.max() + 1
+        buckets = int(np.ceil((end - start) / bucket_seconds))
+
+        counts = np.bincount(((ts - start) // bucket_seconds).astype(np.int64), minlength=buckets)[:buckets]
+        return start + np.arange(buckets) * bucket_seconds, counts
+
+    def percentiles(
+        self,
+        bucket_seconds: float,
+        mask: Optional[np.ndarray] = None,
+        q: Tuple[float, ...] = (50, 90, 99),
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        級別分布和每個時間桶警報數的百分位
+
+        Returns:
+            {"level": {"p50": ...}, "per_bucket": {"p50": ..., "max": ...}}
+        """
+        level = self.level[mask] if mask is not None else self.level
+        level = level[level >= 0]
+        _, counts = self.histogram(bucket_seconds, mask, since, until)
+
+        stats: Dict[str, Dict[str, float]] = {}
+        if len(level):
+            stats["level"] = {f"p{p:g}": float(v) for p, v in zip(q, np.percentile(level, q))}
+        if len(counts):
+            stats["per_bucket"] = {f"p{p:g}": float(v) for p, v in zip(q, np.percentile(counts, q))}
+            stats["per_bucket"]["max"] = float(counts.max())
+            stats["per_bucket"]["mean"] = float(counts.mean())
+        return stats
+
+
+class AlertAnalytics:
+    """從 AlertStore 增量載入列數據的聚合引擎"""
+
+    BATCH_SIZE = 50000
+
+    def __init__(self, store: AlertStore):
+        """
+        初始化聚合引擎
+
+        Args:
+            store: 本地警報存儲
+        """
+        self.store = store
+        self.columns = AlertColumns()
+        self._last_rowid = 0
+
+    def refresh(self) -> int:
+        """
+        載入上次之後新寫入存儲的警報
+
+        Returns:
+            新載入的警報數
+        """
+        loaded = 0
+        while True:
+            rows = self.store.rows_after(self._last_rowid, self.BATCH_SIZE)
+            if not rows:
+                break
+            rowid, ts, rule, level, agent = zip(*rows)
+            self.columns.extend(ts, rule, level, agent)
+            self._last_rowid = rowid[-1]
+            loaded += len(rows)
+        if loaded:
+            logger.debug(f"📈 載入 {loaded} 條警報到列數據（共 {len(self.columns)} 條）")
+        return loaded
@@ -0,0 +1,342 @@
+"""
+Wazuh 警報本地存儲
+以 SQLite 保存同步下來的警報，按高水位時間戳增量同步，過濾和聚合查詢在本地完成
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Tuple
+from loguru import logger
+
+from .compaction import parse_records, record_field
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    alert_id TEXT PRIMARY KEY,
+    ts REAL NOT NULL,
+    timestamp TEXT,
+    rule_id TEXT,
+    level INTEGER,
+    agent_id TEXT,
+    agent_name TEXT,
+    description TEXT,
+    raw TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts(ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_rule_id ON alerts(rule_id, ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_level ON alerts(level, ts);
+CREATE INDEX IF NOT EXISTS idx_alerts_agent_id ON alerts(agent_id, ts);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# 聚合維度 -> SQL 分組表達式
+GROUP_BY_EXPRESSIONS = {
+    "rule": "rule_id",
+    "agent": "agent_id",
+    "level": "level",
+    "hour": "strftime('%Y-%m-%d %H:00', ts, 'unixepoch')",
+    "day": "strftime('%Y-%m-%d', ts, 'unixepoch')",
+}
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """
+    把 Wazuh 時間戳解析為 epoch 秒
+
+    Args:
+        value: ISO 8601 時間字符串（例如 2024-05-01T10:00:00.123+0000）
+
+    Returns:
+        epoch 秒，無法解析時返回 None
+    """
+    if not value:
+        return None
+    text = value.strip().replace("Z", "+00:00")
+    # Wazuh 的時區偏移常寫成 +0000
+    text = re.sub(r"([+-]\d{2})(\d{2})$", r"\1:\2", text)
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def alert_from_record(record: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """
+    把警報工具返回的一條記錄轉換為表行
+
+    Returns:
+        表行字典，缺少可解析的時間戳時返回 None
+    """
+    timestamp = record_field(record, "time", "timestamp", "@timestamp", "date")
+    ts = parse_timestamp(timestamp)
+    if ts is None:
+        return None
+
+    raw = "\n".join(f"{key}: {value}" for key, value in record.items())
+    agent_name = record_field(record, "agent name", "agent")
+    agent_id = record_field(record, "agent id", "agent.id")
+    if agent_id is None and agent_name:
+        # "web-01 (003)" 形式的代理字段
+        match = re.search(r"\((\d{3,})\)", agent_name)
+        if match:
+            agent_id = match.group(1)
+            agent_name = agent_name[:match.start()].strip()
+
+    level = record_field(record, "level", "rule level")
+    level_match = re.search(r"\d+", level or "")
+
+    return {
+        "alert_id": record_field(record, "alert id", "id") or hashlib.sha1(raw.encode("utf-8")).hexdigest(),
+        "ts": ts,
+        "timestamp": timestamp,
+        "rule_id": record_field(record, "rule id", "rule.id", "rule"),
+        "level": int(level_match.group()) if level_match else None,
+        "agent_id": agent_id,
+        "agent_name": agent_name,
+        "description": record_field(record, "description", "rule description"),
+        "raw": raw,
+    }
+
+
+class AlertStore:
+    """
+    SQLite 警報存儲
+
+    MCP 警報工具只支持 limit 參數，同步時從較小的 limit 開始，直到返回的最舊警報
+    早於高水位時間戳（或達到上限）才停止加倍，只寫入比高水位更新的警報。
+    """
+
+    def __init__(self, db_path: str, initial_sync_limit: int = 100, max_sync_limit: int = 10000):
+        """
+        初始化存儲
+
+        Args:
+            db_path: SQLite 數據庫文件路徑（":memory:" 表示內存數據庫）
+            initial_sync_limit: 每次同步的初始 limit
+            max_sync_limit: 單次同步的 limit 上限
+        """
+        self.db_path = db_path
+        self.initial_sync_limit = initial_sync_limit
+        self.max_sync_limit = max_sync_limit
+
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # 同步和查詢可能來自不同線程，統一用鎖串行化
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            if db_path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    def _get_state(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_state(self, key: str, value: Any):
+        self._conn.execute(
+            "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value))
+        )
+
+    @property
+    def high_water_mark(self) -> float:
+        """已同步警報中最新的時間戳（epoch 秒），尚未同步時為 0"""
+        with self._lock:
+            value = self._get_state("high_water_mark")
+        return float(value) if value else 0.0
+
+    @property
+    def last_sync(self) -> float:
+        """上次成功同步的時間（epoch 秒），尚未同步時為 0"""
+        with self._lock:
+            value = self._get_state("last_sync")
+        return float(value) if value else 0.0
+
+    def insert_records(self, records: List[Dict[str, str]]) -> int:
+        """
+        寫入比高水位更新的警報
+
+        Args:
+            records: 警報工具返回的解析記錄
+
+        Returns:
+            新寫入的警報數
+        """
+        alerts = [alert for alert in map(alert_from_record, records) if alert is not None]
+        with self._lock:
+            value = self._get_state("high_water_mark")
+            high_water_mark = float(value) if value else 0.0
+            fresh = [alert for alert in alerts if alert["ts"] >= high_water_mark]
+
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO alerts "
+                "(alert_id, ts, timestamp, rule_id, level, agent_id, agent_name, description, raw) "
+                "VALUES (:alert_id, :ts, :timestamp, :rule_id, :level, :agent_id, :agent_name, :description, :raw)",
+                fresh
+            )
+            inserted = self._conn.total_changes - before
+
+            if fresh:
+                self._set_state("high_water_mark", max(high_water_mark, max(alert["ts"] for alert in fresh)))
+            self._conn.commit()
+        return inserted
+
+    async def sync(self, fetch_alerts: Callable[[int], Awaitable[str]]) -> Dict[str, Any]:
+        """
+        增量同步警報
+
+        Args:
+            fetch_alerts: 以 limit 為參數、返回警報工具文本的協程函數
+
+        Returns:
+            {"inserted", "fetched", "limit", "high_water_mark", "elapsed_ms"}
+        """
+        start = time.perf_counter()
+        high_water_mark = self.high_water_mark
+        # 首次同步直接回填到上限；之後從小 limit 開始按需加倍
+        limit = self.initial_sync_limit if high_water_mark > 0 else self.max_sync_limit
+
+        while True:
+            records = parse_records(await fetch_alerts(limit))[1]
+            timestamps = [ts for ts in (parse_timestamp(record_field(r, "time", "timestamp", "@timestamp", "date")) for r in records) if ts is not None]
+            # 返回的最舊警報仍比高水位新，說明中間可能還有未同步的警報
+            reached = high_water_mark > 0 and timestamps and min(timestamps) <= high_water_mark
+            if reached or len(records) < limit or limit >= self.max_sync_limit:
+                break
+            limit = min(limit * 2, self.max_sync_limit)
+
+        inserted = self.insert_records(records)
+        with self._lock:
+            self._set_state("last_sync", time.time())
+            self._conn.commit()
+
+        stats = {
+            "inserted": inserted,
+            "fetched": len(records),
+            "limit": limit,
+            "high_water_mark": self.high_water_mark,
+            "elapsed_ms": (time.perf_counter() - start) * 1000,
+        }
+        logger.info(f"🗄️  警報同步完成: 新增 {inserted} 條（獲取 {len(records)} 條，limit={limit}，{stats['elapsed_ms']:.0f} ms）")
+        return stats
+
+    @staticmethod
+    def _where(
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        agent_id: Optional[str] = None,
+        rule_id: Optional[str] = None,
+        min_level: Optional[int] = None,
+        text: Optional[str] = None
+    ) -> Tuple[str, List[Any]]:
+        """構建 WHERE 子句和參數"""
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        if agent_id:
+            clauses.append("agent_id = ?")
+            params.append(agent_id)
+        if rule_id:
+            clauses.append("rule_id = ?")
+            params.append(rule_id)
+        if min_level is not None:
+            clauses.append("level >= ?")
+            params.append(min_level)
+        if text:
+            clauses.append("description LIKE ?")
+            params.append(f"%{text}%")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, limit: int = 50, **filters) -> List[Dict[str, Any]]:
+        """
+        按條件查詢警報（最新的在前）
+
+        Args:
+            limit: 返回的最大條數
+            **filters: since、until（epoch 秒）、agent_id、rule_id、min_level、text
+
+        Returns:
+            警報列表
+        """
+        where, params = self._where(**filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT timestamp, rule_id, level, agent_id, agent_name, description FROM alerts{where} "
+                f"ORDER BY ts DESC LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def aggregate(self, group_by: str = "rule", top: int = 20, **filters) -> List[Dict[str, Any]]:
+        """
+        按維度統計警報數
+
+        Args:
+            group_by: rule、agent、level、hour、day
+            top: 返回的最大分組數（hour、day 取最近的 top 個時段，按時間順序返回）
+            **filters: 同 query
+
+        Returns:
+            [{"key", "count", "max_level", "sample"}, ...]
+        """
+        if group_by not in GROUP_BY_EXPRESSIONS:
+            raise ValueError(f"不支持的聚合維度 {group_by}，可選: {', '.join(GROUP_BY_EXPRESSIONS)}")
+
+        expression = GROUP_BY_EXPRESSIONS[group_by]
+        chronological = group_by in ("hour", "day")
+        # 時間維度先按時間倒序取最近的 top 個時段，再翻轉為時間順序
+        order = "key DESC" if chronological else "count DESC, key ASC"
+        where, params = self._where(**filters)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {expression} AS key, COUNT(*) AS count, MAX(level) AS max_level, "
+                f"MAX(description) AS sample FROM alerts{where} GROUP BY key ORDER BY {order} LIMIT ?",
+                params + [top]
+            ).fetchall()
+        if chronological:
+            rows = rows[::-1]
+        return [dict(row) for row in rows]
+
+    def count(self, **filters) -> int:
+        """統計符合條件的警報數"""
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM alerts{where}", params).fetchone()[0]
+
+    def rows_after(self, rowid: int, limit: int) -> List[Tuple[int, float, Optional[str], Optional[int], Optional[str]]]:
+        """
+        按寫入順序讀取 rowid 之後的警報，供列式聚合增量載入
+
+        Returns:
+            [(rowid, ts, rule_id, level, agent_id), ...]
+        """
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(
+                "SELECT rowid, ts, rule_id, level, agent_id FROM alerts WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (rowid, limit)
+            )]
+
+    def close(self):
+        """關閉數據庫連接"""
+        with self._lock:
+            self._conn.close()
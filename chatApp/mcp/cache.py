@@ -0,0 +1,118 @@
+"""
+Wazuh 工具結果緩存
+以工具名稱 + 規範化參數為鍵的 TTL + LRU 緩存
+"""
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+
+def canonical_call_key(tool_name: str, arguments: Dict[str, Any]) -> str:
+    """
+    生成工具調用的規範化鍵
+
+    參數按鍵排序後序列化，值為 None 的參數視為未提供，
+    因此 {"limit": 10, "status": None} 與 {"limit": 10} 得到同一個鍵。
+    """
+    canonical = {k: v for k, v in (arguments or {}).items() if v is not None}
+    return f"{tool_name}:{json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)}"
+
+
+class ToolResultCache:
+    """帶 TTL 和 LRU 容量上限的工具結果緩存"""
+
+    def __init__(self, max_entries: int = 256):
+        """
+        初始化緩存
+
+        Args:
+            max_entries: 最多保留的條目數，超出時淘汰最久未使用的條目
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(tool_name: str, arguments: Dict[str, Any]) -> str:
+        """生成緩存鍵（見 canonical_call_key）"""
+        return canonical_call_key(tool_name, arguments)
+
+    def get(self, tool_name: str, arguments: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        讀取未過期的緩存結果
+
+        Returns:
+            緩存的工具結果，未命中或已過期時返回 None
+        """
+        key = self.make_key(tool_name, arguments)
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, tool_name: str, arguments: Dict[str, Any], result: Dict[str, Any], ttl: float):
+        """
+        寫入緩存
+
+        Args:
+            tool_name: 工具名稱
+            arguments: 工具參數
+            result: 工具結果
+            ttl: 存活秒數，<= 0 時不緩存
+        """
+        if ttl <= 0:
+            return
+
+        key = self.make_key(tool_name, arguments)
+        self._entries[key] = (time.monotonic() + ttl, tool_name, result)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, tool_name: Optional[str] = None, arguments: Optional[Dict[str, Any]] = None) -> int:
+        """
+        使緩存失效
+
+        Args:
+            tool_name: 只清除該工具的條目；為 None 時清空全部
+            arguments: 與 tool_name 一起提供時只清除這一組參數的條目
+
+        Returns:
+            清除的條目數
+        """
+        if tool_name is None:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+
+        if arguments is not None:
+            return 1 if self._entries.pop(self.make_key(tool_name, arguments), None) is not None else 0
+
+        keys = [key for key, entry in self._entries.items() if entry[1] == tool_name]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """緩存命中統計"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -3,18 +3,76 @@ MCP 客戶端實現
 支持通過 stdio 和 HTTP 與 MCP 服務器通信
 """
 import asyncio
+import codecs
 import json
 import os
-from typing import Optional, Dict, Any, List
+import re
+from typing import Optional, Dict, Any, List, Callable, Tuple, AsyncIterator
 from pathlib import Path
 import httpx
 from loguru import logger
 import sys
 
+from .cache import canonical_call_key
+from .loop_bridge import run_on_loop
+from .resilience import LatencyTracker, CircuitBreaker
+
+
+class MCPMessageTooLargeError(Exception):
+    """stdio 消息超過 max_message_size 上限"""
+
+    def __init__(self, size: int, max_size: int, request_id: Optional[int] = None):
+        self.size = size
+        self.max_size = max_size
+        self.request_id = request_id
+        super().__init__(
+            f"MCP 響應大小 {size} 字節超過上限 {max_size} 字節，"
+            f"請減小 limit 參數或調高 stdio.max_message_size"
+        )
+
+
+class MCPTransportError(Exception):
+    """傳輸層或 JSON-RPC 層失敗（連接錯誤、非 200 響應、JSON-RPC error），區別於工具返回的 isError 結果"""
+
 
 class MCPClient:
     """MCP 客戶端，用於與 MCP 服務器通信"""
 
+    # HTTP 連接池默認配置，可在 mcpconfig.json 服務器配置的 "http" 字段中覆蓋
+    DEFAULT_HTTP_OPTIONS: Dict[str, Any] = {
+        "http2": False,                  # 需要安裝 h2（pip install httpx[http2]）
+        "max_connections": 20,           # 連接池最大連接數
+        "max_keepalive_connections": 10, # 保持存活的空閒連接數
+        "keepalive_expiry": 30.0,        # 空閒連接保留秒數
+        "connect_timeout": 10.0,         # 建立連接超時
+        "request_timeout": 30.0,         # 一般請求超時（initialize、tools/list）
+        "tool_timeout": 120.0,           # 工具調用超時
+    }
+
+    # stdio 子進程默認配置，可在服務器配置的 "stdio" 字段中覆蓋
+    DEFAULT_STDIO_OPTIONS: Dict[str, Any] = {
+        "startup_timeout": 30.0,         # 等待服務器完成 initialize 握手的總時間
+        "probe_initial_delay": 0.05,     # 等待握手期間首次檢查進程狀態的間隔
+        "probe_max_delay": 2.0,          # 進程狀態檢查間隔的指數退避上限
+        "read_buffer_limit": 1024 * 1024,         # stdout 緩衝上限，超過時按塊拼接長行
+        "max_message_size": 64 * 1024 * 1024,     # 單條消息的最大字節數
+    }
+
+    # 工具調用彈性控制默認配置，可在服務器配置的 "resilience" 字段中覆蓋
+    DEFAULT_RESILIENCE_OPTIONS: Dict[str, Any] = {
+        "default_timeout": 60.0,         # 延遲樣本不足時的工具超時
+        "min_timeout": 5.0,              # 自適應超時下限
+        "max_timeout": 120.0,            # 自適應超時上限
+        "timeout_multiplier": 3.0,       # 自適應超時 = p99 延遲 × 倍數
+        "min_samples": 10,               # 啟用自適應超時所需的最少樣本數
+        "failure_threshold": 5,          # 觸發工具熔斷的連續失敗次數
+        "server_failure_threshold": 10,  # 觸發服務器熔斷的連續傳輸失敗次數（所有工具合計）
+        "recovery_timeout": 30.0,        # 熔斷後進入半開探測的等待秒數
+    }
+
+    # 表示服務器不接受批量請求的 JSON-RPC 錯誤碼：解析錯誤、無效請求
+    BATCH_REJECTION_CODES = (-32700, -32600)
+
     def __init__(self, server_config: Dict[str, Any]):
         """
         初始化 MCP 客戶端
@@ -25,16 +83,41 @@ class MCPClient:
         self.server_config = server_config
         self.server_url = None
         self.session_id = None
+        self.server_info: Dict[str, Any] = {}  # initialize 返回的 serverInfo（name、version）
         self.process = None  # stdio 模式的子進程
-        self.request_id = 0  # JSON-RPC 請求 ID
+        self.request_id = 0  # JSON-RPC 請求 ID（單調遞增）
+        self._pending: Dict[int, asyncio.Future] = {}  # stdio 模式下等待響應的請求
+        self._reader_task: Optional[asyncio.Task] = None  # stdio 模式的後台讀取任務
+        self._stderr_task: Optional[asyncio.Task] = None  # 持續排空 stderr，避免管道寫滿阻塞服務器
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._notification_handlers: List[Callable[[Dict[str, Any]], None]] = []
+        self._progress_callbacks: Dict[Any, Callable[[Dict[str, Any]], None]] = {}  # {progressToken: 回調}
+        self._pending_batches: List[asyncio.Future] = []  # 等待批量拒絕錯誤的 stdio 批量請求
+        self._batch_supported = True  # 服務器拒絕過批量請求後不再嘗試
+        self.http_options = {**self.DEFAULT_HTTP_OPTIONS, **server_config.get('http', {})}
+        self.stdio_options = {**self.DEFAULT_STDIO_OPTIONS, **server_config.get('stdio', {})}
+        self.resilience_options = {**self.DEFAULT_RESILIENCE_OPTIONS, **server_config.get('resilience', {})}
+        self.latency = LatencyTracker()  # 每個工具的滾動延遲統計
+        self._server_breaker = self._create_breaker(self.resilience_options["server_failure_threshold"])
+        self._tool_breakers: Dict[str, CircuitBreaker] = {}
+        self._inflight_calls: Dict[str, asyncio.Future] = {}  # 單飛：{調用鍵: 共享的在途調用}
+        self._inflight_progress: Dict[str, List[Callable[[Dict[str, Any]], None]]] = {}
+        self._http_client: Optional[httpx.AsyncClient] = None  # HTTP 模式的長連接客戶端
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # 連接所屬的事件循環
         self._initialize_connection()
 
+    @staticmethod
+    def transport_for(server_config: Dict[str, Any]) -> str:
+        """根據服務器配置判斷傳輸模式（'http' 或 'stdio'）"""
+        command = server_config.get('command', '')
+        return 'http' if 'http' in command.lower() or command.startswith('http') else 'stdio'
+
     def _initialize_connection(self):
         """初始化連接配置"""
         command = self.server_config.get('command', '')
 
         # 檢查是否是 HTTP 服務器
-        if 'http' in command.lower() or command.startswith('http'):
+        if self.transport_for(self.server_config) == 'http':
             # HTTP 模式
             self.transport_mode = 'http'
             self.server_url = command
@@ -44,6 +127,124 @@ class MCPClient:
             self.transport_mode = 'stdio'
             logger.info(f"📡 使用 stdio 模式連接 MCP 服務器: {command}")
 
+    @property
+    def is_alive(self) -> bool:
+        """連接是否仍可用（stdio 模式下檢查子進程和讀取任務）"""
+        if self.transport_mode == 'http':
+            return self._http_client is not None and not self._http_client.is_closed
+        return (
+            self.process is not None
+            and self.process.returncode is None
+            and self._reader_task is not None
+            and not self._reader_task.done()
+        )
+
+    async def wait_closed(self):
+        """等待 stdio 連接斷開（讀取任務結束）"""
+        if self._reader_task is not None:
+            await asyncio.shield(self._reader_task)
+
+    def _next_request_id(self) -> int:
+        """生成下一個 JSON-RPC 請求 ID"""
+        self.request_id += 1
+        return self.request_id
+
+    def add_notification_handler(self, handler: Callable[[Dict[str, Any]], None]):
+        """
+        註冊服務器通知處理函數
+
+        Args:
+            handler: 接收 JSON-RPC 通知對象的回調函數
+        """
+        self._notification_handlers.append(handler)
+
+    def _handle_notification(self, notification: Dict[str, Any]):
+        """分發服務器通知（不佔用任何請求的響應通道）"""
+        method = notification.get('method', '')
+        logger.debug(f"📨 收到服務器通知: {method}")
+
+        params = notification.get('params', {})
+        if method == 'notifications/message':
+            logger.debug(f"MCP 服務器日誌 [{params.get('level', 'info')}]: {params.get('data')}")
+        elif method == 'notifications/progress':
+            callback = self._progress_callbacks.get(params.get('progressToken'))
+            if callback is not None:
+                try:
+                    callback(params)
+                except Exception as e:
+                    logger.warning(f"⚠️  進度回調執行失敗: {e}")
+
+        for handler in self._notification_handlers:
+            try:
+                handler(notification)
+            except Exception as e:
+                logger.warning(f"⚠️  通知處理函數執行失敗: {e}")
+
+    def _on_owner_loop(self) -> bool:
+        """
+        當前是否運行在連接所屬的事件循環上
+
+        從其他線程的事件循環調用時，公開方法會把協程轉交給所屬循環執行。
+        """
+        if self._loop is None or self._loop.is_closed():
+            return True
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """
+        獲取 HTTP 客戶端，首次使用時創建
+
+        整個 MCPClient 生命週期內共用同一個連接池，避免每次工具調用都重新進行
+        TCP/TLS 握手。
+
+        Returns:
+            httpx.AsyncClient 實例
+        """
+        if self._http_client is None or self._http_client.is_closed:
+            options = self.http_options
+
+            http2 = bool(options["http2"])
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logger.warning("⚠️  未安裝 h2，改用 HTTP/1.1（pip install httpx[http2]）")
+                    http2 = False
+
+            self._http_client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=options["max_connections"],
+                    max_keepalive_connections=options["max_keepalive_connections"],
+                    keepalive_expiry=options["keepalive_expiry"],
+                ),
+                timeout=httpx.Timeout(
+                    options["request_timeout"],
+                    connect=options["connect_timeout"],
+                ),
+            )
+            logger.debug(f"創建 HTTP 連接池 (http2={http2}, max_connections={options['max_connections']})")
+
+        return self._http_client
+
+    def _http_headers(self, streaming: bool = False) -> Dict[str, str]:
+        """
+        構建 MCP HTTP 請求 headers
+
+        Args:
+            streaming: 是否接受 streamable-HTTP（text/event-stream）響應
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json, text/event-stream" if streaming else "application/json",
+        }
+        if self.session_id:
+            headers['MCP-Session-Id'] = self.session_id
+        return headers
+
     async def connect(self) -> bool:
         """
         建立與 MCP 服務器的連接
@@ -51,6 +252,8 @@ class MCPClient:
         Returns:
             連接是否成功
         """
+        # stdio 管道和 HTTP 連接池都綁定在創建它們的事件循環上
+        self._loop = asyncio.get_running_loop()
         try:
             if self.transport_mode == 'http':
                 return await self._connect_http()
@@ -63,66 +266,61 @@ class MCPClient:
     async def _connect_http(self) -> bool:
         """建立 HTTP 連接"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # 初始化請求
-                init_payload = {
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": "initialize",
-                    "params": {
-                        "protocolVersion": "2025-06-18",
-                        "capabilities": {
-                            "sampling": {},
-                            "roots": {"listChanged": True}
-                        },
-                        "clientInfo": {
-                            "name": "chatapp-wazuh-client",
-                            "version": "1.0.0"
-                        }
+            client = self._get_http_client()
+
+            # 初始化請求
+            init_payload = {
+                "jsonrpc": "2.0",
+                "id": self._next_request_id(),
+                "method": "initialize",
+                "params": {
+                    "protocolVersion": "2025-06-18",
+                    "capabilities": {
+                        "sampling": {},
+                        "roots": {"listChanged": True}
+                    },
+                    "clientInfo": {
+                        "name": "chatapp-wazuh-client",
+                        "version": "1.0.0"
                     }
                 }
+            }
+
+            logger.debug(f"發送初始化請求到 {self.server_url}/mcp")
+            response = await client.post(
+                f"{self.server_url}/mcp",
+                json=init_payload,
+                headers=self._http_headers()
+            )
+
+            if response.status_code == 200:
+                result = response.json()
+                logger.info(f"✅ 成功連接到 MCP 服務器")
+                self.server_info = result.get('result', {}).get('serverInfo', {})
+                logger.debug(f"服務器信息: {self.server_info}")
+
+                # 獲取 session ID（如果使用 SSE）
+                if 'mcp-session-id' in response.headers:
+                    self.session_id = response.headers['mcp-session-id']
 
-                # 設置正確的 headers
-                headers = {
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
+                # 發送 initialized 通知（MCP 協議要求）
+                notification = {
+                    "jsonrpc": "2.0",
+                    "method": "notifications/initialized"
                 }
 
-                logger.debug(f"發送初始化請求到 {self.server_url}/mcp")
-                response = await client.post(
+                logger.debug("發送 initialized 通知")
+                await client.post(
                     f"{self.server_url}/mcp",
-                    json=init_payload,
-                    headers=headers
+                    json=notification,
+                    headers=self._http_headers()
                 )
 
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"✅ 成功連接到 MCP 服務器")
-                    logger.debug(f"服務器信息: {result.get('result', {}).get('serverInfo', {})}")
-
-                    # 獲取 session ID（如果使用 SSE）
-                    if 'mcp-session-id' in response.headers:
-                        self.session_id = response.headers['mcp-session-id']
-                        headers['MCP-Session-Id'] = self.session_id
-
-                    # 發送 initialized 通知（MCP 協議要求）
-                    notification = {
-                        "jsonrpc": "2.0",
-                        "method": "notifications/initialized"
-                    }
-
-                    logger.debug("發送 initialized 通知")
-                    await client.post(
-                        f"{self.server_url}/mcp",
-                        json=notification,
-                        headers=headers
-                    )
-
-                    return True
-                else:
-                    logger.error(f"❌ HTTP 連接失敗: {response.status_code}")
-                    logger.error(f"響應內容: {response.text}")
-                    return False
+                return True
+            else:
+                logger.error(f"❌ HTTP 連接失敗: {response.status_code}")
+                logger.error(f"響應內容: {response.text}")
+                return False
 
         except Exception as e:
             logger.error(f"❌ HTTP 連接異常: {e}")
@@ -151,39 +349,22 @@ class MCPClient:
                 stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
-                env=process_env
+                env=process_env,
+                limit=self.stdio_options["read_buffer_limit"]
             )
 
-            # 等待進程啟動
-            await asyncio.sleep(1)
-
-            if self.process.returncode is not None:
-                logger.error(f"❌ MCP 進程啟動失敗，退出碼: {self.process.returncode}")
-                return False
-
-            # 初始化 MCP 連接
-            init_request = {
-                "jsonrpc": "2.0",
-                "id": 1,
-                "method": "initialize",
-                "params": {
-                    "protocolVersion": "2025-06-18",
-                    "capabilities": {
-                        "sampling": {},
-                        "roots": {"listChanged": True}
-                    },
-                    "clientInfo": {
-                        "name": "chatapp-wazuh-client",
-                        "version": "1.0.0"
-                    }
-                }
-            }
+            # 啟動後台讀取任務，按請求 ID 分發響應；stderr 持續排空到日誌
+            self._write_lock = asyncio.Lock()
+            self._reader_task = asyncio.create_task(self._read_loop_stdio())
+            self._stderr_task = asyncio.create_task(self._drain_stderr_stdio())
 
-            response = await self._send_request_stdio(init_request)
+            # 以 initialize 握手作為就緒探測
+            response = await self._initialize_stdio()
 
             if response and 'result' in response:
                 logger.info(f"✅ 成功連接到 MCP 服務器 (stdio)")
-                logger.debug(f"服務器信息: {response.get('result', {}).get('serverInfo', {})}")
+                self.server_info = response.get('result', {}).get('serverInfo', {})
+                logger.debug(f"服務器信息: {self.server_info}")
 
                 # 發送 initialized 通知
                 notification = {
@@ -202,51 +383,268 @@ class MCPClient:
             await self._close_stdio()
             return False
 
-    async def _send_request_stdio(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    async def _initialize_stdio(self) -> Optional[Dict[str, Any]]:
         """
-        通過 stdio 發送請求並獲取響應
+        發送一次 initialize 握手並等待服務器就緒
+
+        只發送一個 initialize 請求（部分服務器拒絕重複的 initialize），在 startup_timeout 內
+        等待它的響應；按指數退避的間隔檢查進程是否仍在運行，進程退出時立即失敗。
+
+        Returns:
+            initialize 的 JSON-RPC 響應，失敗時返回 None
+        """
+        options = self.stdio_options
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + options["startup_timeout"]
+        delay = options["probe_initial_delay"]
+        checks = 0
+
+        init_request = {
+            "jsonrpc": "2.0",
+            "id": self._next_request_id(),
+            "method": "initialize",
+            "params": {
+                "protocolVersion": "2025-06-18",
+                "capabilities": {
+                    "sampling": {},
+                    "roots": {"listChanged": True}
+                },
+                "clientInfo": {
+                    "name": "chatapp-wazuh-client",
+                    "version": "1.0.0"
+                }
+            }
+        }
+        response = asyncio.ensure_future(
+            self._send_request_stdio(init_request, timeout=options["startup_timeout"], log_timeout=False)
+        )
+
+        try:
+            while not response.done():
+                checks += 1
+                await asyncio.wait({response}, timeout=min(delay, max(0.0, deadline - loop.time())))
+                if response.done():
+                    break
+
+                # 進程已退出或 stdout 已關閉時不再等待
+                if self.process is None or self.process.returncode is not None or self._reader_task.done():
+                    returncode = self.process.returncode if self.process else None
+                    logger.error(f"❌ MCP 進程啟動失敗，退出碼: {returncode}")
+                    return None
+
+                if loop.time() >= deadline:
+                    break
+                delay = min(delay * 2, options["probe_max_delay"])
+        finally:
+            if not response.done():
+                response.cancel()
+                try:
+                    await response
+                except asyncio.CancelledError:
+                    pass
+
+        if response.cancelled() or response.result() is None:
+            if self.process is None or self.process.returncode is not None or self._reader_task.done():
+                returncode = self.process.returncode if self.process else None
+                logger.error(f"❌ MCP 進程啟動失敗，退出碼: {returncode}")
+            else:
+                logger.error(f"❌ MCP 服務器在 {options['startup_timeout']} 秒內未完成握手")
+            return None
+
+        elapsed_ms = (loop.time() - started) * 1000
+        logger.info(f"⏱️  stdio 握手完成: {elapsed_ms:.0f} ms（檢查進程 {checks} 次）")
+        return response.result()
+
+    async def _drain_stderr_stdio(self):
+        """持續讀取子進程 stderr 並寫入調試日誌"""
+        try:
+            while self.process and self.process.stderr is not None:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                logger.debug(f"MCP stderr: {line.decode(errors='replace').rstrip()[:500]}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"stderr 排空任務結束: {e}")
+
+    async def _send_request_stdio(
+        self,
+        request: Dict[str, Any],
+        timeout: float = 30.0,
+        log_timeout: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """
+        通過 stdio 發送請求並等待對應 ID 的響應
+
+        多個請求可以同時在途，響應由後台讀取任務按 ID 分發。
 
         Args:
-            request: JSON-RPC 請求對象
+            request: JSON-RPC 請求對象（必須包含 id）
+            timeout: 等待響應的超時秒數
+            log_timeout: 超時時是否記錄錯誤日誌（就緒探測時關閉）
 
         Returns:
             JSON-RPC 響應對象
         """
+        request_id = request['id']
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+
         try:
-            if not self.process or self.process.stdin is None:
+            if not self.process or self.process.stdin is None or self._reader_task is None or self._reader_task.done():
                 logger.error("❌ MCP 進程未運行")
                 return None
 
             # 發送請求
             request_json = json.dumps(request) + "\n"
             logger.debug(f"發送 stdio 請求: {request_json.strip()}")
-            self.process.stdin.write(request_json.encode())
-            await self.process.stdin.drain()
-
-            # 讀取響應
-            if self.process.stdout is None:
-                logger.error("❌ 無法讀取進程輸出")
-                return None
-
-            response_line = await asyncio.wait_for(
-                self.process.stdout.readline(),
-                timeout=30.0
-            )
-
-            if not response_line:
-                logger.error("❌ 未收到響應")
-                return None
+            async with self._write_lock:
+                self.process.stdin.write(request_json.encode())
+                await self.process.stdin.drain()
 
-            response = json.loads(response_line.decode())
+            # 等待讀取任務分發響應
+            response = await asyncio.wait_for(future, timeout=timeout)
             logger.debug(f"收到 stdio 響應: {json.dumps(response)[:200]}")
             return response
 
         except asyncio.TimeoutError:
-            logger.error("❌ stdio 請求超時")
+            if log_timeout:
+                logger.error(f"❌ stdio 請求超時 (id={request_id})")
             return None
         except Exception as e:
             logger.error(f"❌ stdio 請求失敗: {e}")
             return None
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _read_loop_stdio(self):
+        """後台讀取 stdio 輸出，按請求 ID 將響應路由到對應的 future"""
+        reason: BaseException = ConnectionError("MCP 進程輸出已關閉")
+        try:
+            while self.process and self.process.stdout is not None:
+                try:
+                    line = await self._read_message_stdio()
+                except MCPMessageTooLargeError as e:
+                    logger.error(f"❌ {e}")
+                    if e.request_id is not None:
+                        await self._dispatch_message_stdio({
+                            "jsonrpc": "2.0",
+                            "id": e.request_id,
+                            "error": {"code": -32000, "message": str(e)}
+                        })
+                    continue
+
+                if line is None:
+                    break
+                if not line.strip():
+                    continue
+
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.debug(f"忽略非 JSON 輸出: {line[:200]!r}")
+                    continue
+
+                # 批量響應是一個數組，逐條分發
+                for item in (message if isinstance(message, list) else [message]):
+                    if isinstance(item, dict):
+                        await self._dispatch_message_stdio(item)
+
+        except asyncio.CancelledError:
+            reason = ConnectionError("stdio 連接已關閉")
+            raise
+        except Exception as e:
+            logger.error(f"❌ stdio 讀取任務異常: {e}")
+            reason = e
+        finally:
+            # 讀取結束後，所有未完成的請求都不會再收到響應
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(reason)
+            self._pending.clear()
+
+    async def _read_message_stdio(self) -> Optional[str]:
+        """
+        從 stdout 讀取一條以換行分隔的完整消息
+
+        超過緩衝上限的長行按塊讀取並增量解碼，不會觸發 readline 的
+        LimitOverrunError；超過 max_message_size 的消息被丟棄到行尾後拋出
+        MCPMessageTooLargeError。
+
+        Returns:
+            消息文本，EOF 時返回 None
+        """
+        stdout = self.process.stdout
+        max_size = self.stdio_options["max_message_size"]
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        parts: List[str] = []
+        head = b''
+        size = 0
+
+        while True:
+            try:
+                chunk = await stdout.readuntil(b'\n')
+                complete = True
+            except asyncio.IncompleteReadError as e:
+                # EOF：最後一行可能沒有換行符
+                chunk = e.partial
+                complete = True
+                if not chunk and size == 0:
+                    return None
+            except asyncio.LimitOverrunError as e:
+                # 行長超過緩衝上限：先取出已緩衝的部分
+                chunk = await stdout.readexactly(e.consumed)
+                complete = False
+
+            if size == 0:
+                head = chunk[:256]
+            size += len(chunk)
+
+            if size <= max_size:
+                parts.append(decoder.decode(chunk, final=complete))
+            else:
+                parts.clear()  # 超限後只消費不保存
+
+            if complete:
+                break
+
+        if size > max_size:
+            match = re.search(rb'"id"\s*:\s*(\d+)', head)
+            raise MCPMessageTooLargeError(size, max_size, int(match.group(1)) if match else None)
+
+        return ''.join(parts)
+
+    async def _dispatch_message_stdio(self, message: Dict[str, Any]):
+        """處理從 stdio 讀到的一條 JSON-RPC 消息"""
+        if 'method' not in message:
+            # id 為 null 的錯誤表示整個批量請求被拒絕
+            if message.get('id') is None and 'error' in message and self._pending_batches:
+                batch_future = self._pending_batches.pop(0)
+                if not batch_future.done():
+                    batch_future.set_result(message)
+                return
+
+            # 響應：交給等待該 ID 的請求
+            future = self._pending.get(message.get('id'))
+            if future is not None and not future.done():
+                future.set_result(message)
+            else:
+                logger.debug(f"忽略無對應請求的響應: id={message.get('id')}")
+        elif 'id' in message:
+            # 服務器發起的請求：僅支持 ping，其餘回覆 method not found
+            if message['method'] == 'ping':
+                reply = {"jsonrpc": "2.0", "id": message['id'], "result": {}}
+            else:
+                reply = {
+                    "jsonrpc": "2.0",
+                    "id": message['id'],
+                    "error": {"code": -32601, "message": f"Method not found: {message['method']}"}
+                }
+            await self._send_notification_stdio(reply)
+        else:
+            self._handle_notification(message)
 
     async def _send_notification_stdio(self, notification: Dict[str, Any]) -> bool:
         """
@@ -266,8 +664,9 @@ class MCPClient:
             # 發送通知
             notification_json = json.dumps(notification) + "\n"
             logger.debug(f"發送 stdio 通知: {notification_json.strip()}")
-            self.process.stdin.write(notification_json.encode())
-            await self.process.stdin.drain()
+            async with self._write_lock:
+                self.process.stdin.write(notification_json.encode())
+                await self.process.stdin.drain()
 
             return True
 
@@ -277,15 +676,48 @@ class MCPClient:
 
     async def _close_stdio(self):
         """關閉 stdio 連接"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._reader_task = None
+
+        if self._stderr_task is not None:
+            self._stderr_task.cancel()
+            try:
+                await self._stderr_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._stderr_task = None
+
         if self.process:
             try:
-                self.process.terminate()
+                if self.process.returncode is None:
+                    self.process.terminate()
                 await asyncio.wait_for(self.process.wait(), timeout=5.0)
             except:
-                self.process.kill()
+                if self.process.returncode is None:
+                    self.process.kill()
             finally:
                 self.process = None
 
+    async def aclose(self):
+        """關閉客戶端，釋放 HTTP 連接池和 stdio 子進程"""
+        if not self._on_owner_loop():
+            return await run_on_loop(self._loop, self.aclose())
+
+        if self._http_client is not None:
+            try:
+                await self._http_client.aclose()
+            except Exception as e:
+                logger.warning(f"⚠️  關閉 HTTP 連接池失敗: {e}")
+            finally:
+                self._http_client = None
+
+        await self._close_stdio()
+
     async def list_tools(self) -> List[Dict[str, Any]]:
         """
         獲取可用的工具列表
@@ -293,6 +725,9 @@ class MCPClient:
         Returns:
             工具列表
         """
+        if not self._on_owner_loop():
+            return await run_on_loop(self._loop, self.list_tools())
+
         try:
             if self.transport_mode == 'http':
                 return await self._list_tools_http()
@@ -305,35 +740,28 @@ class MCPClient:
     async def _list_tools_http(self) -> List[Dict[str, Any]]:
         """通過 HTTP 獲取工具列表"""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                payload = {
-                    "jsonrpc": "2.0",
-                    "id": 2,
-                    "method": "tools/list",
-                    "params": {}
-                }
-
-                headers = {
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
-                }
-                if self.session_id:
-                    headers['MCP-Session-Id'] = self.session_id
+            client = self._get_http_client()
+            payload = {
+                "jsonrpc": "2.0",
+                "id": self._next_request_id(),
+                "method": "tools/list",
+                "params": {}
+            }
 
-                response = await client.post(
-                    f"{self.server_url}/mcp",
-                    json=payload,
-                    headers=headers
-                )
+            response = await client.post(
+                f"{self.server_url}/mcp",
+                json=payload,
+                headers=self._http_headers()
+            )
 
-                if response.status_code == 200:
-                    result = response.json()
-                    tools = result.get('result', {}).get('tools', [])
-                    logger.info(f"✅ 獲取到 {len(tools)} 個工具")
-                    return tools
-                else:
-                    logger.error(f"❌ 獲取工具列表失敗: {response.status_code}")
-                    return []
+            if response.status_code == 200:
+                result = response.json()
+                tools = result.get('result', {}).get('tools', [])
+                logger.info(f"✅ 獲取到 {len(tools)} 個工具")
+                return tools
+            else:
+                logger.error(f"❌ 獲取工具列表失敗: {response.status_code}")
+                return []
 
         except Exception as e:
             logger.error(f"❌ HTTP 獲取工具列表異常: {e}")
@@ -344,7 +772,7 @@ class MCPClient:
         try:
             request = {
                 "jsonrpc": "2.0",
-                "id": 2,
+                "id": self._next_request_id(),
                 "method": "tools/list",
                 "params": {}
             }
@@ -363,147 +791,669 @@ class MCPClient:
             logger.error(f"❌ stdio 獲取工具列表異常: {e}")
             return []
 
-    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    def _build_tool_call_request(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        構建 tools/call 請求
+
+        提供 progress_callback 時以請求 ID 作為 progressToken 註冊回調，
+        調用方需在請求結束後從 _progress_callbacks 中移除。
+        """
+        request_id = self._next_request_id()
+        params: Dict[str, Any] = {
+            "name": tool_name,
+            "arguments": arguments
+        }
+        if progress_callback is not None:
+            params["_meta"] = {"progressToken": request_id}
+            self._progress_callbacks[request_id] = progress_callback
+
+        return {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "method": "tools/call",
+            "params": params
+        }
+
+    def _create_breaker(self, failure_threshold: Optional[int] = None) -> CircuitBreaker:
+        """按配置創建熔斷器"""
+        return CircuitBreaker(
+            failure_threshold=failure_threshold or self.resilience_options["failure_threshold"],
+            recovery_timeout=self.resilience_options["recovery_timeout"],
+        )
+
+    def _get_tool_breaker(self, tool_name: str) -> CircuitBreaker:
+        """獲取指定工具的熔斷器"""
+        if tool_name not in self._tool_breakers:
+            self._tool_breakers[tool_name] = self._create_breaker()
+        return self._tool_breakers[tool_name]
+
+    def get_tool_timeout(self, tool_name: str) -> float:
+        """
+        計算工具調用的自適應超時
+
+        樣本足夠時取 p99 延遲 × timeout_multiplier，並限制在 [min_timeout, max_timeout]。
+
+        Args:
+            tool_name: 工具名稱
+
+        Returns:
+            超時秒數
+        """
+        options = self.resilience_options
+        if self.latency.count(tool_name) < options["min_samples"]:
+            return options["default_timeout"]
+
+        p99 = self.latency.percentile(tool_name, 99)
+        return min(options["max_timeout"], max(options["min_timeout"], p99 * options["timeout_multiplier"]))
+
+    @staticmethod
+    def _circuit_open_result(scope: str, tool_name: str, retry_after: float) -> Dict[str, Any]:
+        """熔斷時快速返回的結構化錯誤結果"""
+        target = "MCP 服務器" if scope == "server" else f"工具 {tool_name}"
+        return {
+            "content": [{
+                "type": "text",
+                "text": f"{target} 連續失敗，已暫時熔斷，約 {retry_after:.0f} 秒後重試"
+            }],
+            "structuredContent": {
+                "error": "circuit_open",
+                "scope": scope,
+                "tool": tool_name,
+                "retryAfter": round(retry_after, 1)
+            },
+            "isError": True
+        }
+
+    async def call_tool(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
         """
         調用工具
 
+        相同工具和規範化參數的併發調用只發出一個請求，其餘調用方等待同一結果；
+        單個等待方被取消不會取消共享的請求。
+
         Args:
             tool_name: 工具名稱
             arguments: 工具參數
+            progress_callback: 可選的進度回調，每收到一條 notifications/progress 調用一次
 
         Returns:
             工具執行結果
         """
+        if not self._on_owner_loop():
+            return await run_on_loop(self._loop, self.call_tool(tool_name, arguments, progress_callback))
+
+        key = canonical_call_key(tool_name, arguments)
+        callbacks = self._inflight_progress.setdefault(key, [])
+        if progress_callback is not None:
+            callbacks.append(progress_callback)
+
+        task = self._inflight_calls.get(key)
+        if task is None:
+            def fan_out_progress(params: Dict[str, Any]):
+                for callback in list(callbacks):
+                    callback(params)
+
+            task = asyncio.ensure_future(self._call_tool_guarded(tool_name, arguments, fan_out_progress))
+            self._register_inflight(key, task)
+        else:
+            logger.debug(f"🔗 合併相同的在途工具調用: {tool_name}")
+
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if progress_callback is not None and progress_callback in callbacks:
+                callbacks.remove(progress_callback)
+
+    def _register_inflight(self, key: str, future: asyncio.Future):
+        """登記在途調用，完成後自動移除，供相同調用合併"""
+        self._inflight_calls[key] = future
+
+        def on_done(finished: asyncio.Future):
+            if self._inflight_calls.get(key) is finished:
+                del self._inflight_calls[key]
+                self._inflight_progress.pop(key, None)
+        future.add_done_callback(on_done)
+
+    def _acquire_breakers(self, tool_name: str) -> Tuple[CircuitBreaker, Optional[Dict[str, Any]]]:
+        """
+        檢查服務器級和工具級熔斷器
+
+        Returns:
+            (工具熔斷器, 熔斷時的錯誤結果；允許調用時為 None)
+        """
+        tool_breaker = self._get_tool_breaker(tool_name)
+        if not self._server_breaker.allow():
+            return tool_breaker, self._circuit_open_result("server", tool_name, self._server_breaker.retry_after())
+        if not tool_breaker.allow():
+            self._server_breaker.release()
+            return tool_breaker, self._circuit_open_result("tool", tool_name, tool_breaker.retry_after())
+        return tool_breaker, None
+
+    @staticmethod
+    def _timeout_result(tool_name: str, timeout: float) -> Dict[str, Any]:
+        """工具調用超時的錯誤結果"""
+        return {
+            "content": [{"type": "text", "text": f"Error: 工具 {tool_name} 執行超時 ({timeout:.1f} 秒)"}],
+            "isError": True
+        }
+
+    async def _call_tool_guarded(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        實際發出工具調用
+
+        調用受服務器級和工具級熔斷器保護，並使用基於歷史延遲的自適應超時。
+        工具返回的 isError 結果（如代理不存在）只計入工具熔斷器；傳輸失敗、超時和
+        JSON-RPC 錯誤同時計入服務器熔斷器。
+        """
+        tool_breaker, blocked = self._acquire_breakers(tool_name)
+        if blocked is not None:
+            return blocked
+        return await self._call_tool_attempt(tool_name, arguments, tool_breaker, progress_callback)
+
+    async def _call_tool_attempt(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        tool_breaker: CircuitBreaker,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """在已通過熔斷器檢查後發出單個工具調用，並記錄延遲和結果"""
+        timeout = self.get_tool_timeout(tool_name)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        transport_failed = False
         try:
             if self.transport_mode == 'http':
-                return await self._call_tool_http(tool_name, arguments)
+                call = self._call_tool_http(tool_name, arguments, progress_callback)
             else:
-                return await self._call_tool_stdio(tool_name, arguments)
+                call = self._call_tool_stdio(tool_name, arguments, progress_callback)
+            result = await asyncio.wait_for(call, timeout=timeout)
+            self.latency.record(tool_name, loop.time() - started)
+        except asyncio.TimeoutError:
+            # 超時按截止時間記錄，讓自適應超時隨服務變慢而放寬
+            self.latency.record(tool_name, timeout)
+            logger.error(f"❌ 調用工具 {tool_name} 超時 ({timeout:.1f} 秒)")
+            transport_failed = True
+            result = self._timeout_result(tool_name, timeout)
         except Exception as e:
             logger.error(f"❌ 調用工具 {tool_name} 失敗: {e}")
-            return {
+            transport_failed = True
+            result = {
                 "content": [{"type": "text", "text": f"Error: {str(e)}"}],
                 "isError": True
             }
 
-    async def _call_tool_http(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
-        """通過 HTTP 調用工具"""
-        try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                payload = {
-                    "jsonrpc": "2.0",
-                    "id": 3,
-                    "method": "tools/call",
-                    "params": {
-                        "name": tool_name,
-                        "arguments": arguments
-                    }
-                }
+        self._record_outcome(tool_breaker, transport_failed, bool(result.get("isError")))
+        return result
 
-                headers = {
-                    "Content-Type": "application/json",
-                    "Accept": "application/json",
-                }
-                if self.session_id:
-                    headers['MCP-Session-Id'] = self.session_id
+    def _record_outcome(self, tool_breaker: CircuitBreaker, transport_failed: bool, is_error: bool):
+        """
+        把一次工具調用的結果記錄到熔斷器
 
-                logger.debug(f"🔧 調用工具: {tool_name} with args: {arguments}")
-                response = await client.post(
-                    f"{self.server_url}/mcp",
-                    json=payload,
-                    headers=headers,
-                    timeout=120.0  # 工具執行可能需要更長時間
-                )
+        Args:
+            tool_breaker: 該工具的熔斷器
+            transport_failed: 是否為傳輸失敗、超時或 JSON-RPC 錯誤
+            is_error: 結果是否帶 isError
+        """
+        if transport_failed:
+            tool_breaker.record_failure()
+            self._server_breaker.record_failure()
+            if self._server_breaker.state == CircuitBreaker.OPEN:
+                logger.warning(f"⚠️  MCP 服務器熔斷器已打開（連續失敗 {self._server_breaker.failures} 次）")
+            return
+
+        # 服務器正常返回了結果：工具級錯誤只計入工具熔斷器
+        self._server_breaker.record_success()
+        if is_error:
+            tool_breaker.record_failure()
+        else:
+            tool_breaker.record_success()
 
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.debug(f"✅ 工具執行成功")
-                    return result.get('result', {})
-                else:
-                    error_msg = f"HTTP {response.status_code}: {response.text}"
-                    logger.error(f"❌ 工具調用失敗: {error_msg}")
-                    return {
-                        "content": [{"type": "text", "text": error_msg}],
-                        "isError": True
-                    }
+    async def _iter_sse_messages(self, response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+        """
+        增量解析 text/event-stream 響應
 
-        except Exception as e:
-            error_msg = f"HTTP 異常: {str(e)}"
-            logger.error(f"❌ {error_msg}")
-            return {
-                "content": [{"type": "text", "text": error_msg}],
-                "isError": True
-            }
+        每遇到空行即派發一個事件，不等待整個響應體傳輸完成。
+
+        Yields:
+            事件 data 字段中的 JSON-RPC 消息
+        """
+        data_lines: List[str] = []
+        async for line in response.aiter_lines():
+            if line.startswith(':'):
+                continue  # SSE 註釋 / 心跳
+
+            if line:
+                field, _, value = line.partition(':')
+                if field == 'data':
+                    data_lines.append(value[1:] if value.startswith(' ') else value)
+                continue
+
+            if data_lines:
+                data = "\n".join(data_lines)
+                data_lines = []
+                try:
+                    yield json.loads(data)
+                except json.JSONDecodeError:
+                    logger.debug(f"忽略無法解析的 SSE 事件: {data[:200]}")
+
+        if data_lines:
+            try:
+                yield json.loads("\n".join(data_lines))
+            except json.JSONDecodeError:
+                pass
+
+    async def _call_tool_http(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        通過 HTTP 調用工具
+
+        同時接受 application/json 和 text/event-stream 響應；後者會邊接收邊解析，
+        進度通知在到達時即分發給 progress_callback。
 
-    async def _call_tool_stdio(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
-        """通過 stdio 調用工具"""
+        Raises:
+            MCPTransportError: 連接失敗、非 200 響應或 JSON-RPC 錯誤
+        """
+        payload = self._build_tool_call_request(tool_name, arguments, progress_callback)
         try:
-            request = {
-                "jsonrpc": "2.0",
-                "id": 3,
-                "method": "tools/call",
-                "params": {
-                    "name": tool_name,
-                    "arguments": arguments
-                }
-            }
+            client = self._get_http_client()
+
+            logger.debug(f"🔧 調用工具: {tool_name} with args: {arguments}")
+            async with client.stream(
+                "POST",
+                f"{self.server_url}/mcp",
+                json=payload,
+                headers=self._http_headers(streaming=True),
+                timeout=httpx.Timeout(
+                    self.http_options["tool_timeout"],  # 工具執行可能需要更長時間
+                    connect=self.http_options["connect_timeout"],
+                ),
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise MCPTransportError(f"HTTP {response.status_code}: {response.text}")
+
+                result = None
+                if response.headers.get('content-type', '').startswith('text/event-stream'):
+                    async for message in self._iter_sse_messages(response):
+                        if 'method' in message:
+                            self._handle_notification(message)
+                        elif message.get('id') == payload['id']:
+                            result = message
+                            break
+                else:
+                    await response.aread()
+                    result = response.json()
+
+            if result and 'result' in result:
+                logger.debug(f"✅ 工具執行成功")
+                return result.get('result', {})
+            raise MCPTransportError(f"工具調用失敗: {(result or {}).get('error', '未收到響應')}")
+
+        except httpx.HTTPError as e:
+            raise MCPTransportError(f"HTTP 異常: {str(e)}") from e
+        finally:
+            self._progress_callbacks.pop(payload['id'], None)
+
+    async def _call_tool_stdio(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        通過 stdio 調用工具
 
+        Raises:
+            MCPTransportError: 進程不可用、未收到響應或 JSON-RPC 錯誤
+        """
+        request = self._build_tool_call_request(tool_name, arguments, progress_callback)
+        try:
             logger.debug(f"🔧 stdio 調用工具: {tool_name} with args: {arguments}")
-            response = await self._send_request_stdio(request)
+            # 實際截止時間由 call_tool 的自適應超時控制
+            response = await self._send_request_stdio(request, timeout=self.resilience_options["max_timeout"])
 
             if response and 'result' in response:
                 logger.debug(f"✅ stdio 工具執行成功")
                 return response.get('result', {})
-            else:
-                error_msg = f"stdio 工具調用失敗: {response}"
-                logger.error(f"❌ {error_msg}")
-                return {
-                    "content": [{"type": "text", "text": error_msg}],
-                    "isError": True
-                }
+            raise MCPTransportError(f"stdio 工具調用失敗: {response}")
+        finally:
+            self._progress_callbacks.pop(request['id'], None)
+
+    @staticmethod
+    def _response_to_tool_result(response: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """將 tools/call 的 JSON-RPC 響應轉換為工具結果"""
+        if response and 'result' in response:
+            return response.get('result', {})
+
+        error = (response or {}).get('error', {})
+        error_msg = f"工具調用失敗: {error.get('message', response)}"
+        return {
+            "content": [{"type": "text", "text": error_msg}],
+            "isError": True
+        }
+
+    async def call_tools_batch(self, calls: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        以 JSON-RPC 批量請求一次性調用多個工具
+
+        每個調用與 call_tool 一樣受熔斷器保護並記錄延遲：已熔斷的調用直接返回錯誤結果，
+        與在途調用相同的調用等待同一結果，其餘調用合併為一個批量請求，超時取其中最長的
+        自適應超時。服務器不支持批量請求或批量請求失敗時，退回為併發的單個請求。
+
+        Args:
+            calls: [(工具名稱, 工具參數), ...]
+
+        Returns:
+            與 calls 順序一致的工具執行結果列表
+        """
+        if not calls:
+            return []
+        if not self._on_owner_loop():
+            return await run_on_loop(self._loop, self.call_tools_batch(calls))
+
+        loop = asyncio.get_running_loop()
+        shared: List[asyncio.Future] = []
+        entries: Dict[str, Tuple[str, Dict[str, Any], CircuitBreaker, asyncio.Future]] = {}
+        for tool_name, arguments in calls:
+            key = canonical_call_key(tool_name, arguments)
+            future = self._inflight_calls.get(key)
+            if future is None:
+                future = loop.create_future()
+                tool_breaker, blocked = self._acquire_breakers(tool_name)
+                if blocked is not None:
+                    future.set_result(blocked)
+                else:
+                    entries[key] = (tool_name, arguments, tool_breaker, future)
+                    self._register_inflight(key, future)
+            shared.append(future)
 
+        if entries:
+            try:
+                await self._run_batch(list(entries.values()))
+            finally:
+                # 發送失敗也不能讓等待同一調用的其他調用方永遠掛起
+                for _, _, tool_breaker, future in entries.values():
+                    if not future.done():
+                        tool_breaker.release()
+                        self._server_breaker.release()
+                        future.cancel()
+
+        return list(await asyncio.gather(*(asyncio.shield(future) for future in shared)))
+
+    async def _run_batch(self, entries: List[Tuple[str, Dict[str, Any], CircuitBreaker, asyncio.Future]]):
+        """發送一個批量請求並把每條響應寫入對應的 future"""
+        async def call_each():
+            results = await asyncio.gather(*(
+                self._call_tool_attempt(tool_name, arguments, tool_breaker)
+                for tool_name, arguments, tool_breaker, _ in entries
+            ))
+            for (_, _, _, future), result in zip(entries, results):
+                future.set_result(result)
+
+        if not self._batch_supported or len(entries) == 1:
+            await call_each()
+            return
+
+        requests = [self._build_tool_call_request(tool_name, arguments) for tool_name, arguments, _, _ in entries]
+        timeout = max(self.get_tool_timeout(tool_name) for tool_name, _, _, _ in entries)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        logger.debug(f"🔧 批量調用 {len(entries)} 個工具: {[entry[0] for entry in entries]}")
+        try:
+            if self.transport_mode == 'http':
+                responses = await asyncio.wait_for(self._send_batch_http(requests), timeout=timeout)
+            else:
+                responses = await self._send_batch_stdio(requests, timeout=timeout)
+        except asyncio.TimeoutError:
+            responses = {}
         except Exception as e:
-            error_msg = f"stdio 異常: {str(e)}"
-            logger.error(f"❌ {error_msg}")
+            logger.warning(f"⚠️  批量請求失敗: {e}，改用併發請求")
+            responses = None
+
+        if responses is None:
+            logger.debug(f"以併發單個請求調用 {len(entries)} 個工具")
+            await call_each()
+            return
+
+        elapsed = loop.time() - started
+        for request, (tool_name, _, tool_breaker, future) in zip(requests, entries):
+            response = responses.get(request['id'])
+            if response is None:
+                # 截止時間內未收到響應，按超時處理
+                self.latency.record(tool_name, timeout)
+                logger.error(f"❌ 批量調用工具 {tool_name} 超時 ({timeout:.1f} 秒)")
+                result = self._timeout_result(tool_name, timeout)
+                self._record_outcome(tool_breaker, True, True)
+            else:
+                self.latency.record(tool_name, elapsed)
+                result = self._response_to_tool_result(response)
+                self._record_outcome(tool_breaker, 'result' not in response, bool(result.get("isError")))
+            future.set_result(result)
+
+    async def _send_batch_http(self, requests: List[Dict[str, Any]]) -> Optional[Dict[int, Dict[str, Any]]]:
+        """
+        通過 HTTP 發送批量請求
+
+        只有 HTTP 400 或 JSON-RPC 解析錯誤 / 無效請求才視為服務器不支持批量請求；
+        其他非 200 響應（如暫時性 5xx）作為可重試的失敗拋出，不會關閉批量請求。
+
+        Returns:
+            {請求 ID: 響應}，服務器拒絕批量請求時返回 None
+
+        Raises:
+            MCPTransportError: 連接失敗或其他非 200 響應
+        """
+        client = self._get_http_client()
+        try:
+            response = await client.post(
+                f"{self.server_url}/mcp",
+                json=requests,
+                headers=self._http_headers(),
+                timeout=httpx.Timeout(
+                    self.http_options["tool_timeout"],
+                    connect=self.http_options["connect_timeout"],
+                ),
+            )
+        except httpx.HTTPError as e:
+            raise MCPTransportError(f"HTTP 異常: {str(e)}") from e
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+
+        error = body.get('error') if isinstance(body, dict) else None
+        rejected = response.status_code == 400 or (
+            isinstance(error, dict) and error.get('code') in self.BATCH_REJECTION_CODES
+        )
+        if rejected:
+            logger.info(f"ℹ️  MCP 服務器不支持批量請求 (HTTP {response.status_code})，改用併發請求")
+            self._batch_supported = False
+            return None
+
+        if response.status_code != 200 or not isinstance(body, list):
+            raise MCPTransportError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+        return {item.get('id'): item for item in body if isinstance(item, dict)}
+
+    async def _send_batch_stdio(
+        self,
+        requests: List[Dict[str, Any]],
+        timeout: float
+    ) -> Optional[Dict[int, Dict[str, Any]]]:
+        """
+        通過 stdio 發送批量請求
+
+        Args:
+            requests: JSON-RPC 請求列表
+            timeout: 等待所有響應的超時秒數
+
+        Returns:
+            {請求 ID: 響應}，服務器拒絕批量請求時返回 None；超時的請求不在結果中
+
+        Raises:
+            MCPTransportError: MCP 進程未運行
+        """
+        if not self.process or self.process.stdin is None:
+            raise MCPTransportError("MCP 進程未運行")
+
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for request in requests:
+            futures[request['id']] = loop.create_future()
+            self._pending[request['id']] = futures[request['id']]
+        rejected = loop.create_future()
+        self._pending_batches.append(rejected)
+
+        try:
+            batch_json = json.dumps(requests) + "\n"
+            logger.debug(f"發送 stdio 批量請求: {len(requests)} 條")
+            async with self._write_lock:
+                self.process.stdin.write(batch_json.encode())
+                await self.process.stdin.drain()
+
+            deadline = loop.time() + timeout
+            waiting = set(futures.values())
+            while waiting and loop.time() < deadline:
+                done, waiting = await asyncio.wait(
+                    waiting | {rejected},
+                    timeout=deadline - loop.time(),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if rejected in done:
+                    logger.info(f"ℹ️  MCP 服務器不支持批量請求: {rejected.result().get('error')}，改用併發請求")
+                    self._batch_supported = False
+                    return None
+                waiting.discard(rejected)
+
+            # 超時的請求保持缺失，轉換為錯誤結果
             return {
-                "content": [{"type": "text", "text": error_msg}],
-                "isError": True
+                request_id: future.result()
+                for request_id, future in futures.items()
+                if future.done() and not future.cancelled() and future.exception() is None
             }
 
+        finally:
+            if rejected in self._pending_batches:
+                self._pending_batches.remove(rejected)
+            for request_id in futures:
+                self._pending.pop(request_id, None)
+
 
 class MCPClientManager:
     """MCP 客戶端管理器，管理多個 MCP 服務器連接"""
 
+    # 單個服務器的默認超時（秒），可在服務器配置的 "timeout" 字段中覆蓋
+    DEFAULT_CONNECT_TIMEOUT = 45.0
+    DEFAULT_LIST_TOOLS_TIMEOUT = 30.0
+
     def __init__(self):
         self.clients: Dict[str, MCPClient] = {}
-
-    async def add_server(self, name: str, server_config: Dict[str, Any]) -> bool:
+        self.timings: Dict[str, Dict[str, float]] = {}  # {server_name: {階段: 毫秒}}
+
+    def _record_timing(self, name: str, phase: str, started: float):
+        """記錄某個服務器某個階段的耗時"""
+        elapsed_ms = (asyncio.get_running_loop().time() - started) * 1000
+        self.timings.setdefault(name, {})[phase] = elapsed_ms
+        return elapsed_ms
+
+    async def add_server(
+        self,
+        name: str,
+        server_config: Dict[str, Any],
+        timeout: Optional[float] = None
+    ) -> bool:
         """
         添加 MCP 服務器
 
         Args:
             name: 服務器名稱
-            server_config: 服務器配置
+            server_config: 服務器配置（stdio 模式下 pool_size > 1 時啟動進程池，HTTP 模式忽略 pool_size）
+            timeout: 連接超時秒數（默認使用配置中的 timeout 或 DEFAULT_CONNECT_TIMEOUT）
 
         Returns:
             是否添加成功
         """
+        timeout = timeout or server_config.get('timeout', self.DEFAULT_CONNECT_TIMEOUT)
+        started = asyncio.get_running_loop().time()
+        client = None
+
         try:
-            client = MCPClient(server_config)
-            success = await client.connect()
+            pool_size = int(server_config.get('pool_size', 1))
+            if pool_size > 1 and MCPClient.transport_for(server_config) == 'http':
+                # HTTP 模式已共用 httpx 連接池，進程池只適用於 stdio
+                logger.warning(f"⚠️  MCP 服務器 '{name}' 使用 HTTP 模式，忽略 pool_size={pool_size}")
+                pool_size = 1
+
+            if pool_size > 1:
+                from .pool import MCPServerPool
+                client = MCPServerPool(server_config, pool_size)
+            else:
+                client = MCPClient(server_config)
+            success = await asyncio.wait_for(client.connect(), timeout=timeout)
+            elapsed_ms = self._record_timing(name, 'connect', started)
 
             if success:
                 self.clients[name] = client
-                logger.info(f"✅ MCP 服務器 '{name}' 連接成功")
+                logger.info(f"✅ MCP 服務器 '{name}' 連接成功 ({elapsed_ms:.0f} ms)")
                 return True
             else:
-                logger.warning(f"⚠️  MCP 服務器 '{name}' 連接失敗")
+                logger.warning(f"⚠️  MCP 服務器 '{name}' 連接失敗 ({elapsed_ms:.0f} ms)")
+                await client.aclose()
                 return False
 
+        except asyncio.TimeoutError:
+            self._record_timing(name, 'connect', started)
+            logger.error(f"❌ MCP 服務器 '{name}' 連接超時 ({timeout} 秒)")
+            if client is not None:
+                await client.aclose()
+            return False
         except Exception as e:
             logger.error(f"❌ 添加 MCP 服務器 '{name}' 失敗: {e}")
+            if client is not None:
+                await client.aclose()
             return False
 
+    async def add_servers(self, servers: Dict[str, Dict[str, Any]]) -> Dict[str, bool]:
+        """
+        併發添加多個 MCP 服務器
+
+        每個服務器使用各自的超時，慢或無響應的服務器不會阻塞其他服務器。
+
+        Args:
+            servers: {服務器名稱: 服務器配置}
+
+        Returns:
+            {服務器名稱: 是否添加成功}
+        """
+        names = list(servers.keys())
+        results = await asyncio.gather(
+            *(self.add_server(name, servers[name]) for name in names)
+        )
+        return dict(zip(names, results))
+
     def get_client(self, name: str) -> Optional[MCPClient]:
         """獲取指定的 MCP 客戶端"""
         return self.clients.get(name)
@@ -512,15 +1462,38 @@ class MCPClientManager:
         """獲取所有 MCP 客戶端"""
         return self.clients
 
-    async def list_all_tools(self) -> Dict[str, List[Dict[str, Any]]]:
+    async def list_all_tools(self, timeout: Optional[float] = None) -> Dict[str, List[Dict[str, Any]]]:
         """
-        獲取所有服務器的工具列表
+        併發獲取所有服務器的工具列表
+
+        Args:
+            timeout: 每個服務器的超時秒數（默認 DEFAULT_LIST_TOOLS_TIMEOUT）
 
         Returns:
-            {server_name: [tools]}
+            {server_name: [tools]}，超時或失敗的服務器返回空列表
         """
-        all_tools = {}
-        for name, client in self.clients.items():
-            tools = await client.list_tools()
-            all_tools[name] = tools
-        return all_tools
+        timeout = timeout or self.DEFAULT_LIST_TOOLS_TIMEOUT
+
+        async def list_one(name: str, client: MCPClient) -> List[Dict[str, Any]]:
+            started = asyncio.get_running_loop().time()
+            try:
+                return await asyncio.wait_for(client.list_tools(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"❌ MCP 服務器 '{name}' 獲取工具列表超時 ({timeout} 秒)")
+                return []
+            finally:
+                self._record_timing(name, 'list_tools', started)
+
+        names = list(self.clients.keys())
+        results = await asyncio.gather(*(list_one(name, self.clients[name]) for name in names))
+        return dict(zip(names, results))
+
+    async def close_all(self):
+        """關閉所有 MCP 客戶端的連接"""
+        for name, client in list(self.clients.items()):
+            try:
+                await client.aclose()
+                logger.debug(f"🔌 已關閉 MCP 服務器 '{name}' 的連接")
+            except Exception as e:
+                logger.warning(f"⚠️  關閉 MCP 服務器 '{name}' 失敗: {e}")
+        self.clients.clear()
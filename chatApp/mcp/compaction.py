@@ -0,0 +1,372 @@
+"""
+Wazuh 工具結果壓縮
+在工具結果交給 LLM 之前按 token 預算壓縮，完整結果可通過句柄取回
+"""
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+from loguru import logger
+
+from .cache import canonical_call_key
+
+
+# 中日韓字符大致按每字 1 token 計算，其餘按每 4 個字符 1 token 估算
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+# "Key: Value" 形式的字段行（Wazuh MCP 服務器的文本輸出格式）
+_FIELD_RE = re.compile(r"^\s*[-*]?\s*([A-Za-z][\w .()/-]{0,39}?|[\u4e00-\u9fff][^:：\n]{0,19}?)\s*[:：]\s*(.*)$")
+_BLOCK_SPLIT_RE = re.compile(r"\n\s*\n")
+
+# 用於排序的字段名（小寫）及其取值的嚴重程度
+RANK_FIELDS = ("severity", "level", "rule level", "alert level", "嚴重性", "級別")
+SEVERITY_ORDER = {
+    "critical": 4, "high": 3, "medium": 2, "moderate": 2, "low": 1, "none": 0,
+    "error": 3, "warning": 2, "warn": 2, "info": 1, "debug": 0,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 token 數
+
+    Args:
+        text: 文本
+
+    Returns:
+        估算的 token 數
+    """
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def parse_records(text: str) -> Tuple[List[str], List[Dict[str, str]]]:
+    """
+    把 "Key: Value" 形式的文本解析為記錄
+
+    記錄之間以空行分隔；不含字段的行視為上一字段的續行。
+
+    Args:
+        text: 工具返回的文本
+
+    Returns:
+        (無法解析為記錄的文本塊, 記錄列表)
+    """
+    preamble: List[str] = []
+    records: List[Dict[str, str]] = []
+
+    for block in _BLOCK_SPLIT_RE.split(text.strip()):
+        record: Dict[str, str] = {}
+        last_key = None
+        for line in block.splitlines():
+            match = _FIELD_RE.match(line)
+            if match:
+                last_key = match.group(1).strip()
+                record[last_key] = match.group(2).strip()
+            elif last_key is not None and line.strip():
+                record[last_key] = f"{record[last_key]} {line.strip()}".strip()
+
+        if len(record) >= 2:
+            records.append(record)
+        elif block.strip():
+            preamble.append(block.strip())
+
+    return preamble, records
+
+
+def record_field(record: Dict[str, str], *names: str) -> Optional[str]:
+    """
+    按字段名（不區分大小寫）讀取記錄中第一個非空的值
+
+    Args:
+        record: parse_records 返回的記錄
+        *names: 依次嘗試的小寫字段名
+
+    Returns:
+        字段值，都不存在時返回 None
+    """
+    lowered = {key.lower(): value for key, value in record.items()}
+    for name in names:
+        value = lowered.get(name)
+        if value:
+            return value
+    return None
+
+
+def _severity_value(value: str) -> float:
+    """把嚴重性或級別字段轉換為可比較的數值"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for word in re.findall(r"[A-Za-z]+|\d+(?:\.\d+)?", value):
+        lowered = word.lower()
+        if lowered in SEVERITY_ORDER:
+            return SEVERITY_ORDER[lowered]
+        try:
+            return float(word)
+        except ValueError:
+            continue
+    return -1
+
+
+def _find_rank_field(records: List[Dict[str, str]]) -> Optional[str]:
+    """找出用於排序的嚴重性或級別字段"""
+    for record in records:
+        for key in record:
+            if key.lower() in RANK_FIELDS:
+                return key
+    return None
+
+
+def _cell(value: str, max_chars: int) -> str:
+    """規範化表格單元格：合併空白、轉義豎線並截斷過長的值"""
+    value = " ".join(value.split()).replace("|", "/")
+    return value if len(value) <= max_chars else value[:max_chars - 1] + "…"
+
+
+class ResultStore:
+    """按句柄保存完整工具結果的 LRU 存儲"""
+
+    def __init__(self, max_entries: int = 64):
+        """
+        初始化存儲
+
+        Args:
+            max_entries: 最多保留的結果數，超出時淘汰最久未使用的結果
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 同步工具可能從其他線程讀取句柄
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_handle(tool_name: str, arguments: Dict[str, Any], text: str) -> str:
+        """生成句柄：相同調用的相同結果得到相同句柄"""
+        digest = hashlib.sha1(f"{canonical_call_key(tool_name, arguments)}\n{text}".encode("utf-8")).hexdigest()
+        return f"res-{digest[:12]}"
+
+    def put(self, tool_name: str, arguments: Dict[str, Any], text: str) -> str:
+        """
+        保存完整結果
+
+        Returns:
+            結果句柄
+        """
+        handle = self.make_handle(tool_name, arguments, text)
+        with self._lock:
+            self._entries[handle] = {"tool": tool_name, "arguments": dict(arguments), "text": text}
+            self._entries.move_to_end(handle)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return handle
+
+    def get(self, handle: str) -> Optional[Dict[str, Any]]:
+        """
+        讀取完整結果
+
+        Returns:
+            {"tool", "arguments", "text"}，句柄不存在或已淘汰時返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None:
+                self._entries.move_to_end(handle)
+            return entry
+
+    def records(self, handle: str) -> Optional[List[Dict[str, str]]]:
+        """
+        讀取完整結果解析後的記錄（解析結果隨條目緩存）
+
+        無法解析為記錄的文本按空行分塊，每塊作為 {"text": 塊內容} 返回。
+
+        Returns:
+            記錄列表，句柄不存在或已淘汰時返回 None
+        """
+        entry = self.get(handle)
+        if entry is None:
+            return None
+        if "records" not in entry:
+            preamble, records = parse_records(entry["text"])
+            entry["records"] = records if records else [{"text": block} for block in preamble]
+        return entry["records"]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ResultCompactor:
+    """
+    按 token 預算壓縮工具結果
+
+    結構化結果會去重、按嚴重性排序並渲染為緊湊表格，超出預算的行只保留匯總；
+    無法解析的結果按行截斷。被壓縮的完整結果保存在 ResultStore 中。
+    """
+
+    MAX_CELL_CHARS = 80      # 表格單元格最大字符數
+    SUMMARY_RESERVE = 80     # 為省略匯總和句柄預留的 token 數
+
+    def __init__(
+        self,
+        token_budgets: Optional[Dict[str, int]] = None,
+        default_budget: int = 2000,
+        store: Optional[ResultStore] = None,
+        max_rows: int = 50
+    ):
+        """
+        初始化壓縮器
+
+        Args:
+            token_budgets: 每個工具的 token 預算，<= 0 表示不壓縮
+            default_budget: 未列出工具的 token 預算
+            store: 完整結果存儲（默認創建新的存儲）
+            max_rows: 表格最多顯示的行數
+        """
+        self.token_budgets = token_budgets or {}
+        self.default_budget = default_budget
+        self.store = store if store is not None else ResultStore()
+        self.max_rows = max_rows
+
+    def budget_for(self, tool_name: str) -> int:
+        """獲取工具的 token 預算"""
+        return self.token_budgets.get(tool_name, self.default_budget)
+
+    def compact(self, tool_name: str, arguments: Dict[str, Any], text: str) -> str:
+        """
+        壓縮工具結果
+
+        Args:
+            tool_name: 工具名稱
+            arguments: 工具參數
+            text: 工具返回的完整文本
+
+        Returns:
+            未超出預算時原樣返回，否則返回壓縮後的文本（附帶完整結果句柄）
+        """
+        budget = self.budget_for(tool_name)
+        original_tokens = estimate_tokens(text)
+        if budget <= 0 or original_tokens <= budget:
+            return text
+
+        handle = self.store.put(tool_name, arguments, text)
+        preamble, records = parse_records(text)
+
+        if len(records) >= 2:
+            compacted = self._compact_records(tool_name, preamble, records, budget)
+        else:
+            compacted = self._truncate_lines(text, budget)
+
+        logger.debug(f"🗜️  壓縮 {tool_name} 結果: ~{original_tokens} → ~{estimate_tokens(compacted)} tokens ({handle})")
+        return f"{compacted}\n完整結果句柄: {handle}（可用 get_full_tool_result 分段讀取）"
+
+    def _compact_records(
+        self,
+        tool_name: str,
+        preamble: List[str],
+        records: List[Dict[str, str]],
+        budget: int
+    ) -> str:
+        """去重、排序並在預算內渲染記錄表格"""
+        # 去重：完全相同的記錄合併為一行並計數
+        counts: "OrderedDict[Tuple[Tuple[str, str], ...], int]" = OrderedDict()
+        for record in records:
+            key = tuple(record.items())
+            counts[key] = counts.get(key, 0) + 1
+        unique = [(dict(key), count) for key, count in counts.items()]
+
+        rank_field = _find_rank_field(records)
+        if rank_field:
+            # sorted 是穩定排序，同級記錄保持服務器返回的順序
+            unique.sort(key=lambda item: _severity_value(item[0].get(rank_field, "")), reverse=True)
+
+        columns: List[str] = []
+        for record, _ in unique:
+            for key in record:
+                if key not in columns:
+                    columns.append(key)
+
+        # 所有記錄取值相同的字段只在表頭顯示一次
+        common = {
+            column: unique[0][0][column]
+            for column in columns
+            if all(record.get(column) == unique[0][0].get(column) for record, _ in unique)
+        }
+        varying = [column for column in columns if column not in common]
+        has_duplicates = any(count > 1 for _, count in unique)
+
+        header = f"[{tool_name}] 共 {len(records)} 條記錄"
+        if has_duplicates:
+            header += f"（去重後 {len(unique)} 條）"
+        if rank_field:
+            header += f"，按 {rank_field} 從高到低排列"
+        lines = [header]
+        lines.extend(_cell(block, 200) for block in preamble[:2])
+        if common:
+            lines.append("共同字段: " + "; ".join(f"{k}={_cell(v, self.MAX_CELL_CHARS)}" for k, v in common.items()))
+
+        table_columns = varying + (["重複"] if has_duplicates else [])
+        lines.append("| " + " | ".join(table_columns) + " |")
+        lines.append("|" + "---|" * len(table_columns))
+
+        used = estimate_tokens("\n".join(lines))
+        shown = 0
+        for record, count in unique:
+            if shown >= self.max_rows:
+                break
+            cells = [_cell(record.get(column, ""), self.MAX_CELL_CHARS) for column in varying]
+            if has_duplicates:
+                cells.append(f"×{count}")
+            row = "| " + " | ".join(cells) + " |"
+            row_tokens = estimate_tokens(row) + 1
+            if shown > 0 and used + row_tokens > budget - self.SUMMARY_RESERVE:
+                break
+            lines.append(row)
+            used += row_tokens
+            shown += 1
+
+        dropped = unique[shown:]
+        if dropped:
+            lines.append(self._dropped_summary(dropped, rank_field, varying))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _dropped_summary(
+        dropped: List[Tuple[Dict[str, str], int]],
+        rank_field: Optional[str],
+        columns: List[str]
+    ) -> str:
+        """匯總被省略的記錄：按嚴重性字段或第一個低基數字段統計分布"""
+        total = sum(count for _, count in dropped)
+        summary = f"已省略 {total} 條記錄"
+
+        group_field = rank_field
+        if group_field is None:
+            for column in columns:
+                if len({record.get(column) for record, _ in dropped}) <= 8:
+                    group_field = column
+                    break
+
+        if group_field is not None:
+            distribution: Counter = Counter()
+            for record, count in dropped:
+                distribution[_cell(record.get(group_field, "(無)"), 30)] += count
+            summary += f"（{group_field}: " + ", ".join(f"{value} {n}" for value, n in distribution.most_common(8)) + "）"
+        return summary
+
+    @staticmethod
+    def _truncate_lines(text: str, budget: int) -> str:
+        """按行截斷無法解析為記錄的文本"""
+        lines = text.splitlines()
+        kept: List[str] = []
+        used = 0
+        for line in lines:
+            line_tokens = estimate_tokens(line) + 1
+            if used + line_tokens > budget - ResultCompactor.SUMMARY_RESERVE:
+                if not kept:
+                    # 單行就超出預算時按字符截斷
+                    kept.append(line[:max(budget - ResultCompactor.SUMMARY_RESERVE, 1) * 2])
+                break
+            kept.append(line)
+            used += line_tokens
+        kept.append(f"…（已截斷，顯示 {len(kept)}/{len(lines)} 行）")
+        return "\n".join(kept)
@@ -0,0 +1,273 @@
+"""
+跨代理關聯索引
+從已採集的進程、端口和漏洞結果建立倒排索引：遠程 IP、進程名、命令行哈希、CVE -> 代理集合
+"""
+import hashlib
+import re
+import threading
+from collections import Counter
+from typing import Dict, Any, Optional, List, Set, Tuple
+from loguru import logger
+
+from .cache import canonical_call_key
+from .compaction import parse_records, record_field
+
+
+FIELDS = ("ip", "process", "cmdline", "cve")
+
+# 工具名 -> 可提取的索引字段
+INDEXED_TOOLS = {
+    "get_wazuh_agent_processes": ("process", "cmdline"),
+    "get_wazuh_agent_ports": ("ip", "process"),
+    "get_wazuh_vulnerability_summary": ("cve",),
+    "get_wazuh_critical_vulnerabilities": ("cve",),
+}
+
+# 不具備關聯意義的地址
+IGNORED_IPS = {"", "0.0.0.0", "::", "127.0.0.1", "::1", "*"}
+
+_CVE_RE = re.compile(r"CVE-\d{4}-\d{4,}", re.IGNORECASE)
+_PID_SUFFIX_RE = re.compile(r"\s*\(.*?\)\s*$")
+
+
+def cmdline_hash(command: str) -> str:
+    """
+    計算命令行哈希（合併空白後取 blake2b 前 8 字節）
+
+    Args:
+        command: 進程命令行
+
+    Returns:
+        16 位十六進制字符串
+    """
+    normalized = " ".join(command.split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _host(address: Optional[str]) -> Optional[str]:
+    """從 "ip:port" 或 "[ipv6]:port" 中取出主機部分"""
+    if not address:
+        return None
+    address = address.strip()
+    if address.startswith("["):
+        return address[1:address.find("]")] if "]" in address else address[1:]
+    if address.count(":") == 1:
+        return address.split(":")[0]
+    return address
+
+
+def extract_keys(tool_name: str, records: List[Dict[str, str]]) -> Set[Tuple[str, str]]:
+    """
+    從工具結果記錄中提取索引鍵
+
+    Returns:
+        {(字段, 值), ...}
+    """
+    fields = INDEXED_TOOLS.get(tool_name, ())
+    keys: Set[Tuple[str, str]] = set()
+    for record in records:
+        if "process" in fields:
+            name = record_field(record, "name", "process name", "process")
+            if name:
+                name = _PID_SUFFIX_RE.sub("", name).strip().lower()
+                if name:
+                    keys.add(("process", name))
+        if "cmdline" in fields:
+            command = record_field(record, "command", "cmd", "cmdline", "command line")
+            if command:
+                keys.add(("cmdline", cmdline_hash(command)))
+        if "ip" in fields:
+            host = _host(record_field(record, "remote", "remote address", "remote ip"))
+            if host and host not in IGNORED_IPS:
+                keys.add(("ip", host))
+        if "cve" in fields:
+            for value in record.values():
+                for cve in _CVE_RE.findall(value):
+                    keys.add(("cve", cve.upper()))
+    return keys
+
+
+class CorrelationIndex:
+    """
+    倒排索引
+
+    代理 ID 映射為連續整數，每個鍵的倒排表是一個 Python 整數位圖（第 i 位表示第 i 個代理），
+    求交集、並集都是整數位運算。同一代理同一來源（工具 + 非代理參數）重新採集時替換舊的鍵。
+    """
+
+    def __init__(self):
+        self._agents: List[str] = []
+        self._agent_codes: Dict[str, int] = {}
+        self._postings: Dict[Tuple[str, str], int] = {}
+        self._contributions: Dict[Tuple[int, str], Set[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def _agent_code(self, agent_id: str) -> int:
+        code = self._agent_codes.get(agent_id)
+        if code is None:
+            code = self._agent_codes[agent_id] = len(self._agents)
+            self._agents.append(agent_id)
+        return code
+
+    def _decode(self, bits: int) -> List[str]:
+        """把位圖解碼為代理 ID 列表"""
+        agents = []
+        while bits:
+            lowest = bits & -bits
+            agents.append(self._agents[lowest.bit_length() - 1])
+            bits ^= lowest
+        return sorted(agents)
+
+    def observe(self, tool_name: str, arguments: Dict[str, Any], result: Dict[str, Any]):
+        """
+        工具結果回調：索引可關聯的結果
+
+        Args:
+            tool_name: 工具名稱
+            arguments: 工具參數（需包含 agent_id）
+            result: MCP 工具結果
+        """
+        agent_id = arguments.get("agent_id")
+        if tool_name not in INDEXED_TOOLS or not agent_id or result.get("isError"):
+            return
+
+        texts = [
+            item.get("text", "") for item in result.get("content", [])
+            if isinstance(item, dict) and item.get("type") == "text"
+        ]
+        self.add(tool_name, arguments, parse_records("\n\n".join(texts))[1])
+
+    def add(self, tool_name: str, arguments: Dict[str, Any], records: List[Dict[str, str]]) -> int:
+        """
+        用一次採集結果替換該代理在同一來源下的索引鍵（offset 大於 0 的分頁結果則追加）
+
+        Args:
+            tool_name: 工具名稱
+            arguments: 工具參數（需包含 agent_id）
+            records: 解析後的記錄
+
+        Returns:
+            該來源當前的鍵數
+        """
+        keys = extract_keys(tool_name, records)
+        source = canonical_call_key(
+            tool_name, {k: v for k, v in arguments.items() if k not in ("agent_id", "limit", "offset")}
+        )
+        with self._lock:
+            code = self._agent_code(str(arguments["agent_id"]))
+            bit = 1 << code
+            previous = self._contributions.get((code, source), set())
+            if arguments.get("offset"):
+                # 分頁結果的後續頁面追加到同一來源
+                keys |= previous
+
+            # 其他來源仍提供的鍵不能清除該代理的位
+            other_keys = set()
+            for (agent_code, other_source), contributed in self._contributions.items():
+                if agent_code == code and other_source != source:
+                    other_keys |= contributed
+
+            for key in previous - keys - other_keys:
+                remaining = self._postings.get(key, 0) & ~bit
+                if remaining:
+                    self._postings[key] = remaining
+                else:
+                    self._postings.pop(key, None)
+            for key in keys - previous:
+                self._postings[key] = self._postings.get(key, 0) | bit
+            self._contributions[(code, source)] = keys
+
+        logger.debug(f"🔗 關聯索引更新: {arguments['agent_id']} {tool_name} ({len(keys)} 個鍵)")
+        return len(keys)
+
+    def lookup(self, field: str, value: str) -> List[str]:
+        """
+        查詢擁有某個鍵的代理
+
+        Args:
+            field: ip、process、cmdline、cve
+            value: 鍵值；cmdline 可傳原始命令行或其哈希
+
+        Returns:
+            代理 ID 列表
+        """
+        return self._decode(self._bits(field, value))
+
+    def _bits(self, field: str, value: str) -> int:
+        if field not in FIELDS:
+            raise ValueError(f"不支持的字段 {field}，可選: {', '.join(FIELDS)}")
+        value = value.strip()
+        if field == "process":
+            value = value.lower()
+        elif field == "cve":
+            value = value.upper()
+        elif field == "cmdline" and not re.fullmatch(r"[0-9a-f]{16}", value):
+            value = cmdline_hash(value)
+        with self._lock:
+            return self._postings.get((field, value), 0)
+
+    def intersect(self, criteria: Dict[str, str]) -> List[str]:
+        """
+        查詢同時滿足所有條件的代理
+
+        Args:
+            criteria: {字段: 值}
+
+        Returns:
+            代理 ID 列表
+        """
+        bits = -1
+        for field, value in criteria.items():
+            bits &= self._bits(field, value)
+        return self._decode(bits) if criteria else []
+
+    def related(self, agent_id: str, max_share: float = 0.5) -> List[Tuple[str, int, List[Tuple[str, str]]]]:
+        """
+        查找與某代理共享索引鍵的其他代理
+
+        超過 max_share 比例代理都具有的鍵（如 sshd、常見 CVE）視為普遍存在，不計入關聯。
+
+        Returns:
+            [(代理 ID, 共享鍵數, 共享鍵示例), ...]，按共享鍵數從多到少
+        """
+        with self._lock:
+            code = self._agent_codes.get(agent_id)
+            if code is None:
+                return []
+            keys = set()
+            for (agent_code, _), contributed in self._contributions.items():
+                if agent_code == code:
+                    keys |= contributed
+
+            bit = 1 << code
+            limit = max(1, int(len(self._agents) * max_share))
+            shared: Counter = Counter()
+            examples: Dict[str, List[Tuple[str, str]]] = {}
+            for key in keys:
+                others = self._postings.get(key, 0) & ~bit
+                if not others or bin(others).count("1") > limit:
+                    continue
+                for other in self._decode(others):
+                    shared[other] += 1
+                    examples.setdefault(other, []).append(key)
+
+        ranked = sorted(shared.items(), key=lambda item: (-item[1], item[0]))
+        return [(other, count, sorted(examples[other])[:5]) for other, count in ranked]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        索引統計
+
+        Returns:
+            {"agents", "keys": {字段: 鍵數}, "sources": {工具名: 已索引代理數}}
+        """
+        with self._lock:
+            keys = Counter(field for field, _ in self._postings)
+            sources: Dict[str, Set[int]] = {}
+            for (code, source), _ in self._contributions.items():
+                sources.setdefault(source.split(":", 1)[0], set()).add(code)
+        return {
+            "agents": len(self._agents),
+            "keys": {field: keys.get(field, 0) for field in FIELDS},
+            "sources": {tool: len(codes) for tool, codes in sources.items()},
+        }
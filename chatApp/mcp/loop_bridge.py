@@ -0,0 +1,138 @@
+"""
+事件循環橋接
+在後台線程運行一個長期存在的事件循環，供同步代碼提交協程
+"""
+import asyncio
+import threading
+from typing import Awaitable, Optional, TypeVar
+from loguru import logger
+
+T = TypeVar("T")
+
+
+async def run_on_loop(loop: Optional[asyncio.AbstractEventLoop], coro: Awaitable[T]) -> T:
+    """
+    在指定事件循環上執行協程並等待結果
+
+    如果當前正運行在該循環上（或未指定循環），直接 await。
+
+    Args:
+        loop: 目標事件循環
+        coro: 要執行的協程
+
+    Returns:
+        協程的返回值
+    """
+    try:
+        current = asyncio.get_running_loop()
+    except RuntimeError:
+        current = None
+
+    if loop is None or loop is current or loop.is_closed():
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+class EventLoopBridge:
+    """
+    後台事件循環線程
+
+    MCP 連接（stdio 管道、HTTP 連接池）在這個循環上創建，同步和異步調用方都把
+    協程提交到這裡執行，從而共享同一組連接和緩存，且不再每次調用都創建新循環。
+    """
+
+    def __init__(self, name: str = "mcp-event-loop"):
+        """
+        初始化橋接
+
+        Args:
+            name: 後台線程名稱
+        """
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """後台事件循環（首次訪問時啟動線程）"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._start()
+            return self._loop
+
+    def _start(self):
+        """啟動後台線程並等待事件循環就緒"""
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(ready.set)
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+        self._thread.start()
+        ready.wait()
+        self._loop = loop
+        logger.debug(f"🧵 事件循環線程 {self.name} 已啟動")
+
+    def in_bridge_thread(self) -> bool:
+        """當前是否在後台線程中"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """
+        從同步代碼提交協程並阻塞等待結果
+
+        Args:
+            coro: 要執行的協程
+            timeout: 最長等待秒數
+
+        Returns:
+            協程的返回值
+        """
+        if self.in_bridge_thread():
+            # 在循環線程內阻塞等待自身只會死鎖
+            coro.close()
+            raise RuntimeError("不能在事件循環橋接線程內同步等待協程，請改用 await")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    async def run_async(self, coro: Awaitable[T]) -> T:
+        """
+        從任意事件循環提交協程到後台循環並 await 結果
+
+        Args:
+            coro: 要執行的協程
+
+        Returns:
+            協程的返回值
+        """
+        return await run_on_loop(self.loop, coro)
+
+    def stop(self):
+        """停止後台事件循環並等待線程退出"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if self._thread is not None and self._thread is not threading.current_thread():
+                self._thread.join(timeout=5.0)
+            if not self._loop.is_running():
+                self._loop.close()
+            self._loop = None
+            self._thread = None
+            logger.debug(f"🧵 事件循環線程 {self.name} 已停止")
+
+
+_bridge: Optional[EventLoopBridge] = None
+_bridge_lock = threading.Lock()
+
+
+def get_loop_bridge() -> EventLoopBridge:
+    """獲取全局事件循環橋接單例"""
+    global _bridge
+    with _bridge_lock:
+        if _bridge is None:
+            _bridge = EventLoopBridge()
+        return _bridge
@@ -0,0 +1,216 @@
+"""
+MCP 服務器進程池
+為 stdio 模式的 MCP 服務器啟動多個子進程，分攤工具調用負載
+"""
+import asyncio
+from typing import Optional, Dict, Any, List, Callable, Tuple
+from loguru import logger
+
+from .client import MCPClient
+from .loop_bridge import run_on_loop
+
+
+class MCPServerPool:
+    """
+    stdio MCP 服務器進程池
+
+    提供與 MCPClient 相同的調用接口。每個調用分配給在途請求最少的健康進程；
+    崩潰的進程由監督任務按指數退避自動重啟，不影響其他進程上的在途請求。
+    """
+
+    RESTART_INITIAL_DELAY = 0.5  # 首次重啟等待秒數
+    RESTART_MAX_DELAY = 30.0     # 重啟退避上限
+
+    def __init__(self, server_config: Dict[str, Any], size: int):
+        """
+        初始化進程池
+
+        Args:
+            server_config: MCP 服務器配置（與 MCPClient 相同）
+            size: 進程數量
+        """
+        self.server_config = server_config
+        self.size = size
+        self.transport_mode = 'stdio'
+        self.workers: List[Optional[MCPClient]] = [None] * size
+        self._inflight: List[int] = [0] * size
+        self._supervisors: List[asyncio.Task] = []
+        self._notification_handlers: List[Callable[[Dict[str, Any]], None]] = []
+        self._closing = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # 進程池所屬的事件循環
+
+    @property
+    def is_alive(self) -> bool:
+        """是否至少有一個健康的進程"""
+        return any(worker is not None and worker.is_alive for worker in self.workers)
+
+    @property
+    def server_info(self) -> Dict[str, Any]:
+        """任一健康進程的 serverInfo（所有進程運行同一服務器）"""
+        for worker in self.workers:
+            if worker is not None and worker.server_info:
+                return worker.server_info
+        return {}
+
+    def add_notification_handler(self, handler: Callable[[Dict[str, Any]], None]):
+        """註冊服務器通知處理函數（對所有進程生效，包括重啟後的進程）"""
+        self._notification_handlers.append(handler)
+        for worker in self.workers:
+            if worker is not None:
+                worker.add_notification_handler(handler)
+
+    async def _start_worker(self, index: int) -> bool:
+        """啟動第 index 個進程"""
+        worker = MCPClient(self.server_config)
+        for handler in self._notification_handlers:
+            worker.add_notification_handler(handler)
+
+        if await worker.connect():
+            self.workers[index] = worker
+            return True
+
+        await worker.aclose()
+        return False
+
+    async def connect(self) -> bool:
+        """
+        併發啟動所有進程
+
+        Returns:
+            至少一個進程啟動成功即返回 True
+        """
+        self._loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(self._start_worker(i) for i in range(self.size)))
+        logger.info(f"🧵 MCP 進程池已啟動 {sum(results)}/{self.size} 個進程")
+
+        if not any(results):
+            return False
+
+        self._supervisors = [asyncio.create_task(self._supervise(i)) for i in range(self.size)]
+        return True
+
+    async def _supervise(self, index: int):
+        """監督第 index 個進程，退出後按指數退避重啟"""
+        delay = self.RESTART_INITIAL_DELAY
+        while not self._closing:
+            worker = self.workers[index]
+            if worker is not None and worker.is_alive:
+                # 讀取任務結束即表示進程輸出已關閉
+                try:
+                    await worker.wait_closed()
+                except (asyncio.CancelledError, Exception):
+                    if self._closing:
+                        return
+                if self._closing:
+                    return
+                logger.warning(f"⚠️  MCP 進程池第 {index} 號進程已退出，{delay:.1f} 秒後重啟")
+                await worker.aclose()
+                self.workers[index] = None
+            else:
+                logger.warning(f"⚠️  MCP 進程池第 {index} 號進程不可用，{delay:.1f} 秒後重啟")
+
+            await asyncio.sleep(delay)
+            if self._closing:
+                return
+
+            if await self._start_worker(index):
+                logger.info(f"✅ MCP 進程池第 {index} 號進程已重啟")
+                delay = self.RESTART_INITIAL_DELAY
+            else:
+                delay = min(delay * 2, self.RESTART_MAX_DELAY)
+
+    def _acquire(self) -> Optional[int]:
+        """選擇在途請求最少的健康進程"""
+        candidates = [
+            i for i, worker in enumerate(self.workers)
+            if worker is not None and worker.is_alive
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda i: self._inflight[i])
+
+    def _on_owner_loop(self) -> bool:
+        """當前是否運行在進程池所屬的事件循環上"""
+        if self._loop is None or self._loop.is_closed():
+            return True
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def _dispatch(self, func: Callable[[MCPClient], Any], on_unavailable: Any) -> Any:
+        """
+        將調用分配給在途請求最少的進程並維護在途計數
+
+        不在其他進程上重試崩潰進程的請求：導致崩潰的請求會同樣擊垮兄弟進程。
+        """
+        if not self._on_owner_loop():
+            return await run_on_loop(self._loop, self._dispatch(func, on_unavailable))
+
+        index = self._acquire()
+        if index is None:
+            return on_unavailable
+
+        self._inflight[index] += 1
+        try:
+            return await func(self.workers[index])
+        finally:
+            self._inflight[index] -= 1
+
+    async def list_tools(self) -> List[Dict[str, Any]]:
+        """從任一健康進程獲取工具列表"""
+        return await self._dispatch(lambda worker: worker.list_tools(), [])
+
+    async def call_tool(
+        self,
+        tool_name: str,
+        arguments: Dict[str, Any],
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        在最空閒的進程上調用工具
+
+        Args:
+            tool_name: 工具名稱
+            arguments: 工具參數
+            progress_callback: 可選的進度回調
+
+        Returns:
+            工具執行結果
+        """
+        return await self._dispatch(
+            lambda worker: worker.call_tool(tool_name, arguments, progress_callback),
+            {
+                "content": [{"type": "text", "text": "MCP 進程池中沒有可用的進程"}],
+                "isError": True
+            }
+        )
+
+    async def call_tools_batch(self, calls: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """將多個工具調用分散到進程池中併發執行，結果順序與 calls 一致"""
+        if not self._on_owner_loop():
+            return await run_on_loop(self._loop, self.call_tools_batch(calls))
+        return list(await asyncio.gather(
+            *(self.call_tool(tool_name, arguments) for tool_name, arguments in calls)
+        ))
+
+    async def aclose(self):
+        """停止監督任務並關閉所有進程"""
+        if not self._on_owner_loop():
+            return await run_on_loop(self._loop, self.aclose())
+
+        self._closing = True
+        for task in self._supervisors:
+            task.cancel()
+        for task in self._supervisors:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._supervisors = []
+
+        await asyncio.gather(
+            *(worker.aclose() for worker in self.workers if worker is not None),
+            return_exceptions=True
+        )
+        self.workers = [None] * self.size
@@ -0,0 +1,137 @@
+"""
+MCP 調用的彈性控制
+基於滾動延遲統計的自適應超時，以及按服務器 / 工具劃分的熔斷器
+"""
+import bisect
+import time
+from collections import deque
+from typing import Dict, Deque, Optional
+
+
+class LatencyTracker:
+    """按鍵（工具名稱）記錄最近 N 次調用延遲的滾動直方圖"""
+
+    def __init__(self, window: int = 200):
+        """
+        初始化延遲追蹤器
+
+        Args:
+            window: 每個鍵保留的最近樣本數
+        """
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._sorted: Dict[str, list] = {}  # 與 _samples 同步的有序副本，便於取分位數
+
+    def record(self, key: str, seconds: float):
+        """記錄一次調用耗時"""
+        samples = self._samples.setdefault(key, deque())
+        ordered = self._sorted.setdefault(key, [])
+
+        if len(samples) >= self.window:
+            oldest = samples.popleft()
+            del ordered[bisect.bisect_left(ordered, oldest)]
+
+        samples.append(seconds)
+        bisect.insort(ordered, seconds)
+
+    def count(self, key: str) -> int:
+        """已記錄的樣本數"""
+        return len(self._samples.get(key, ()))
+
+    def percentile(self, key: str, q: float) -> Optional[float]:
+        """
+        獲取延遲分位數
+
+        Args:
+            key: 工具名稱
+            q: 分位數（0-100）
+
+        Returns:
+            分位數延遲（秒），沒有樣本時返回 None
+        """
+        ordered = self._sorted.get(key)
+        if not ordered:
+            return None
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """所有工具的延遲摘要（p50 / p95 / p99，秒）"""
+        return {
+            key: {
+                "count": self.count(key),
+                "p50": self.percentile(key, 50),
+                "p95": self.percentile(key, 95),
+                "p99": self.percentile(key, 99),
+            }
+            for key in self._samples
+        }
+
+
+class CircuitBreaker:
+    """
+    熔斷器
+
+    連續失敗達到閾值後進入 open 狀態並快速失敗；經過恢復時間後進入 half_open，
+    只放行一個探測請求，成功則關閉，失敗則重新打開。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        初始化熔斷器
+
+        Args:
+            failure_threshold: 觸發熔斷的連續失敗次數
+            recovery_timeout: 熔斷後進入半開探測前的等待秒數
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """當前是否允許發出請求"""
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+        # 半開狀態只放行一個探測請求
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def retry_after(self) -> float:
+        """距離下一次允許探測的秒數"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+    def release(self):
+        """放棄已獲得的半開探測名額（請求最終未發出時調用）"""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        """記錄成功調用"""
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        """記錄失敗調用"""
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
@@ -0,0 +1,210 @@
+"""
+代理進程與端口快照存儲
+以內容哈希保存每個代理的進程和端口列表，比較快照只需集合運算
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+from loguru import logger
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    agent_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    taken_at REAL NOT NULL,
+    checked_at REAL NOT NULL,
+    digest TEXT NOT NULL,
+    item_count INTEGER NOT NULL,
+    items BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_agent_kind ON snapshots(agent_id, kind, id);
+CREATE TABLE IF NOT EXISTS snapshot_items (
+    hash INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# 每次採集都會變化、不代表進程或連接身份的字段（小寫）
+VOLATILE_FIELDS = {
+    "pid", "ppid", "tgid", "state", "status", "start time", "start_time", "scan time", "scan_time",
+    "utime", "stime", "vm size", "vm_size", "size", "resident", "share", "rss", "memory",
+    "cpu", "priority", "nice", "threads", "nlwp", "processor", "session", "inode",
+    "tx queue", "tx_queue", "rx queue", "rx_queue",
+}
+_PID_RE = re.compile(r"\s*\(?\bpid[:=\s]*\d+\)?", re.IGNORECASE)
+
+
+def fingerprint(record: Dict[str, str]) -> Tuple[int, str]:
+    """
+    計算進程或連接記錄的身份哈希
+
+    忽略 PID、狀態、資源佔用等易變字段，同一個進程重新採集得到相同的哈希。
+
+    Args:
+        record: parse_records 返回的記錄
+
+    Returns:
+        (有符號 64 位哈希, 用於展示的緊湊文本)
+    """
+    identity = sorted(
+        (key.lower(), " ".join(_PID_RE.sub("", value).split()))
+        for key, value in record.items()
+        if key.lower() not in VOLATILE_FIELDS
+    )
+    text = "; ".join(f"{key}={value}" for key, value in identity if value)
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True), text[:200]
+
+
+def _pack(hashes: List[int]) -> bytes:
+    """把排序後的哈希打包為二進制"""
+    return array("q", hashes).tobytes()
+
+
+def _unpack(blob: bytes) -> array:
+    """解包二進制哈希列表"""
+    hashes = array("q")
+    hashes.frombytes(blob)
+    return hashes
+
+
+class SnapshotStore:
+    """
+    SQLite 快照存儲
+
+    每個快照只保存排序後的 64 位哈希數組和整體摘要；展示文本按哈希去重單獨保存，
+    並記錄被多少個快照引用，快照超出歷史上限被刪除後，不再被引用的文本隨之刪除。
+    摘要相同的快照直接判定無變化，不必解包比較。
+    """
+
+    def __init__(self, db_path: str, history: int = 10):
+        """
+        初始化存儲
+
+        Args:
+            db_path: SQLite 數據庫文件路徑（":memory:" 表示內存數據庫）
+            history: 每個代理每類快照最多保留的數量
+        """
+        self.db_path = db_path
+        self.history = history
+
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            if db_path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    def _texts(self, hashes: List[int]) -> List[str]:
+        """按哈希查詢展示文本"""
+        texts = []
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT text FROM snapshot_items WHERE hash IN ({placeholders})", chunk
+            ).fetchall()
+            texts.extend(row["text"] for row in rows)
+        return sorted(texts)
+
+    def record(self, agent_id: str, kind: str, records: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        保存新快照並與上一個快照比較
+
+        Args:
+            agent_id: 代理 ID
+            kind: 快照類型（processes、ports）
+            records: 本次採集的解析記錄
+
+        Returns:
+            {"baseline", "unchanged", "added", "removed", "count", "previous_at"}
+        """
+        items = dict(fingerprint(record) for record in records)
+        hashes = sorted(items)
+        digest = hashlib.blake2b(_pack(hashes), digest_size=16).hexdigest()
+        now = time.time()
+
+        with self._lock:
+            previous = self._conn.execute(
+                "SELECT id, taken_at, digest, items FROM snapshots "
+                "WHERE agent_id = ? AND kind = ? ORDER BY id DESC LIMIT 1",
+                (agent_id, kind)
+            ).fetchone()
+
+            diff = {
+                "baseline": previous is None,
+                "unchanged": previous is not None and previous["digest"] == digest,
+                "added": [],
+                "removed": [],
+                "count": len(hashes),
+                "previous_at": previous["taken_at"] if previous else None,
+            }
+
+            if diff["unchanged"]:
+                self._conn.execute("UPDATE snapshots SET checked_at = ? WHERE id = ?", (now, previous["id"]))
+                self._conn.commit()
+                return diff
+
+            self._conn.executemany(
+                "INSERT INTO snapshot_items (hash, kind, text, refs) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(hash) DO UPDATE SET refs = refs + 1",
+                [(h, kind, text) for h, text in items.items()]
+            )
+
+            if previous is not None:
+                current = set(hashes)
+                before = set(_unpack(previous["items"]))
+                diff["added"] = [items[h] for h in sorted(current - before)]
+                diff["removed"] = self._texts(sorted(before - current))
+
+            self._conn.execute(
+                "INSERT INTO snapshots (agent_id, kind, taken_at, checked_at, digest, item_count, items) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (agent_id, kind, now, now, digest, len(hashes), _pack(hashes))
+            )
+            self._expire(agent_id, kind)
+            self._conn.commit()
+
+        if not diff["baseline"]:
+            logger.debug(f"📸 {agent_id} {kind} 快照: +{len(diff['added'])} -{len(diff['removed'])}")
+        return diff
+
+    def _expire(self, agent_id: str, kind: str):
+        """刪除超出歷史上限的快照，並釋放它們引用的展示文本（調用方持有鎖並負責提交）"""
+        expired = self._conn.execute(
+            "SELECT id, items FROM snapshots WHERE agent_id = ? AND kind = ? ORDER BY id DESC LIMIT -1 OFFSET ?",
+            (agent_id, kind, self.history)
+        ).fetchall()
+        if not expired:
+            return
+
+        released: Counter = Counter()
+        for row in expired:
+            released.update(_unpack(row["items"]))
+        self._conn.executemany("DELETE FROM snapshots WHERE id = ?", [(row["id"],) for row in expired])
+        self._conn.executemany(
+            "UPDATE snapshot_items SET refs = refs - ? WHERE hash = ?",
+            [(count, h) for h, count in released.items()]
+        )
+        self._conn.executemany(
+            "DELETE FROM snapshot_items WHERE hash = ? AND refs <= 0", [(h,) for h in released]
+        )
+
+    def close(self):
+        """關閉數據庫連接"""
+        with self._lock:
+            self._conn.close()
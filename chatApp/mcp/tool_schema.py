@@ -0,0 +1,146 @@
+"""
+MCP 工具模式
+將 MCP 工具的 JSON Schema 轉換為 pydantic 參數模型，並按服務器版本緩存到磁盤
+"""
+import json
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Type, Literal
+
+from pydantic import BaseModel, Field, create_model
+from loguru import logger
+
+
+# JSON Schema 類型到 Python 類型的映射
+JSON_SCHEMA_TYPES: Dict[str, Any] = {
+    "string": str,
+    "integer": int,
+    "number": float,
+    "boolean": bool,
+    "array": List[Any],
+    "object": Dict[str, Any],
+}
+
+
+def _python_type(prop: Dict[str, Any]) -> Any:
+    """根據單個屬性的 JSON Schema 推導 Python 類型"""
+    if prop.get("enum"):
+        return Literal[tuple(prop["enum"])]
+
+    json_type = prop.get("type", "string")
+    if isinstance(json_type, list):
+        # 例如 ["integer", "null"]：取第一個非 null 類型
+        json_type = next((t for t in json_type if t != "null"), "string")
+
+    return JSON_SCHEMA_TYPES.get(json_type, Any)
+
+
+def build_args_schema(tool_name: str, input_schema: Dict[str, Any]) -> Type[BaseModel]:
+    """
+    根據 MCP 工具的 inputSchema 生成 pydantic 參數模型
+
+    必填參數使用 Field(...)，其餘參數為 Optional 且默認 None。
+
+    Args:
+        tool_name: 工具名稱（用於生成模型名稱）
+        input_schema: 工具的 JSON Schema
+
+    Returns:
+        pydantic 模型類
+    """
+    properties = (input_schema or {}).get("properties", {}) or {}
+    required = set((input_schema or {}).get("required", []) or [])
+
+    fields: Dict[str, Any] = {}
+    for name, prop in properties.items():
+        py_type = _python_type(prop)
+        description = prop.get("description", "")
+        if name in required:
+            fields[name] = (py_type, Field(..., description=description))
+        else:
+            fields[name] = (Optional[py_type], Field(default=None, description=description))
+
+    model_name = "".join(part.capitalize() for part in tool_name.split("_")) + "Args"
+    return create_model(model_name, **fields)
+
+
+def parameters_to_input_schema(parameters: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    將 WazToolConfig.WAZUH_TOOLS 的參數定義轉換為 JSON Schema
+
+    Args:
+        parameters: {參數名: {"type", "description", "required"}}
+
+    Returns:
+        MCP inputSchema 格式的字典
+    """
+    return {
+        "type": "object",
+        "properties": {
+            name: {"type": info.get("type", "string"), "description": info.get("description", "")}
+            for name, info in parameters.items()
+        },
+        "required": [name for name, info in parameters.items() if info.get("required")],
+    }
+
+
+class ToolSchemaCache:
+    """按服務器名稱和版本緩存 tools/list 結果的磁盤緩存"""
+
+    def __init__(self, path: str):
+        """
+        初始化模式緩存
+
+        Args:
+            path: 緩存 JSON 文件路徑
+        """
+        self.path = Path(path)
+
+    @staticmethod
+    def server_key(server_info: Dict[str, Any]) -> Optional[str]:
+        """由 serverInfo 生成緩存鍵，缺少版本信息時返回 None（不緩存）"""
+        name = (server_info or {}).get("name")
+        version = (server_info or {}).get("version")
+        if not name or not version:
+            return None
+        return f"{name}@{version}"
+
+    def _read(self) -> Dict[str, Any]:
+        """讀取整個緩存文件"""
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"⚠️  讀取工具模式緩存失敗: {e}")
+            return {}
+
+    def load(self, server_info: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """
+        讀取指定服務器版本的工具定義
+
+        Returns:
+            tools/list 格式的工具列表，未命中時返回 None
+        """
+        key = self.server_key(server_info)
+        if key is None:
+            return None
+        return self._read().get(key)
+
+    def save(self, server_info: Dict[str, Any], tools: List[Dict[str, Any]]):
+        """寫入指定服務器版本的工具定義"""
+        key = self.server_key(server_info)
+        if key is None or not tools:
+            return
+
+        data = self._read()
+        data[key] = tools
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            tmp_path.replace(self.path)
+            logger.debug(f"💾 已緩存 {key} 的 {len(tools)} 個工具模式")
+        except OSError as e:
+            logger.warning(f"⚠️  寫入工具模式緩存失敗: {e}")
@@ -2,14 +2,28 @@
 Wazuh MCP 工具包
 將 MCP 工具轉換為 LangChain 工具格式
 """
-from typing import Dict, Any, Optional, List
-from langchain.tools import StructuredTool
-from langchain_core.tools import Tool
-from pydantic import BaseModel, Field
 import asyncio
+import base64
+import json
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, List, Callable, Tuple, AsyncIterator, Awaitable, Literal, Type
+from langchain.tools import StructuredTool
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, Field, ValidationError
 from loguru import logger
 
 from .client import MCPClient
+from .alert_analytics import AlertAnalytics
+from .alert_store import AlertStore
+from .cache import ToolResultCache
+from .compaction import ResultCompactor, ResultStore, parse_records, record_field
+from .correlation import CorrelationIndex
+from .loop_bridge import get_loop_bridge
+from .snapshot_store import SnapshotStore
+from .tool_schema import ToolSchemaCache, build_args_schema, parameters_to_input_schema
 
 
 class WazToolConfig:
@@ -112,77 +126,284 @@ class WazToolConfig:
         }
     }
 
+    # 工具結果緩存的存活秒數：規則、集群拓撲等變化緩慢的數據緩存較久，
+    # 警報和日誌只做短暫緩存；未列出的工具不緩存
+    CACHE_TTLS = {
+        "get_wazuh_alert_summary": 30,
+        "get_wazuh_agents": 120,
+        "get_wazuh_vulnerability_summary": 600,
+        "get_wazuh_critical_vulnerabilities": 600,
+        "get_wazuh_agent_processes": 60,
+        "get_wazuh_agent_ports": 60,
+        "get_wazuh_rules_summary": 3600,
+        "search_wazuh_manager_logs": 30,
+        "get_wazuh_manager_error_logs": 30,
+        "get_wazuh_cluster_health": 30,
+        "get_wazuh_cluster_nodes": 600,
+        "get_wazuh_weekly_stats": 1800,
+        "get_wazuh_remoted_stats": 30,
+        "get_wazuh_log_collector_stats": 60,
+    }
+
+    # 工具結果交給 LLM 前的 token 預算：進程、端口、漏洞等長列表壓縮得更緊，
+    # 未列出的工具使用 DEFAULT_TOKEN_BUDGET，0 表示不壓縮
+    DEFAULT_TOKEN_BUDGET = 2000
+    TOKEN_BUDGETS = {
+        "get_wazuh_alert_summary": 2000,
+        "get_wazuh_agents": 1500,
+        "get_wazuh_vulnerability_summary": 2000,
+        "get_wazuh_critical_vulnerabilities": 1500,
+        "get_wazuh_agent_processes": 1500,
+        "get_wazuh_agent_ports": 1200,
+        "get_wazuh_rules_summary": 1500,
+        "search_wazuh_manager_logs": 1500,
+        "get_wazuh_manager_error_logs": 1500,
+        "get_wazuh_cluster_health": 800,
+        "get_wazuh_cluster_nodes": 1200,
+        "get_wazuh_weekly_stats": 2000,
+        "get_wazuh_remoted_stats": 1000,
+        "get_wazuh_log_collector_stats": 1000,
+    }
+
+    # 全機群掃描工具：每次最多併發調用的代理數、整體截止秒數和掃描的代理上限
+    FLEET_CONCURRENCY = 8
+    FLEET_DEADLINE = 90.0
+    FLEET_MAX_AGENTS = 1000
+
+    # 服務器不支持 offset 時本地分頁一次請求的記錄上限（工具模式未聲明 limit 最大值時使用）
+    PAGE_FETCH_LIMIT = 10000
+
+    # 本地警報存儲距上次同步超過該秒數時，查詢最近窗口前先增量同步
+    ALERT_SYNC_INTERVAL = 60.0
+
+    # 快照採集：進程和端口列表的 limit，以及端口快照的查詢組合（端口工具要求 protocol 和 state）
+    SNAPSHOT_LIMIT = 5000
+    SNAPSHOT_PORT_QUERIES = [
+        {"protocol": "tcp", "state": "LISTENING"},
+        {"protocol": "tcp", "state": "ESTABLISHED"},
+    ]
+
+    @classmethod
+    def static_tool_definitions(cls) -> List[Dict[str, Any]]:
+        """
+        將 WAZUH_TOOLS 轉換為 tools/list 格式，作為無法動態發現工具時的後備
+
+        Returns:
+            [{"name", "description", "inputSchema"}, ...]
+        """
+        return [
+            {
+                "name": name,
+                "description": info["description"],
+                "inputSchema": parameters_to_input_schema(info.get("parameters", {}))
+            }
+            for name, info in cls.WAZUH_TOOLS.items()
+        ]
+
+
+async def call_wazuh_tool(
+    mcp_client: MCPClient,
+    name: str,
+    arguments: Dict[str, Any],
+    cache: Optional[ToolResultCache] = None,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    on_result: Optional[Callable[[str, Dict[str, Any], Dict[str, Any]], None]] = None
+) -> Dict[str, Any]:
+    """
+    調用 Wazuh MCP 工具，按 WazToolConfig.CACHE_TTLS 讀寫結果緩存
+
+    Args:
+        mcp_client: MCP 客戶端實例
+        name: 工具名稱
+        arguments: 工具參數
+        cache: 可選的結果緩存
+        progress_callback: 可選的進度回調
+        on_result: 可選的結果回調，參數為 (工具名稱, 工具參數, 工具結果)，只在實際請求成功後調用
+
+    Returns:
+        MCP 工具結果
+    """
+    result = cache.get(name, arguments) if cache is not None else None
+    if result is not None:
+        logger.info(f"💾 命中緩存: {name} with args: {arguments}")
+        return result
+
+    logger.info(f"🔧 調用 Wazuh 工具: {name} with args: {arguments}")
+    result = await mcp_client.call_tool(name, arguments, progress_callback=progress_callback)
+    if result and not result.get("isError"):
+        if cache is not None:
+            cache.set(name, arguments, result, WazToolConfig.CACHE_TTLS.get(name, 0))
+        if on_result is not None:
+            try:
+                on_result(name, arguments, result)
+            except Exception as e:
+                logger.warning(f"⚠️  工具結果回調失敗: {name}: {e}")
+    return result
+
+
+def result_text(result: Dict[str, Any]) -> Optional[str]:
+    """
+    提取 MCP 工具結果中的文本內容
+
+    Returns:
+        以空行連接的文本，沒有文本內容時返回 None
+    """
+    texts = [
+        item.get("text", "")
+        for item in (result or {}).get("content", [])
+        if isinstance(item, dict) and item.get("type") == "text"
+    ]
+    return "\n\n".join(texts) if texts else None
+
+
+def validation_error_message(error: Exception) -> str:
+    """參數不合法時把錯誤返回給 Agent 修正，而不是中斷執行"""
+    return f"參數校驗失敗，請修正後重試: {error}"
+
+
+def make_structured_tool(
+    name: str,
+    description: str,
+    args_schema: Type[BaseModel],
+    coro_fn: Optional[Callable[..., Awaitable[str]]] = None,
+    func: Optional[Callable[..., str]] = None,
+    bridge: bool = True
+) -> BaseTool:
+    """
+    創建帶統一錯誤處理的 StructuredTool
+
+    coro_fn 默認提交到事件循環橋接線程執行（同步和異步調用共用 MCP 連接和緩存）；
+    只讀內存的工具改傳同步的 func，直接在調用線程執行。同時提供兩者時同步調用使用 func，
+    異步調用使用 coro_fn。參數校驗和執行異常都轉為錯誤信息返回給 Agent。
 
-def create_wazuh_tools(mcp_client: MCPClient) -> List[Tool]:
+    Args:
+        name: 工具名稱
+        description: 工具描述
+        args_schema: 參數模型
+        coro_fn: 工具的異步實現
+        func: 工具的同步實現（不需要 MCP 連接時使用）
+        bridge: coro_fn 是否經過事件循環橋接（不使用 MCP 連接的異步實現可設為 False，在調用方的事件循環中執行）
+
+    Returns:
+        LangChain 工具
+    """
+    def error_message(e: Exception) -> str:
+        error_msg = f"執行工具 {name} 時發生錯誤: {str(e)}"
+        logger.error(f"❌ {error_msg}")
+        return error_msg
+
+    async def invoke(*args, **kwargs) -> str:
+        try:
+            return await coro_fn(*args, **kwargs)
+        except Exception as e:
+            return error_message(e)
+
+    if func is not None:
+        def sync_wrapper(*args, **kwargs) -> str:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                return error_message(e)
+    else:
+        def sync_wrapper(*args, **kwargs) -> str:
+            """同步工具調用包裝器（LangChain 需要）"""
+            return get_loop_bridge().run(invoke(*args, **kwargs))
+
+    if coro_fn is None:
+        # 純內存操作，不需要經過事件循環橋接
+        async def tool_wrapper(*args, **kwargs) -> str:
+            return sync_wrapper(*args, **kwargs)
+    elif bridge:
+        async def tool_wrapper(*args, **kwargs) -> str:
+            """異步工具調用包裝器"""
+            return await get_loop_bridge().run_async(invoke(*args, **kwargs))
+    else:
+        tool_wrapper = invoke
+
+    return StructuredTool(
+        name=name,
+        description=description,
+        args_schema=args_schema,
+        func=sync_wrapper,
+        coroutine=tool_wrapper,
+        handle_validation_error=validation_error_message
+    )
+
+
+def create_wazuh_tools(
+    mcp_client: MCPClient,
+    progress_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    cache: Optional[ToolResultCache] = None,
+    tool_definitions: Optional[List[Dict[str, Any]]] = None,
+    compactor: Optional[ResultCompactor] = None,
+    on_result: Optional[Callable[[str, Dict[str, Any], Dict[str, Any]], None]] = None
+) -> List[BaseTool]:
     """
     創建 Wazuh LangChain 工具列表
 
+    每個工具都是帶 pydantic args_schema 的 StructuredTool，參數在發出 MCP 請求前完成校驗。
+
     Args:
         mcp_client: MCP 客戶端實例
+        progress_callback: 可選的進度回調，參數為 (工具名稱, notifications/progress 的 params)
+        cache: 可選的結果緩存，按 WazToolConfig.CACHE_TTLS 緩存成功的結果
+        tool_definitions: tools/list 格式的工具定義（默認使用 WazToolConfig 的靜態定義）
+        compactor: 可選的結果壓縮器，超出 token 預算的結果壓縮後再返回給 Agent
+        on_result: 可選的結果回調，見 call_wazuh_tool
 
     Returns:
         LangChain 工具列表
     """
     tools = []
+    if tool_definitions is None:
+        tool_definitions = WazToolConfig.static_tool_definitions()
 
-    for tool_name, tool_info in WazToolConfig.WAZUH_TOOLS.items():
-        # 創建工具的包裝函數
-        def make_tool_wrappers(name: str):
-            async def tool_wrapper(*args, **kwargs) -> str:
-                """異步工具調用包裝器"""
-                try:
-                    if args and not kwargs:
-                        if len(args) == 1 and isinstance(args[0], dict):
-                            kwargs = args[0]
-                        else:
-                            kwargs = {"input": args[0] if len(args) == 1 else args}
-
-                    logger.info(f"🔧 調用 Wazuh 工具: {name} with args: {kwargs}")
-                    result = await mcp_client.call_tool(name, kwargs)
-
-                    # 提取文本內容
-                    if result and "content" in result:
-                        content_items = result["content"]
-                        texts = []
-                        for item in content_items:
-                            if isinstance(item, dict) and item.get("type") == "text":
-                                texts.append(item.get("text", ""))
-                        return "\n\n".join(texts) if texts else "無返回結果"
+    for definition in tool_definitions:
+        tool_name = definition["name"]
+        # 創建工具的調用函數
+        def make_invoke_tool(name: str):
+            def on_progress(params: Dict[str, Any]):
+                """工具執行中收到進度通知時即時輸出"""
+                total = params.get("total")
+                progress = f"{params.get('progress')}/{total}" if total else f"{params.get('progress')}"
+                logger.info(f"⏳ {name} 進度: {progress} {params.get('message', '')}".rstrip())
+                if progress_callback is not None:
+                    progress_callback(name, params)
+
+            async def invoke_tool(*args, **kwargs) -> str:
+                """在事件循環橋接線程上執行的工具調用"""
+                if args and not kwargs:
+                    if len(args) == 1 and isinstance(args[0], dict):
+                        kwargs = args[0]
                     else:
-                        return "工具執行完成但無返回數據"
+                        kwargs = {"input": args[0] if len(args) == 1 else args}
 
-                except Exception as e:
-                    error_msg = f"執行工具 {name} 時發生錯誤: {str(e)}"
-                    logger.error(f"❌ {error_msg}")
-                    return error_msg
+                # 未提供的可選參數不發送給服務器
+                kwargs = {k: v for k, v in kwargs.items() if v is not None}
 
-            # 創建同步版本（LangChain 需要）
-            def sync_wrapper(*args, **kwargs) -> str:
-                """同步工具調用包裝器"""
-                return asyncio.run(tool_wrapper(*args, **kwargs))
+                result = await call_wazuh_tool(mcp_client, name, kwargs, cache, on_progress, on_result)
 
-            return sync_wrapper, tool_wrapper
+                # 提取文本內容
+                if result and "content" in result:
+                    text = result_text(result)
+                    if text is None:
+                        return "無返回結果"
+                    return compactor.compact(name, kwargs, text) if compactor is not None else text
+                else:
+                    return "工具執行完成但無返回數據"
 
-        # 創建工具描述
-        description = tool_info["description"]
-        parameters = tool_info.get("parameters", {})
+            return invoke_tool
 
-        # 構建參數說明
-        if parameters:
-            param_desc = "\n參數:\n"
-            for param_name, param_info in parameters.items():
-                required = param_info.get("required", False)
-                desc = param_info.get("description", "")
-                param_desc += f"  - {param_name}: {desc} {'(必填)' if required else '(可選)'}\n"
-            description += param_desc
+        # 優先使用本地調校過的中文描述，參數說明由 args_schema 提供
+        static_info = WazToolConfig.WAZUH_TOOLS.get(tool_name, {})
+        description = static_info.get("description") or definition.get("description") or tool_name
 
         # 創建 LangChain 工具
-        sync_wrapper, async_wrapper = make_tool_wrappers(tool_name)
-        tool = Tool(
-            name=tool_name,
-            description=description,
-            func=sync_wrapper,
-            coroutine=async_wrapper
+        tool = make_structured_tool(
+            tool_name,
+            description,
+            build_args_schema(tool_name, definition.get("inputSchema", {})),
+            coro_fn=make_invoke_tool(tool_name)
         )
 
         tools.append(tool)
@@ -192,20 +413,1145 @@ def create_wazuh_tools(mcp_client: MCPClient) -> List[Tool]:
     return tools
 
 
+class FullResultInput(BaseModel):
+    """get_full_tool_result 的參數"""
+    handle: str = Field(description="壓縮結果末尾給出的完整結果句柄（例如 res-1a2b3c4d5e6f）")
+    offset: int = Field(default=0, description="起始字符位置（默認 0）")
+    max_chars: int = Field(default=6000, description="本次讀取的最大字符數（默認 6000）")
+
+
+def create_full_result_tool(store: ResultStore, max_chars_limit: int = 20000) -> BaseTool:
+    """
+    創建按句柄分段讀取完整工具結果的工具
+
+    Args:
+        store: 保存完整結果的 ResultStore
+        max_chars_limit: 單次讀取的字符上限
+
+    Returns:
+        LangChain 工具
+    """
+    def read_full_result(handle: str, offset: int = 0, max_chars: int = 6000) -> str:
+        entry = store.get(handle.strip())
+        if entry is None:
+            return f"找不到結果句柄 {handle}，結果可能已過期，請重新調用原工具"
+
+        text = entry["text"]
+        offset = max(offset, 0)
+        max_chars = min(max(max_chars, 1), max_chars_limit)
+        chunk = text[offset:offset + max_chars]
+        end = offset + len(chunk)
+
+        header = f"[{entry['tool']}] 完整結果第 {offset}-{end} 字符，共 {len(text)} 字符"
+        footer = f"\n…繼續讀取請使用 offset={end}" if end < len(text) else ""
+        return f"{header}\n{chunk}{footer}"
+
+    return make_structured_tool(
+        "get_full_tool_result",
+        "按句柄分段讀取被壓縮的 Wazuh 工具完整結果。只在壓縮後的摘要不足以回答問題時使用。",
+        FullResultInput,
+        func=read_full_result
+    )
+
+
+def _numbers_for(record: Dict[str, str], keyword: str) -> int:
+    """累加字段名包含 keyword 的所有數值字段"""
+    total = 0
+    for key, value in record.items():
+        if keyword in key.lower():
+            match = re.search(r"-?\d+", value.replace(",", ""))
+            if match:
+                total += int(match.group())
+    return total
+
+
+class FleetScanner:
+    """
+    全機群掃描
+
+    先獲取代理列表，再以有限併發對每個代理調用同一個工具，在截止時間內合併為
+    一個排序後的結果，把 Agent 的 N 次工具迭代變成一次工具調用。
+    """
+
+    def __init__(
+        self,
+        mcp_client: MCPClient,
+        cache: Optional[ToolResultCache] = None,
+        concurrency: int = WazToolConfig.FLEET_CONCURRENCY,
+        deadline: float = WazToolConfig.FLEET_DEADLINE,
+        max_agents: int = WazToolConfig.FLEET_MAX_AGENTS,
+        on_result: Optional[Callable[[str, Dict[str, Any], Dict[str, Any]], None]] = None
+    ):
+        """
+        初始化掃描器
+
+        Args:
+            mcp_client: MCP 客戶端實例
+            cache: 可選的結果緩存（與單代理工具共用）
+            concurrency: 同時進行的代理調用數
+            deadline: 整次掃描（包括獲取代理列表）的截止秒數，超時的代理計為未完成
+            max_agents: 最多掃描的代理數
+            on_result: 可選的結果回調，見 call_wazuh_tool
+        """
+        self.mcp_client = mcp_client
+        self.cache = cache
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.max_agents = max_agents
+        self.on_result = on_result
+
+    def start_deadline(self) -> float:
+        """從現在開始計算整次掃描的截止時間（事件循環時間）"""
+        return asyncio.get_running_loop().time() + self.deadline
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        """距截止時間的剩餘秒數"""
+        return max(0.0, deadline - asyncio.get_running_loop().time())
+
+    async def list_agents(self, status: Optional[str] = "active", deadline: Optional[float] = None) -> List[Tuple[str, str]]:
+        """
+        獲取代理列表
+
+        Args:
+            status: 代理狀態過濾，為 None 時返回全部
+            deadline: 截止時間（start_deadline 的返回值），為 None 時從現在開始計算
+
+        Returns:
+            [(代理 ID, 代理名稱), ...]
+
+        Raises:
+            RuntimeError: 獲取失敗或超過截止時間
+        """
+        arguments: Dict[str, Any] = {"limit": self.max_agents}
+        if status:
+            arguments["status"] = status
+
+        deadline = deadline if deadline is not None else self.start_deadline()
+        try:
+            result = await asyncio.wait_for(
+                call_wazuh_tool(self.mcp_client, "get_wazuh_agents", arguments, self.cache, on_result=self.on_result),
+                timeout=self._remaining(deadline)
+            )
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"獲取代理列表超過掃描截止時間（{self.deadline:g} 秒）")
+        text = result_text(result) or ""
+        if result.get("isError"):
+            raise RuntimeError(text or "獲取代理列表失敗")
+
+        agents = []
+        for record in parse_records(text)[1]:
+            agent_id = record_field(record, "agent id", "id")
+            if agent_id:
+                agents.append((agent_id.split()[0], record_field(record, "name", "agent name") or ""))
+        return agents
+
+    async def fan_out(
+        self,
+        agents: List[Tuple[str, str]],
+        tool_name: str,
+        extra_arguments: Optional[Dict[str, Any]] = None,
+        deadline: Optional[float] = None,
+        use_cache: bool = True
+    ) -> Tuple[Dict[str, List[Dict[str, str]]], Dict[str, str], List[str]]:
+        """
+        對每個代理併發調用工具
+
+        Args:
+            agents: [(代理 ID, 代理名稱), ...]
+            tool_name: 工具名稱（需接受 agent_id 參數）
+            extra_arguments: 附加的工具參數
+            deadline: 截止時間（start_deadline 的返回值），為 None 時從現在開始計算
+            use_cache: 是否使用結果緩存，需要當前狀態時（如快照比較）設為 False
+
+        Returns:
+            (代理 ID -> 解析後的記錄, 代理 ID -> 錯誤信息, 截止時仍未完成的代理 ID)
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        cache = self.cache if use_cache else None
+
+        async def scan(agent_id: str) -> List[Dict[str, str]]:
+            async with semaphore:
+                arguments = {"agent_id": agent_id, **(extra_arguments or {})}
+                result = await call_wazuh_tool(
+                    self.mcp_client, tool_name, arguments, cache, on_result=self.on_result
+                )
+            text = result_text(result) or ""
+            if result.get("isError"):
+                raise RuntimeError(text or "工具執行失敗")
+            return parse_records(text)[1]
+
+        tasks = {asyncio.ensure_future(scan(agent_id)): agent_id for agent_id, _ in agents}
+        if not tasks:
+            return {}, {}, []
+
+        deadline = deadline if deadline is not None else self.start_deadline()
+        done, pending = await asyncio.wait(tasks, timeout=self._remaining(deadline))
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+        results: Dict[str, List[Dict[str, str]]] = {}
+        failed: Dict[str, str] = {}
+        for task in done:
+            agent_id = tasks[task]
+            if task.exception() is not None:
+                failed[agent_id] = " ".join(str(task.exception()).split())[:120]
+            else:
+                results[agent_id] = task.result()
+
+        unfinished = sorted(tasks[task] for task in pending)
+        logger.info(
+            f"🛰️  {tool_name} 全機群掃描: 成功 {len(results)}，失敗 {len(failed)}，"
+            f"超時 {len(unfinished)}（共 {len(tasks)} 個代理）"
+        )
+        return results, failed, unfinished
+
+    @staticmethod
+    def _coverage(
+        title: str,
+        agents: List[Tuple[str, str]],
+        results: Dict[str, Any],
+        failed: Dict[str, str],
+        unfinished: List[str]
+    ) -> List[str]:
+        """掃描覆蓋情況的標題行"""
+        return [
+            f"[{title}] 掃描 {len(agents)} 個代理：成功 {len(results)}，失敗 {len(failed)}，超時 {len(unfinished)}"
+        ]
+
+    @staticmethod
+    def _problems(failed: Dict[str, str], unfinished: List[str]) -> List[str]:
+        """失敗和超時代理的說明行"""
+        lines = []
+        if failed:
+            lines.append("失敗的代理: " + "; ".join(f"{agent_id} ({error})" for agent_id, error in sorted(failed.items())[:10]))
+        if unfinished:
+            lines.append("截止時間內未完成: " + ", ".join(unfinished[:20]))
+        return lines
+
+    async def critical_vulnerabilities(self, status: Optional[str] = "active", top: int = 20) -> str:
+        """
+        掃描全機群的關鍵漏洞
+
+        Returns:
+            按關鍵漏洞數排序的代理列表和影響代理最多的 CVE
+        """
+        deadline = self.start_deadline()
+        agents = await self.list_agents(status, deadline)
+        results, failed, unfinished = await self.fan_out(agents, "get_wazuh_critical_vulnerabilities", deadline=deadline)
+        names = dict(agents)
+
+        cve_agents: Dict[str, set] = defaultdict(set)
+        cve_titles: Dict[str, str] = {}
+        per_agent = []
+        for agent_id, records in results.items():
+            cves = []
+            for record in records:
+                cve = record_field(record, "cve", "cve id", "id")
+                if not cve:
+                    continue
+                cves.append(cve)
+                cve_agents[cve].add(agent_id)
+                cve_titles.setdefault(cve, record_field(record, "title", "name", "description") or "")
+            per_agent.append((agent_id, len(set(cves)), cves))
+
+        per_agent.sort(key=lambda item: (-item[1], item[0]))
+        lines = self._coverage("fleet_critical_vulnerabilities", agents, results, failed, unfinished)
+        affected = [item for item in per_agent if item[1] > 0]
+        lines.append(f"{len(affected)} 個代理存在關鍵漏洞，共 {len(cve_agents)} 個不同的 CVE")
+
+        if affected:
+            lines.append("| 代理 | 名稱 | 關鍵漏洞數 | 示例 CVE |")
+            lines.append("|---|---|---|---|")
+            for agent_id, count, cves in affected[:top]:
+                lines.append(f"| {agent_id} | {names.get(agent_id, '')} | {count} | {', '.join(cves[:3])} |")
+
+            lines.append("影響代理最多的 CVE:")
+            lines.append("| CVE | 受影響代理數 | 標題 |")
+            lines.append("|---|---|---|")
+            ranked = sorted(cve_agents.items(), key=lambda item: (-len(item[1]), item[0]))
+            for cve, agent_ids in ranked[:top]:
+                lines.append(f"| {cve} | {len(agent_ids)} | {cve_titles.get(cve, '')[:80]} |")
+
+        lines.extend(self._problems(failed, unfinished))
+        return "\n".join(lines)
+
+    async def listening_ports(self, status: Optional[str] = "active", protocol: str = "tcp", top: int = 20) -> str:
+        """
+        掃描全機群的監聽端口
+
+        Returns:
+            按暴露代理數排序的端口列表
+        """
+        deadline = self.start_deadline()
+        agents = await self.list_agents(status, deadline)
+        results, failed, unfinished = await self.fan_out(
+            agents, "get_wazuh_agent_ports", {"protocol": protocol, "state": "LISTENING"}, deadline
+        )
+
+        port_agents: Dict[str, set] = defaultdict(set)
+        port_processes: Dict[str, set] = defaultdict(set)
+        for agent_id, records in results.items():
+            for record in records:
+                port = record_field(record, "local port", "port")
+                if not port:
+                    local = record_field(record, "local", "local address", "local ip") or ""
+                    match = re.search(r":(\d+)\s*$", local)
+                    port = match.group(1) if match else None
+                if not port:
+                    continue
+                port_agents[port].add(agent_id)
+                process = record_field(record, "process", "process name")
+                if process:
+                    port_processes[port].add(process.split(" (")[0])
+
+        lines = self._coverage("fleet_listening_ports", agents, results, failed, unfinished)
+        lines.append(f"共發現 {len(port_agents)} 個不同的 {protocol} 監聽端口")
+        if port_agents:
+            lines.append("| 端口 | 暴露代理數 | 進程 | 代理 |")
+            lines.append("|---|---|---|---|")
+            ranked = sorted(port_agents.items(), key=lambda item: (-len(item[1]), int(item[0]) if item[0].isdigit() else 0))
+            for port, agent_ids in ranked[:top]:
+                processes = ", ".join(sorted(port_processes.get(port, set()))[:3])
+                agent_list = ", ".join(sorted(agent_ids)[:5]) + (" …" if len(agent_ids) > 5 else "")
+                lines.append(f"| {port} | {len(agent_ids)} | {processes} | {agent_list} |")
+
+        lines.extend(self._problems(failed, unfinished))
+        return "\n".join(lines)
+
+    async def log_collector_stats(self, status: Optional[str] = "active", top: int = 20) -> str:
+        """
+        掃描全機群的日誌收集器統計
+
+        Returns:
+            按丟棄事件數排序的代理列表
+        """
+        deadline = self.start_deadline()
+        agents = await self.list_agents(status, deadline)
+        results, failed, unfinished = await self.fan_out(agents, "get_wazuh_log_collector_stats", deadline=deadline)
+        names = dict(agents)
+
+        rows = []
+        for agent_id, records in results.items():
+            rows.append((
+                agent_id,
+                sum(_numbers_for(record, "drop") for record in records),
+                sum(_numbers_for(record, "event") for record in records),
+                sum(_numbers_for(record, "byte") for record in records),
+                len(records)
+            ))
+        rows.sort(key=lambda row: (-row[1], -row[2], row[0]))
+
+        lines = self._coverage("fleet_log_collector_stats", agents, results, failed, unfinished)
+        dropping = sum(1 for row in rows if row[1] > 0)
+        lines.append(f"{dropping} 個代理存在丟棄事件")
+        if rows:
+            lines.append("| 代理 | 名稱 | 丟棄 | 事件 | 字節 | 日誌目標數 |")
+            lines.append("|---|---|---|---|---|---|")
+            for agent_id, drops, events, size, targets in rows[:top]:
+                lines.append(f"| {agent_id} | {names.get(agent_id, '')} | {drops} | {events} | {size} | {targets} |")
+
+        lines.extend(self._problems(failed, unfinished))
+        return "\n".join(lines)
+
+
+class FleetScanInput(BaseModel):
+    """全機群掃描工具的參數"""
+    status: Optional[str] = Field(default="active", description="只掃描該狀態的代理（默認 active）")
+    top: int = Field(default=20, description="結果中最多列出的條目數（默認 20）")
+
+
+class FleetPortScanInput(FleetScanInput):
+    """全機群端口掃描工具的參數"""
+    protocol: str = Field(default="tcp", description="協議（tcp, udp）")
+
+
+def create_fleet_tools(scanner: FleetScanner) -> List[BaseTool]:
+    """
+    創建全機群掃描工具
+
+    Args:
+        scanner: FleetScanner 實例
+
+    Returns:
+        LangChain 工具列表
+    """
+    specs = [
+        (
+            "fleet_critical_vulnerabilities",
+            "一次掃描所有代理的關鍵（Critical）漏洞，返回按漏洞數排序的代理和影響最廣的 CVE。"
+            "回答「哪些代理有關鍵漏洞」時使用，無需逐個代理調用。",
+            FleetScanInput,
+            scanner.critical_vulnerabilities
+        ),
+        (
+            "fleet_listening_ports",
+            "一次掃描所有代理的監聽端口，返回按暴露代理數排序的端口及對應進程。",
+            FleetPortScanInput,
+            scanner.listening_ports
+        ),
+        (
+            "fleet_log_collector_stats",
+            "一次獲取所有代理的日誌收集器統計，返回按丟棄事件數排序的代理。",
+            FleetScanInput,
+            scanner.log_collector_stats
+        ),
+    ]
+
+    return [
+        make_structured_tool(name, description, args_schema, coro_fn=scan)
+        for name, description, args_schema, scan in specs
+    ]
+
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    """把分頁狀態編碼為不透明的游標字符串"""
+    raw = json.dumps(state, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    解碼游標
+
+    Raises:
+        ValueError: 游標格式無效
+    """
+    try:
+        padded = cursor.strip() + "=" * (-len(cursor.strip()) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise ValueError(f"無效的游標: {cursor}")
+    if not isinstance(state, dict) or "o" not in state:
+        raise ValueError(f"無效的游標: {cursor}")
+    return state
+
+
+class WazuhPaginator:
+    """
+    Wazuh 列表工具的游標分頁
+
+    工具模式帶 offset 參數時每頁單獨向服務器請求；否則整個列表只請求一次並保存在
+    ResultStore 中，後續頁面從本地切片。游標對調用方不透明。
+    """
+
+    def __init__(
+        self,
+        mcp_client: MCPClient,
+        cache: Optional[ToolResultCache] = None,
+        store: Optional[ResultStore] = None,
+        tool_definitions: Optional[List[Dict[str, Any]]] = None,
+        on_result: Optional[Callable[[str, Dict[str, Any], Dict[str, Any]], None]] = None
+    ):
+        """
+        初始化分頁器
+
+        Args:
+            mcp_client: MCP 客戶端實例
+            cache: 可選的結果緩存
+            store: 保存完整列表的 ResultStore（默認創建新的存儲）
+            tool_definitions: tools/list 格式的工具定義（默認使用 WazToolConfig 的靜態定義）
+            on_result: 可選的結果回調，見 call_wazuh_tool
+        """
+        self.mcp_client = mcp_client
+        self.cache = cache
+        self.store = store if store is not None else ResultStore()
+        self.on_result = on_result
+        self._properties: Dict[str, Dict[str, Any]] = {}
+        self._args_schemas: Dict[str, Type[BaseModel]] = {}
+        self.update_definitions(tool_definitions or WazToolConfig.static_tool_definitions())
+
+    def update_definitions(self, tool_definitions: List[Dict[str, Any]]):
+        """更新工具定義（工具發現後調用），並為可分頁的工具生成參數模型"""
+        self._properties = {
+            definition["name"]: definition.get("inputSchema", {}).get("properties", {})
+            for definition in tool_definitions
+        }
+        self._args_schemas = {
+            definition["name"]: build_args_schema(definition["name"], definition.get("inputSchema", {}))
+            for definition in tool_definitions
+            if "limit" in self._properties[definition["name"]]
+        }
+
+    def validate_arguments(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        按工具模式校驗分頁參數
+
+        Returns:
+            轉換類型並去掉空值後的參數
+
+        Raises:
+            ValueError: 參數不屬於該工具或不合法
+        """
+        unknown = sorted(set(arguments) - set(self._properties.get(tool_name, {})))
+        if unknown:
+            raise ValueError(
+                f"工具 {tool_name} 不接受參數 {', '.join(unknown)}，"
+                f"可用參數: {', '.join(self._properties.get(tool_name, {}))}"
+            )
+        try:
+            validated = self._args_schemas[tool_name].model_validate(arguments)
+        except ValidationError as e:
+            raise ValueError(f"工具 {tool_name} 的參數校驗失敗，請修正後重試: {e}")
+        return validated.model_dump(exclude_none=True)
+
+    def fetch_limit(self, tool_name: str) -> int:
+        """本地分頁時一次請求的記錄數：工具模式聲明的 limit 最大值，否則為 PAGE_FETCH_LIMIT"""
+        maximum = self._properties.get(tool_name, {}).get("limit", {}).get("maximum")
+        return int(maximum) if maximum else WazToolConfig.PAGE_FETCH_LIMIT
+
+    @property
+    def pageable_tools(self) -> List[str]:
+        """支持分頁的列表工具（帶 limit 參數）"""
+        return [name for name, properties in self._properties.items() if "limit" in properties]
+
+    def supports_offset(self, tool_name: str) -> bool:
+        """服務器端是否支持 offset 分頁"""
+        return "offset" in self._properties.get(tool_name, {})
+
+    async def fetch_page(
+        self,
+        tool_name: Optional[str] = None,
+        arguments: Optional[Dict[str, Any]] = None,
+        cursor: Optional[str] = None,
+        page_size: int = 50
+    ) -> Dict[str, Any]:
+        """
+        獲取一頁記錄
+
+        Args:
+            tool_name: 工具名稱（提供 cursor 時忽略）
+            arguments: 工具參數（提供 cursor 時忽略）
+            cursor: 上一頁返回的游標，為 None 時從第一頁開始
+            page_size: 每頁記錄數
+
+        Returns:
+            {"tool", "records", "offset", "total", "truncated", "next_cursor"}，total 未知時為 None；
+            truncated 表示列表達到請求的 limit，total 可能小於實際總數
+
+        Raises:
+            ValueError: 工具不支持分頁、游標無效或已過期
+            RuntimeError: 工具調用失敗
+        """
+        page_size = max(page_size, 1)
+
+        if cursor:
+            state = decode_cursor(cursor)
+            offset = int(state["o"])
+            if "h" in state:
+                return self._local_page(state["h"], offset, page_size)
+            tool_name, arguments = state["t"], state.get("a", {})
+        else:
+            offset = 0
+            arguments = {k: v for k, v in (arguments or {}).items() if v is not None}
+            if tool_name not in self.pageable_tools:
+                raise ValueError(f"工具 {tool_name} 不支持分頁，可分頁的工具: {', '.join(self.pageable_tools)}")
+            arguments = self.validate_arguments(tool_name, arguments)
+
+        if not self.supports_offset(tool_name):
+            # 服務器只支持 limit：整個列表請求一次，之後從本地切片；
+            # 顯式指定 limit，避免服務器默認值（通常為 300）悄悄截斷列表
+            arguments = {**arguments, "limit": arguments.get("limit") or self.fetch_limit(tool_name)}
+            result = await call_wazuh_tool(
+                self.mcp_client, tool_name, arguments, self.cache, on_result=self.on_result
+            )
+            text = result_text(result) or ""
+            if result.get("isError"):
+                raise RuntimeError(text or f"工具 {tool_name} 執行失敗")
+            handle = self.store.put(tool_name, arguments, text)
+            return self._local_page(handle, offset, page_size)
+
+        page_arguments = {**arguments, "offset": offset, "limit": page_size}
+        result = await call_wazuh_tool(
+            self.mcp_client, tool_name, page_arguments, self.cache, on_result=self.on_result
+        )
+        text = result_text(result) or ""
+        if result.get("isError"):
+            raise RuntimeError(text or f"工具 {tool_name} 執行失敗")
+
+        records = parse_records(text)[1]
+        next_cursor = None
+        if len(records) >= page_size:
+            next_cursor = encode_cursor({"t": tool_name, "a": arguments, "o": offset + len(records)})
+        return {
+            "tool": tool_name, "records": records, "offset": offset,
+            "total": None, "truncated": False, "next_cursor": next_cursor
+        }
+
+    def _local_page(self, handle: str, offset: int, page_size: int) -> Dict[str, Any]:
+        """從 ResultStore 中保存的完整列表切出一頁"""
+        records = self.store.records(handle)
+        entry = self.store.get(handle)
+        if records is None or entry is None:
+            raise ValueError("游標已過期，請重新開始分頁")
+
+        page = records[offset:offset + page_size]
+        end = offset + len(page)
+        next_cursor = encode_cursor({"h": handle, "o": end}) if end < len(records) else None
+        limit = entry["arguments"].get("limit")
+        return {
+            "tool": entry["tool"], "records": page, "offset": offset, "total": len(records),
+            "truncated": bool(limit) and len(records) >= limit, "next_cursor": next_cursor
+        }
+
+
+class PageInput(BaseModel):
+    """get_wazuh_page 的參數"""
+    tool_name: Optional[str] = Field(default=None, description="要分頁的 Wazuh 列表工具名稱（首頁必填）")
+    arguments: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="傳給該工具的參數，按該工具的參數模式校驗（例如 {\"agent_id\": \"001\"}）"
+    )
+    cursor: Optional[str] = Field(default=None, description="上一頁返回的游標；提供時忽略 tool_name 和 arguments")
+    page_size: int = Field(default=30, description="每頁記錄數（默認 30）")
+
+
+def create_page_tool(paginator: WazuhPaginator) -> BaseTool:
+    """
+    創建游標分頁工具
+
+    Args:
+        paginator: WazuhPaginator 實例
+
+    Returns:
+        LangChain 工具
+    """
+    async def read_page(
+        tool_name: Optional[str] = None,
+        arguments: Optional[Dict[str, Any]] = None,
+        cursor: Optional[str] = None,
+        page_size: int = 30
+    ) -> str:
+        try:
+            page = await paginator.fetch_page(tool_name, arguments, cursor, page_size)
+        except (ValueError, RuntimeError) as e:
+            return str(e)
+
+        start = page["offset"]
+        end = start + len(page["records"])
+        if page["truncated"]:
+            total = f"，已獲取 {page['total']} 條（達到請求上限，實際總數可能更多）"
+        else:
+            total = f"，共 {page['total']} 條" if page["total"] is not None else ""
+        lines = [f"[{page['tool']}] 第 {start + 1}-{end} 條{total}"]
+        for record in page["records"]:
+            lines.append("; ".join(f"{key}: {value}" for key, value in record.items()))
+        if page["next_cursor"]:
+            lines.append(f"下一頁游標: {page['next_cursor']}")
+        elif page["truncated"]:
+            lines.append("已到已獲取數據的末尾，但列表可能被截斷；需要完整數據時請縮小過濾條件後重新分頁")
+        else:
+            lines.append("已到最後一頁")
+        return "\n".join(lines)
+
+    return make_structured_tool(
+        "get_wazuh_page",
+        "分頁讀取大型 Wazuh 列表（進程、端口、漏洞、規則、日誌等）。首頁提供 tool_name 和 arguments，"
+        "之後用返回的游標讀取下一頁；找到所需信息後即可停止。",
+        PageInput,
+        coro_fn=read_page
+    )
+
+
+class LocalAlertFilterInput(BaseModel):
+    """本地警報查詢的過濾參數"""
+    since_hours: Optional[float] = Field(default=24, description="只查詢最近多少小時的警報（默認 24）")
+    until_hours_ago: Optional[float] = Field(default=None, description="時間窗口結束於多少小時前（查詢歷史窗口時使用）")
+    agent_id: Optional[str] = Field(default=None, description="代理 ID（例如 '001'）")
+    rule_id: Optional[str] = Field(default=None, description="規則 ID")
+    min_level: Optional[int] = Field(default=None, description="最低規則級別")
+    refresh: bool = Field(default=False, description="是否先強制從 Wazuh 增量同步")
+
+
+class LocalAlertQueryInput(LocalAlertFilterInput):
+    """query_local_alerts 的參數"""
+    text: Optional[str] = Field(default=None, description="描述中包含的關鍵詞")
+    limit: int = Field(default=30, description="返回的最大警報數（默認 30）")
+
+
+class LocalAlertAggregateInput(LocalAlertFilterInput):
+    """aggregate_local_alerts 的參數"""
+    group_by: Literal["rule", "agent", "level", "hour", "day"] = Field(default="rule", description="聚合維度")
+    top: int = Field(default=20, description="返回的最大分組數（默認 20）")
+
+
+class AlertTrendInput(LocalAlertFilterInput):
+    """analyze_alert_trends 的參數"""
+    analysis: Literal["top", "top_per_agent", "histogram", "percentiles"] = Field(
+        default="top",
+        description="top: 數量最多的分組；top_per_agent: 每個代理內數量最多的分組；"
+                    "histogram: 按時間桶統計；percentiles: 級別和每桶警報數的百分位"
+    )
+    group_by: Literal["rule", "agent", "level"] = Field(default="rule", description="分組維度")
+    bucket_minutes: int = Field(default=60, description="時間桶分鐘數（默認 60）")
+    top: int = Field(default=10, description="返回的最大分組數（默認 10）")
+
+
+def _format_epoch(ts: float) -> str:
+    """把 epoch 秒格式化為 UTC 時間"""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def create_alert_store_tools(
+    store: AlertStore,
+    mcp_client: MCPClient,
+    sync_interval: float = WazToolConfig.ALERT_SYNC_INTERVAL
+) -> List[BaseTool]:
+    """
+    創建本地警報存儲的查詢和聚合工具
+
+    查詢窗口包含最近時段且距上次同步超過 sync_interval 時先增量同步；
+    窗口完全早於上次同步時間的歷史查詢不訪問 Wazuh。
+
+    Args:
+        store: AlertStore 實例
+        mcp_client: MCP 客戶端實例
+        sync_interval: 自動同步間隔秒數
+
+    Returns:
+        LangChain 工具列表
+    """
+    sync_lock: Optional[asyncio.Lock] = None
+    analytics = AlertAnalytics(store)
+
+    async def fetch_alerts(limit: int) -> str:
+        result = await call_wazuh_tool(mcp_client, "get_wazuh_alert_summary", {"limit": limit})
+        text = result_text(result) or ""
+        if result.get("isError"):
+            raise RuntimeError(text or "獲取警報失敗")
+        return text
+
+    async def ensure_fresh(until: Optional[float], refresh: bool) -> Optional[str]:
+        """按需同步，返回同步失敗時的提示"""
+        nonlocal sync_lock
+        if not refresh:
+            if until is not None and until <= store.last_sync:
+                return None
+            if time.time() - store.last_sync < sync_interval:
+                return None
+
+        if sync_lock is None:
+            sync_lock = asyncio.Lock()
+        async with sync_lock:
+            # 等鎖期間其他調用可能已完成同步
+            if not refresh and time.time() - store.last_sync < sync_interval:
+                return None
+            try:
+                await store.sync(fetch_alerts)
+            except Exception as e:
+                logger.warning(f"⚠️  警報同步失敗，使用本地數據: {e}")
+                return f"（同步失敗，結果僅包含本地已有的警報: {e}）"
+        return None
+
+    def window_filters(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.time()
+        # StructuredTool 只傳入模型給出的參數，省略 since_hours 時需在此補上默認窗口
+        since_hours = kwargs.get("since_hours", 24)
+        until_hours_ago = kwargs.get("until_hours_ago")
+        return {
+            "since": now - since_hours * 3600 if since_hours else None,
+            "until": now - until_hours_ago * 3600 if until_hours_ago else None,
+            "agent_id": kwargs.get("agent_id"),
+            "rule_id": kwargs.get("rule_id"),
+            "min_level": kwargs.get("min_level"),
+        }
+
+    def describe_window(kwargs: Dict[str, Any]) -> str:
+        since_hours = kwargs.get("since_hours", 24)
+        until_hours_ago = kwargs.get("until_hours_ago")
+        if since_hours and until_hours_ago:
+            return f"{since_hours:g} 小時前至 {until_hours_ago:g} 小時前"
+        if since_hours:
+            return f"最近 {since_hours:g} 小時"
+        if until_hours_ago:
+            return f"{until_hours_ago:g} 小時前及更早"
+        return "全部時間"
+
+    async def query_alerts(**kwargs) -> str:
+        filters = window_filters(kwargs)
+        note = await ensure_fresh(filters["until"], kwargs.get("refresh", False))
+        filters["text"] = kwargs.get("text")
+
+        total = store.count(**filters)
+        rows = store.query(limit=kwargs.get("limit", 30), **filters)
+        lines = [f"[query_local_alerts] 符合條件 {total} 條，顯示最新 {len(rows)} 條"]
+        if note:
+            lines.append(note)
+        if rows:
+            lines.append("| 時間 | 級別 | 規則 | 代理 | 描述 |")
+            lines.append("|---|---|---|---|---|")
+            for row in rows:
+                agent = row["agent_id"] or row["agent_name"] or ""
+                lines.append(
+                    f"| {row['timestamp']} | {row['level'] if row['level'] is not None else ''} | "
+                    f"{row['rule_id'] or ''} | {agent} | {(row['description'] or '')[:80]} |"
+                )
+        return "\n".join(lines)
+
+    async def aggregate_alerts(**kwargs) -> str:
+        filters = window_filters(kwargs)
+        note = await ensure_fresh(filters["until"], kwargs.get("refresh", False))
+        group_by = kwargs.get("group_by", "rule")
+
+        total = store.count(**filters)
+        groups = store.aggregate(group_by=group_by, top=kwargs.get("top", 20), **filters)
+        lines = [f"[aggregate_local_alerts] 符合條件 {total} 條，按 {group_by} 分組"]
+        if note:
+            lines.append(note)
+        if groups:
+            lines.append(f"| {group_by} | 數量 | 最高級別 | 示例描述 |")
+            lines.append("|---|---|---|---|")
+            for group in groups:
+                lines.append(
+                    f"| {group['key'] if group['key'] is not None else '(無)'} | {group['count']} | "
+                    f"{group['max_level'] if group['max_level'] is not None else ''} | {(group['sample'] or '')[:60]} |"
+                )
+        return "\n".join(lines)
+
+    async def analyze_trends(**kwargs) -> str:
+        filters = window_filters(kwargs)
+        note = await ensure_fresh(filters["until"], kwargs.get("refresh", False))
+        analytics.refresh()
+
+        columns = analytics.columns
+        mask = columns.mask(**filters)
+        analysis = kwargs.get("analysis", "top")
+        group_by = kwargs.get("group_by", "rule")
+        top = kwargs.get("top", 10)
+        bucket_seconds = max(kwargs.get("bucket_minutes", 60), 1) * 60
+        # 時間桶一直延伸到窗口結束，最近沒有警報的時段也會顯示為 0
+        window_end = filters["until"] or time.time()
+
+        lines = [
+            f"[analyze_alert_trends] {analysis}，時間窗口: {describe_window(kwargs)}，"
+            f"符合條件 {int(mask.sum())} 條警報"
+        ]
+        if note:
+            lines.append(note)
+
+        if analysis == "top":
+            lines.append(f"| {group_by} | 數量 | 最高級別 |")
+            lines.append("|---|---|---|")
+            for group in columns.top_k(group_by, top, mask):
+                lines.append(f"| {group['key']} | {group['count']} | {group['max_level']} |")
+
+        elif analysis == "top_per_agent":
+            inner = group_by if group_by != "agent" else "rule"
+            per_agent = columns.top_k_per_group("agent", inner, 3, mask)
+            busiest = [group["key"] for group in columns.top_k("agent", top, mask)]
+            for agent_id in busiest:
+                entries = ", ".join(
+                    f"{entry['key']}×{entry['count']}(L{entry['max_level']})" for entry in per_agent.get(agent_id, [])
+                )
+                lines.append(f"{agent_id}: {entries}")
+
+        elif analysis == "histogram":
+            starts, counts = columns.histogram(bucket_seconds, mask, filters["since"], window_end)
+            peak = int(counts.max()) if len(counts) else 0
+            shown = list(zip(starts, counts))[-72:]
+            if len(starts) > len(shown):
+                lines.append(f"（只顯示最近 {len(shown)} 個時間桶，共 {len(starts)} 個）")
+            for start, count in shown:
+                bar = "▇" * int(round(20 * count / peak)) if peak else ""
+                lines.append(f"{_format_epoch(start)}  {int(count):>6}  {bar}")
+
+        else:
+            stats = columns.percentiles(bucket_seconds, mask, since=filters["since"], until=window_end)
+            if "level" in stats:
+                lines.append("級別: " + ", ".join(f"{k}={v:g}" for k, v in stats["level"].items()))
+            if "per_bucket" in stats:
+                lines.append(
+                    f"每 {bucket_seconds // 60} 分鐘警報數: "
+                    + ", ".join(f"{k}={v:.1f}" for k, v in stats["per_bucket"].items())
+                )
+        return "\n".join(lines)
+
+    specs = [
+        (
+            "query_local_alerts",
+            "在本地警報庫中按時間窗口、代理、規則、級別或關鍵詞過濾警報，毫秒級返回。"
+            "查詢歷史警報時優先使用此工具而不是 get_wazuh_alert_summary。",
+            LocalAlertQueryInput,
+            query_alerts
+        ),
+        (
+            "aggregate_local_alerts",
+            "在本地警報庫中按規則、代理、級別、小時或天統計警報數量，用於回答趨勢和排行類問題。",
+            LocalAlertAggregateInput,
+            aggregate_alerts
+        ),
+        (
+            "analyze_alert_trends",
+            "對本地警報做向量化統計：Top-K 規則或代理、每個代理的 Top 規則、時間直方圖和百分位。"
+            "回答「過去 24 小時各代理觸發最多的規則」等趨勢問題時使用，只返回聚合數字。",
+            AlertTrendInput,
+            analyze_trends
+        ),
+    ]
+
+    return [
+        make_structured_tool(name, description, args_schema, coro_fn=run)
+        for name, description, args_schema, run in specs
+    ]
+
+
+class SnapshotDiffInput(BaseModel):
+    """diff_agent_snapshots 的參數"""
+    agent_id: Optional[str] = Field(default=None, description="代理 ID（例如 '001'）；為空時比較所有活躍代理")
+    kind: Literal["processes", "ports", "all"] = Field(default="all", description="比較進程、端口或兩者")
+    max_items: int = Field(default=20, description="每個代理最多列出的新增或消失條目數（默認 20）")
+
+
+def create_snapshot_tools(store: SnapshotStore, scanner: FleetScanner) -> List[BaseTool]:
+    """
+    創建快照比較工具
+
+    Args:
+        store: SnapshotStore 實例
+        scanner: 用於併發採集的 FleetScanner
+
+    Returns:
+        LangChain 工具列表
+    """
+    async def collect(
+        agents: List[Tuple[str, str]],
+        kind: str,
+        deadline: float
+    ) -> Tuple[Dict[str, List[Dict[str, str]]], Dict[str, str], List[str]]:
+        """採集進程或端口列表；任一查詢失敗的代理不參與比較，避免誤報消失
+
+        快照需要反映當前狀態，繞過結果緩存，否則緩存有效期內的變化會被判斷為無變化。
+        """
+        if kind == "processes":
+            return await scanner.fan_out(
+                agents, "get_wazuh_agent_processes", {"limit": WazToolConfig.SNAPSHOT_LIMIT},
+                deadline=deadline, use_cache=False
+            )
+
+        merged: Dict[str, List[Dict[str, str]]] = defaultdict(list)
+        failed: Dict[str, str] = {}
+        unfinished = set()
+        for query in WazToolConfig.SNAPSHOT_PORT_QUERIES:
+            results, query_failed, query_unfinished = await scanner.fan_out(
+                agents, "get_wazuh_agent_ports", {**query, "limit": WazToolConfig.SNAPSHOT_LIMIT},
+                deadline=deadline, use_cache=False
+            )
+            for agent_id, records in results.items():
+                merged[agent_id].extend(records)
+            failed.update(query_failed)
+            unfinished.update(query_unfinished)
+
+        complete = {
+            agent_id: records for agent_id, records in merged.items()
+            if agent_id not in failed and agent_id not in unfinished
+        }
+        return complete, failed, sorted(unfinished)
+
+    async def diff_snapshots(agent_id: Optional[str] = None, kind: str = "all", max_items: int = 20) -> str:
+        # 代理列表和各次採集共用一個截止時間
+        deadline = scanner.start_deadline()
+        agents = [(agent_id, "")] if agent_id else await scanner.list_agents("active", deadline)
+        kinds = ["processes", "ports"] if kind == "all" else [kind]
+        now = time.time()
+
+        lines = []
+        for snapshot_kind in kinds:
+            results, failed, unfinished = await collect(agents, snapshot_kind, deadline)
+            changed, unchanged, baseline = [], 0, 0
+            for current_agent in sorted(results):
+                diff = store.record(current_agent, snapshot_kind, results[current_agent])
+                if diff["baseline"]:
+                    baseline += 1
+                elif diff["unchanged"] or not (diff["added"] or diff["removed"]):
+                    unchanged += 1
+                else:
+                    changed.append((current_agent, diff))
+
+            lines.append(
+                f"[{snapshot_kind}] {len(changed)} 個代理有變化，{unchanged} 個無變化，"
+                f"{baseline} 個首次建立基線快照"
+            )
+            for current_agent, diff in changed:
+                minutes = (now - diff["previous_at"]) / 60
+                lines.append(
+                    f"{current_agent}（相對 {minutes:.0f} 分鐘前的快照）: "
+                    f"新增 {len(diff['added'])}，消失 {len(diff['removed'])}"
+                )
+                for sign, entries in (("+", diff["added"]), ("-", diff["removed"])):
+                    lines.extend(f"{sign} {entry}" for entry in entries[:max_items])
+                    if len(entries) > max_items:
+                        lines.append(f"{sign} …另有 {len(entries) - max_items} 條")
+            lines.extend(FleetScanner._problems(failed, unfinished))
+        return "\n".join(lines)
+
+    return [make_structured_tool(
+        "diff_agent_snapshots",
+        "採集代理當前的進程和端口列表，與上一次快照比較，只返回新增和消失的進程或連接。"
+        "用於發現可疑的新進程、新監聽端口或新外連；首次調用只建立基線。",
+        SnapshotDiffInput,
+        coro_fn=diff_snapshots
+    )]
+
+
+class CorrelationInput(BaseModel):
+    """correlate_agents 的參數"""
+    ip: Optional[str] = Field(default=None, description="遠程 IP 地址")
+    process: Optional[str] = Field(default=None, description="進程名（不區分大小寫，例如 'nc'）")
+    cmdline: Optional[str] = Field(default=None, description="完整命令行或其 16 位哈希")
+    cve: Optional[str] = Field(default=None, description="CVE ID（例如 'CVE-2024-3094'）")
+    agent_id: Optional[str] = Field(
+        default=None,
+        description="代理 ID；與其他條件同時提供時從結果中排除該代理，單獨提供時列出與它共享 IP、進程或 CVE 的代理"
+    )
+    max_agents: int = Field(default=50, description="每項最多列出的代理數（默認 50）")
+
+
+def create_correlation_tools(index: CorrelationIndex) -> List[BaseTool]:
+    """
+    創建跨代理關聯查詢工具
+
+    查詢只讀取內存索引，不發出 MCP 請求。
+
+    Args:
+        index: 由工具結果回調填充的 CorrelationIndex
+
+    Returns:
+        LangChain 工具列表
+    """
+    def format_agents(agents: List[str], max_agents: int) -> str:
+        shown = ", ".join(agents[:max_agents])
+        return shown + (f" …另有 {len(agents) - max_agents} 個" if len(agents) > max_agents else "")
+
+    def correlate(
+        ip: Optional[str] = None,
+        process: Optional[str] = None,
+        cmdline: Optional[str] = None,
+        cve: Optional[str] = None,
+        agent_id: Optional[str] = None,
+        max_agents: int = 50
+    ) -> str:
+        stats = index.stats()
+        if not stats["agents"]:
+            return (
+                "關聯索引為空。請先運行 diff_agent_snapshots、fleet_listening_ports、fleet_critical_vulnerabilities "
+                "或單代理的進程、端口、漏洞工具採集數據。"
+            )
+
+        criteria = {
+            field: value for field, value in
+            (("ip", ip), ("process", process), ("cmdline", cmdline), ("cve", cve))
+            if value
+        }
+        if not criteria and not agent_id:
+            return "請至少提供 ip、process、cmdline、cve 或 agent_id 之一"
+
+        lines = []
+        if criteria:
+            for field, value in criteria.items():
+                agents = [a for a in index.lookup(field, value) if a != agent_id]
+                lines.append(f"{field}={value}: {len(agents)} 個代理" + (f" — {format_agents(agents, max_agents)}" if agents else ""))
+            if len(criteria) > 1:
+                agents = [a for a in index.intersect(criteria) if a != agent_id]
+                lines.append(f"同時滿足所有條件: {len(agents)} 個代理" + (f" — {format_agents(agents, max_agents)}" if agents else ""))
+        else:
+            related = index.related(agent_id)
+            lines.append(f"與代理 {agent_id} 共享 IP、進程、命令行或 CVE 的代理: {len(related)} 個（忽略過半代理共有的項）")
+            for other, count, examples in related[:max_agents]:
+                lines.append(f"- {other}: {count} 項，例如 " + ", ".join(f"{field}={value}" for field, value in examples))
+
+        keys = stats["keys"]
+        lines.append(
+            f"索引覆蓋 {stats['agents']} 個代理（IP {keys['ip']}、進程 {keys['process']}、"
+            f"命令行 {keys['cmdline']}、CVE {keys['cve']} 個鍵）；未採集過的代理不會出現在結果中"
+        )
+        return "\n".join(lines)
+
+    return [make_structured_tool(
+        "correlate_agents",
+        "在已採集的進程、端口和漏洞結果中查找跨代理關聯：哪些代理連接了同一個遠程 IP、"
+        "運行同一個進程或命令行、存在同一個 CVE。只查詢本地索引，不調用 Wazuh。",
+        CorrelationInput,
+        func=correlate
+    )]
+
+
 class WazuhToolkit:
     """Wazuh 工具包，提供便捷的工具創建和管理"""
 
-    def __init__(self, mcp_client: MCPClient):
+    def __init__(
+        self,
+        mcp_client: MCPClient,
+        progress_callback: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        cache: Optional[ToolResultCache] = None,
+        schema_cache_path: Optional[str] = None,
+        compactor: Optional[ResultCompactor] = None,
+        alert_store: Optional[AlertStore] = None,
+        snapshot_store: Optional[SnapshotStore] = None
+    ):
         """
         初始化 Wazuh 工具包
 
         Args:
             mcp_client: MCP 客戶端實例
+            progress_callback: 可選的工具進度回調，參數為 (工具名稱, 進度參數)
+            cache: 工具結果緩存（默認創建新的緩存）
+            schema_cache_path: 工具模式磁盤緩存路徑（為 None 時不緩存）
+            compactor: 工具結果壓縮器（默認按 WazToolConfig.TOKEN_BUDGETS 創建）
+            alert_store: 可選的本地警報存儲，提供時添加本地警報查詢工具
+            snapshot_store: 可選的進程和端口快照存儲，提供時添加快照比較工具
         """
         self.mcp_client = mcp_client
-        self._tools: Optional[List[Tool]] = None
+        self.progress_callback = progress_callback
+        self.cache = cache if cache is not None else ToolResultCache()
+        self.schema_cache = ToolSchemaCache(schema_cache_path) if schema_cache_path else None
+        self.compactor = compactor if compactor is not None else ResultCompactor(
+            WazToolConfig.TOKEN_BUDGETS,
+            WazToolConfig.DEFAULT_TOKEN_BUDGET
+        )
+        # 所有實際發出的進程、端口、漏洞查詢結果都寫入關聯索引
+        self.correlation = CorrelationIndex()
+        self.fleet = FleetScanner(mcp_client, self.cache, on_result=self.correlation.observe)
+        self.paginator = WazuhPaginator(
+            mcp_client, self.cache, self.compactor.store, on_result=self.correlation.observe
+        )
+        self.alert_store = alert_store
+        self.snapshot_store = snapshot_store
+        self._tool_definitions: Optional[List[Dict[str, Any]]] = None
+        self._tools: Optional[List[BaseTool]] = None
+
+    async def discover_tools(self) -> List[Dict[str, Any]]:
+        """
+        從 MCP 服務器發現工具定義
+
+        相同服務器版本的定義從磁盤緩存讀取，跳過 tools/list；
+        發現失敗時退回 WazToolConfig 的靜態定義。
+
+        Returns:
+            tools/list 格式的工具定義
+        """
+        server_info = getattr(self.mcp_client, "server_info", {})
+        definitions = self.schema_cache.load(server_info) if self.schema_cache else None
+
+        if definitions:
+            logger.info(f"💾 使用緩存的工具模式: {ToolSchemaCache.server_key(server_info)} ({len(definitions)} 個工具)")
+        else:
+            definitions = await self.mcp_client.list_tools()
+            if definitions:
+                logger.info(f"🔎 從 MCP 服務器發現 {len(definitions)} 個工具")
+                if self.schema_cache:
+                    self.schema_cache.save(server_info, definitions)
+            else:
+                logger.warning("⚠️  無法從 MCP 服務器獲取工具列表，使用內置工具定義")
+                definitions = WazToolConfig.static_tool_definitions()
 
-    def get_tools(self) -> List[Tool]:
+        self._tool_definitions = definitions
+        self.paginator.update_definitions(definitions)
+        self._tools = None
+        return definitions
+
+    def get_tools(self) -> List[BaseTool]:
         """
         獲取所有 Wazuh 工具
 
@@ -213,10 +1559,25 @@ class WazuhToolkit:
             LangChain 工具列表
         """
         if self._tools is None:
-            self._tools = create_wazuh_tools(self.mcp_client)
+            self._tools = create_wazuh_tools(
+                self.mcp_client,
+                self.progress_callback,
+                self.cache,
+                self._tool_definitions,
+                self.compactor,
+                self.correlation.observe
+            )
+            self._tools.append(create_full_result_tool(self.compactor.store))
+            self._tools.extend(create_fleet_tools(self.fleet))
+            self._tools.append(create_page_tool(self.paginator))
+            self._tools.extend(create_correlation_tools(self.correlation))
+            if self.alert_store is not None:
+                self._tools.extend(create_alert_store_tools(self.alert_store, self.mcp_client))
+            if self.snapshot_store is not None:
+                self._tools.extend(create_snapshot_tools(self.snapshot_store, self.fleet))
         return self._tools
 
-    def get_tool_by_name(self, tool_name: str) -> Optional[Tool]:
+    def get_tool_by_name(self, tool_name: str) -> Optional[BaseTool]:
         """
         根據名稱獲取工具
 
@@ -239,4 +1600,54 @@ class WazuhToolkit:
         Returns:
             工具名稱列表
         """
-        return list(WazToolConfig.WAZUH_TOOLS.keys())
+        return [tool.name for tool in self.get_tools()]
+
+    async def iter_pages(
+        self,
+        tool_name: str,
+        arguments: Optional[Dict[str, Any]] = None,
+        page_size: int = 100
+    ) -> AsyncIterator[List[Dict[str, str]]]:
+        """
+        逐頁迭代列表工具的記錄
+
+        每頁都在事件循環橋接線程上獲取；調用方 break 後不再請求後續頁面。
+
+        Args:
+            tool_name: 工具名稱
+            arguments: 工具參數
+            page_size: 每頁記錄數
+
+        Yields:
+            每頁的記錄列表
+        """
+        bridge = get_loop_bridge()
+        page = await bridge.run_async(self.paginator.fetch_page(tool_name, arguments, page_size=page_size))
+        while True:
+            if page["records"]:
+                yield page["records"]
+            if not page["next_cursor"]:
+                return
+            page = await bridge.run_async(self.paginator.fetch_page(cursor=page["next_cursor"], page_size=page_size))
+
+    def invalidate_cache(self, tool_name: Optional[str] = None, arguments: Optional[Dict[str, Any]] = None) -> int:
+        """
+        使工具結果緩存失效
+
+        Args:
+            tool_name: 只清除該工具的緩存；為 None 時清空全部
+            arguments: 只清除該組參數的緩存
+
+        Returns:
+            清除的條目數
+        """
+        return self.cache.invalidate(tool_name, arguments)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        獲取緩存命中統計
+
+        Returns:
+            包含 size、hits、misses、evictions、hit_rate 的字典
+        """
+        return self.cache.stats()
@@ -0,0 +1,155 @@
+"""
+查詢向量緩存
+以規範化後的查詢文本為鍵緩存嵌入向量，重複的查詢不再經過編碼器
+"""
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+
+def normalize_query(query: str) -> str:
+    """
+    規範化查詢文本：NFKC（全形轉半形）、大小寫折疊、合併空白
+
+    只差在全形、大小寫或空白的近似重複查詢共用一個緩存條目。all-MiniLM-L6-v2 的分詞器本身
+    會轉小寫並忽略多餘空白，但不做 NFKC 轉換，因此命中緩存時返回的向量與直接編碼原查詢只是近似相同。
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class QueryEmbeddingCache:
+    """
+    帶 LRU 容量上限的查詢向量緩存
+
+    可選持久化到 .npz 文件（查詢文本數組 + float32 向量矩陣），文件記錄模型名稱，
+    更換嵌入模型後舊緩存自動失效。
+    """
+
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None, model: str = ""):
+        """
+        初始化緩存
+
+        Args:
+            max_entries: 最大緩存條目數
+            path: 持久化文件路徑（為 None 時只保存在內存中）
+            model: 嵌入模型名稱
+        """
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self.model = model
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def embed(self, queries: Sequence[str], embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """
+        獲取查詢向量，未命中的查詢一次性批量編碼
+
+        Args:
+            queries: 查詢文本列表
+            embed_fn: 批量編碼函數（例如 embeddings.embed_documents）
+
+        Returns:
+            與 queries 一一對應的向量
+        """
+        keys = [normalize_query(query) for query in queries]
+        vectors: List[Optional[List[float]]] = []
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                vectors.append(vector)
+
+            # 同一批中重複的查詢只編碼一次，只有實際送入編碼器的查詢計為未命中
+            missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+
+        if missing:
+            computed = dict(zip(missing, embed_fn(missing)))
+            with self._lock:
+                for key, vector in computed.items():
+                    self._entries[key] = list(vector)
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                self._dirty = True
+            vectors = [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+        return vectors
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        緩存統計
+
+        Returns:
+            {"entries", "max_entries", "hits", "misses", "hit_rate"}
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def load(self) -> int:
+        """
+        從持久化文件載入緩存
+
+        Returns:
+            載入的條目數
+        """
+        if self.path is None or not self.path.exists():
+            return 0
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["model"]) != self.model:
+                    logger.info(f"💾 查詢向量緩存的模型已變更，忽略: {self.path}")
+                    return 0
+                queries = data["queries"].tolist()
+                vectors = data["vectors"].tolist()
+        except Exception as e:
+            logger.warning(f"⚠️  讀取查詢向量緩存失敗: {e}")
+            return 0
+
+        with self._lock:
+            for query, vector in zip(queries[-self.max_entries:], vectors[-self.max_entries:]):
+                self._entries[query] = vector
+        logger.info(f"💾 載入 {len(self._entries)} 條查詢向量緩存")
+        return len(self._entries)
+
+    def save(self) -> bool:
+        """
+        寫入持久化文件（按 LRU 順序，最近使用的在後）
+
+        Returns:
+            是否寫入了文件
+        """
+        if self.path is None:
+            return False
+        with self._lock:
+            if not self._dirty or not self._entries:
+                return False
+            queries = list(self._entries)
+            vectors = np.asarray(list(self._entries.values()), dtype=np.float32)
+            self._dirty = False
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 先寫臨時文件再替換，避免中途退出留下損壞的緩存
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, model=np.array(self.model), queries=np.array(queries), vectors=vectors)
+        tmp_path.replace(self.path)
+        logger.debug(f"💾 保存 {len(queries)} 條查詢向量緩存: {self.path}")
+        return True
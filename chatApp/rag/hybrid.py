@@ -0,0 +1,212 @@
+"""
+混合檢索
+BM25 倒排索引（中日文按雙字切分，標識符保留完整詞和子詞）與向量相似度按倒數排名融合
+"""
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from loguru import logger
+
+
+# 平假名、片假名、CJK 擴展 A、CJK 統一漢字、兼容漢字
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[{_CJK}]+|[a-z0-9]+(?:[_.\-][a-z0-9]+)*")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+_SUBWORD_RE = re.compile(r"[_.\-]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    切分檢索詞
+
+    中日文連續字符切為相鄰雙字（單字則保留單字）；英文和數字按詞切分，
+    帶 _ . - 的標識符（如 get_wazuh_agent_ports、CVE-2024-3094）同時保留完整詞和各子詞。
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        詞列表
+    """
+    tokens = []
+    for word in _TOKEN_RE.findall(unicodedata.normalize("NFKC", text).casefold()):
+        if _CJK_RE.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+            parts = _SUBWORD_RE.split(word)
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """
+    倒數排名融合：每個文檔的分數為各排名列表中 1 / (k + 名次) 之和
+
+    Args:
+        rankings: 多個按相關度排序的文檔編號列表
+        k: 平滑常數
+
+    Returns:
+        [(文檔編號, 融合分數), ...]，按分數從高到低
+    """
+    scores: Dict[int, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class BM25Index:
+    """
+    BM25 倒排索引
+
+    每個詞的倒排表在構建時就保存 idf 與詞頻歸一化後的權重，查詢時只需按詞累加。
+    """
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        """
+        構建索引
+
+        Args:
+            texts: 文檔文本，列表下標即文檔編號
+            k1: 詞頻飽和參數
+            b: 文檔長度歸一化參數
+        """
+        counts = [Counter(tokenize(text)) for text in texts]
+        lengths = [sum(count.values()) for count in counts]
+        average = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+        document_frequency: Counter = Counter()
+        for count in counts:
+            document_frequency.update(count.keys())
+
+        total = len(texts)
+        self.postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        for doc, (count, length) in enumerate(zip(counts, lengths)):
+            norm = k1 * (1 - b + b * length / average) if average else k1
+            for token, tf in count.items():
+                df = document_frequency[token]
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                self.postings[token].append((doc, idf * tf * (k1 + 1) / (tf + norm)))
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """
+        檢索
+
+        Args:
+            query: 查詢文本
+            limit: 返回的最大文檔數
+
+        Returns:
+            [(文檔編號, BM25 分數), ...]，按分數從高到低
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            for doc, weight in self.postings.get(token, ()):
+                scores[doc] += weight
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+class HybridIndex:
+    """
+    內存混合索引
+
+    保存全部文本塊、BM25 倒排索引和歸一化後的向量矩陣。文本塊數超過 prefilter_threshold 時，
+    向量相似度只對 BM25 候選計算；否則對全部文本塊計算，以免漏掉沒有共同詞的語義匹配。
+    """
+
+    def __init__(
+        self,
+        documents: List[Document],
+        embeddings: np.ndarray,
+        candidates: int = 50,
+        prefilter_threshold: int = 2000
+    ):
+        """
+        初始化索引
+
+        Args:
+            documents: 文本塊
+            embeddings: 與 documents 對應的向量矩陣
+            candidates: 每個檢索階段保留的候選數
+            prefilter_threshold: 啟用 BM25 預篩選的文本塊數下限
+        """
+        self.documents = documents
+        self.candidates = candidates
+        self.prefilter_threshold = prefilter_threshold
+        self.bm25 = BM25Index([doc.page_content for doc in documents])
+
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        matrix = matrix.reshape(len(documents), -1) if documents else np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.where(norms == 0, 1, norms)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, **kwargs) -> "HybridIndex":
+        """
+        從 Chroma 向量庫載入全部文本塊和向量
+
+        Args:
+            vectorstore: LangChain Chroma 向量庫
+            **kwargs: 傳給構造函數的參數
+
+        Returns:
+            HybridIndex 實例
+        """
+        data = vectorstore.get(include=["documents", "metadatas", "embeddings"])
+        documents = [
+            Document(page_content=text or "", metadata=metadata or {}, id=doc_id)
+            for doc_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        ]
+        embeddings = data["embeddings"] if data.get("embeddings") is not None else []
+        index = cls(documents, np.asarray(embeddings, dtype=np.float32), **kwargs)
+        logger.debug(f"🔤 混合索引: {len(index)} 個文本塊，{len(index.bm25.postings)} 個檢索詞")
+        return index
+
+    def search(self, query: str, vector: Sequence[float], k: int) -> List[Document]:
+        """
+        混合檢索
+
+        Args:
+            query: 查詢文本
+            vector: 查詢向量
+            k: 返回的文檔數量
+
+        Returns:
+            按融合分數排序的文檔列表
+        """
+        if not self.documents:
+            return []
+
+        lexical = [doc for doc, _ in self.bm25.search(query, self.candidates)]
+
+        query_vector = np.asarray(vector, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        if len(self) > self.prefilter_threshold and len(lexical) >= k:
+            pool = np.asarray(lexical)
+            scores = self.matrix[pool] @ query_vector
+        else:
+            pool = None
+            scores = self.matrix @ query_vector
+
+        top = min(self.candidates, len(scores))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        semantic = (pool[best] if pool is not None else best).tolist()
+
+        fused = reciprocal_rank_fusion([lexical, semantic])
+        return [self.documents[doc] for doc, _ in fused[:k]]
@@ -0,0 +1,191 @@
+"""
+知識庫增量索引
+掃描知識庫目錄（Markdown、文本、Wazuh 規則 XML），按內容哈希為文本塊生成 ID，
+只嵌入新增或修改的文本塊，並刪除已不存在的文本塊
+"""
+import hashlib
+import re
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Sequence
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from loguru import logger
+
+
+TEXT_SUFFIXES = {".md": "markdown", ".markdown": "markdown", ".txt": "text"}
+RULE_SUFFIXES = {".xml"}
+
+_XML_DECL_RE = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+
+def chunk_id(source: str, content: str) -> str:
+    """
+    文本塊 ID：來源路徑和內容的哈希
+
+    來源參與哈希，刪除一個文件只會刪除它自己的文本塊。
+    """
+    return hashlib.blake2b(f"{source}\0{content}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def parse_wazuh_rules(text: str, source: str) -> Optional[List[Document]]:
+    """
+    把 Wazuh 規則文件解析為每條規則一個文檔
+
+    規則文件通常有多個頂層 <group>，解析前包一層根元素。
+
+    Args:
+        text: 規則文件內容
+        source: 來源路徑
+
+    Returns:
+        文檔列表，不是有效 XML 時返回 None
+    """
+    try:
+        root = ET.fromstring(f"<root>{_XML_DECL_RE.sub('', text)}</root>")
+    except ET.ParseError:
+        return None
+
+    documents = []
+    for group in [root, *root.iter("group")]:
+        group_names = [name for name in (group.get("name") or "").split(",") if name]
+        for rule in group.findall("rule"):
+            rule_id = rule.get("id", "")
+            level = rule.get("level", "")
+            lines = [f"Wazuh 規則 {rule_id}（級別 {level}）"]
+            groups = list(group_names)
+            for child in rule:
+                value = " ".join((child.text or "").split())
+                if child.tag == "description":
+                    lines.append(f"描述: {value}")
+                elif child.tag == "group":
+                    groups.extend(name for name in value.split(",") if name)
+                elif child.tag == "mitre":
+                    lines.append("MITRE ATT&CK: " + ", ".join(e.text.strip() for e in child.iter("id") if e.text))
+                else:
+                    name = f" {child.get('name')}" if child.get("name") else ""
+                    lines.append(f"{child.tag}{name}: {value}")
+            if groups:
+                lines.append(f"組: {', '.join(groups)}")
+
+            metadata: Dict[str, Any] = {"source": source, "type": "wazuh_rule", "rule_id": rule_id}
+            if level.isdigit():
+                metadata["level"] = int(level)
+            documents.append(Document(page_content="\n".join(lines), metadata=metadata))
+    return documents
+
+
+class KnowledgeBaseIndexer:
+    """
+    知識庫增量索引器
+
+    每次同步都重新讀取和分割所有文件（成本很低），只有向量庫中不存在的文本塊 ID 才需要嵌入。
+    內容修改後文本塊的哈希隨之改變：新塊被嵌入，舊塊被刪除。
+    """
+
+    ADD_BATCH_SIZE = 256
+
+    def __init__(
+        self,
+        source_dir: Optional[str] = None,
+        builtin_texts: Sequence[str] = (),
+        chunk_size: int = 500,
+        chunk_overlap: int = 50
+    ):
+        """
+        初始化索引器
+
+        Args:
+            source_dir: 知識庫目錄（為 None 或不存在時只索引內置文檔）
+            builtin_texts: 內置知識文檔
+            chunk_size: 文本塊大小
+            chunk_overlap: 文本塊重疊字符數
+        """
+        self.source_dir = Path(source_dir) if source_dir else None
+        self.builtin_texts = list(builtin_texts)
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+        )
+
+    def _files(self) -> List[Path]:
+        if self.source_dir is None or not self.source_dir.is_dir():
+            return []
+        suffixes = set(TEXT_SUFFIXES) | RULE_SUFFIXES
+        return sorted(path for path in self.source_dir.rglob("*") if path.is_file() and path.suffix.lower() in suffixes)
+
+    def load_chunks(self) -> Dict[str, Document]:
+        """
+        讀取並分割所有知識文檔
+
+        Returns:
+            文本塊 ID -> 文本塊
+        """
+        documents = [
+            Document(page_content=text, metadata={"source": f"security_knowledge_{i+1}", "type": "best_practices"})
+            for i, text in enumerate(self.builtin_texts)
+        ]
+        rules: List[Document] = []
+
+        for path in self._files():
+            source = path.relative_to(self.source_dir).as_posix()
+            try:
+                text = path.read_text(encoding="utf-8")
+            except (OSError, UnicodeDecodeError) as e:
+                logger.warning(f"⚠️  無法讀取知識文件 {source}: {e}")
+                continue
+
+            if path.suffix.lower() in RULE_SUFFIXES:
+                parsed = parse_wazuh_rules(text, source)
+                if parsed is not None:
+                    rules.extend(parsed)
+                    continue
+                logger.warning(f"⚠️  {source} 不是有效的規則 XML，按文本索引")
+            documents.append(Document(
+                page_content=text,
+                metadata={"source": source, "type": TEXT_SUFFIXES.get(path.suffix.lower(), "text")}
+            ))
+
+        # 規則已經是獨立的小文檔，不再分割
+        chunks = {}
+        for chunk in self.splitter.split_documents(documents) + rules:
+            chunks[chunk_id(chunk.metadata["source"], chunk.page_content)] = chunk
+        return chunks
+
+    def sync(self, vectorstore) -> Dict[str, Any]:
+        """
+        同步向量庫與知識文檔
+
+        Args:
+            vectorstore: LangChain Chroma 向量庫
+
+        Returns:
+            {"chunks", "added", "removed", "elapsed_ms"}
+        """
+        start = time.perf_counter()
+        chunks = self.load_chunks()
+        existing = set(vectorstore.get(include=[])["ids"])
+
+        added = [key for key in chunks if key not in existing]
+        removed = sorted(existing - set(chunks))
+
+        if removed:
+            vectorstore.delete(ids=removed)
+        for i in range(0, len(added), self.ADD_BATCH_SIZE):
+            batch = added[i:i + self.ADD_BATCH_SIZE]
+            vectorstore.add_documents([chunks[key] for key in batch], ids=batch)
+
+        stats = {
+            "chunks": len(chunks),
+            "added": len(added),
+            "removed": len(removed),
+            "elapsed_ms": (time.perf_counter() - start) * 1000,
+        }
+        logger.info(
+            f"📄 知識庫索引同步: {stats['chunks']} 個文本塊，新增 {stats['added']}，"
+            f"刪除 {stats['removed']} ({stats['elapsed_ms']:.0f} ms)"
+        )
+        return stats
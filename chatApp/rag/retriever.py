@@ -2,17 +2,25 @@
 安全知識庫檢索器
 使用向量數據庫進行語義搜索和檢索
 """
-from typing import List, Optional, Dict, Any
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional, Dict, Any, Sequence
 from pathlib import Path
 import asyncio
+import threading
+import time
 
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.retrievers import BaseRetriever
+from pydantic import Field, PrivateAttr
 from loguru import logger
 
+from .embedding_cache import QueryEmbeddingCache
+from .hybrid import HybridIndex
+from .ingest import KnowledgeBaseIndexer
+
 # 創建安全的知識庫文檔
 SECURITY_KNOWLEDGE_BASE = [
     """
@@ -225,13 +233,44 @@ SECURITY_KNOWLEDGE_BASE = [
 
 
 class SecurityKnowledgeRetriever(BaseRetriever):
-    """安全知識庫檢索器"""
+    """
+    安全知識庫檢索器
+
+    嵌入模型和向量數據庫在首次查詢時加載；調用 warm_up() 可以提前在後台線程加載，
+    之後的查詢只需等待尚未完成的部分。異步檢索在有界線程池中執行，不會阻塞事件循環。
+    默認使用 BM25 與向量相似度的混合檢索，精確的工具名和 CVE 編號也能被召回。
+    """
+
+    knowledge_base_path: Path = Path("rag/chroma_db")
+    source_dir: Optional[Path] = None
+    embed_model: str = "sentence-transformers/all-MiniLM-L6-v2"
+    k: int = 3
+    max_workers: int = 2
+    query_cache_path: Optional[Path] = None
+    query_cache_size: int = 1024
+    hybrid: bool = True
+    timings: Dict[str, float] = Field(default_factory=dict)
+
+    _vectorstore: Optional[Chroma] = PrivateAttr(default=None)
+    _embeddings: Any = PrivateAttr(default=None)
+    _query_cache: Optional[QueryEmbeddingCache] = PrivateAttr(default=None)
+    _hybrid_index: Optional[HybridIndex] = PrivateAttr(default=None)
+    _executor: Optional[ThreadPoolExecutor] = PrivateAttr(default=None)
+    _executor_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _initialized: bool = PrivateAttr(default=False)
+    _init_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _warmup: Optional[Future] = PrivateAttr(default=None)
 
     def __init__(
         self,
         knowledge_base_path: str = "rag/chroma_db",
         embed_model: Optional[str] = None,
-        k: int = 3
+        k: int = 3,
+        max_workers: int = 2,
+        source_dir: Optional[str] = None,
+        query_cache_path: Optional[str] = None,
+        query_cache_size: int = 1024,
+        hybrid: bool = True
     ):
         """
         初始化檢索器
@@ -240,75 +279,202 @@ class SecurityKnowledgeRetriever(BaseRetriever):
             knowledge_base_path: 向量數據庫存儲路徑
             embed_model: 嵌入模型名稱（默認使用 all-MiniLM-L6-v2）
             k: 返回的文檔數量
+            max_workers: 異步檢索線程池的最大線程數
+            source_dir: 知識庫文檔目錄（Markdown、文本、Wazuh 規則 XML），為 None 時只索引內置文檔
+            query_cache_path: 查詢向量緩存的持久化路徑（為 None 時只緩存在內存中）
+            query_cache_size: 查詢向量緩存的最大條目數
+            hybrid: 是否使用 BM25 + 向量混合檢索（False 時只用向量檢索）
+        """
+        super().__init__(
+            knowledge_base_path=Path(knowledge_base_path),
+            source_dir=Path(source_dir) if source_dir else None,
+            query_cache_path=Path(query_cache_path) if query_cache_path else None,
+            query_cache_size=query_cache_size,
+            hybrid=hybrid,
+            embed_model=embed_model or "sentence-transformers/all-MiniLM-L6-v2",
+            k=k,
+            max_workers=max_workers
+        )
+
+    def warm_up(self) -> Future:
         """
-        super().__init__()
-        self.knowledge_base_path = Path(knowledge_base_path)
-        self.embed_model = embed_model or "sentence-transformers/all-MiniLM-L6-v2"
-        self.k = k
-        self._vectorstore: Optional[Chroma] = None
-        self._initialized = False
+        在後台線程加載嵌入模型並打開向量數據庫，立即返回
+
+        Returns:
+            完成時結果為各階段耗時（毫秒）的 Future
+        """
+        with self._init_lock:
+            if self._warmup is None:
+                self._warmup = Future()
+                threading.Thread(target=self._run_warm_up, name="rag-warm-up", daemon=True).start()
+            return self._warmup
+
+    def _run_warm_up(self):
+        """預熱線程入口"""
+        future = self._warmup
+        try:
+            self._initialize_vectorstore()
+            future.set_result(dict(self.timings))
+        except Exception as e:
+            future.set_exception(e)
+
+    @property
+    def pending_phases(self) -> List[str]:
+        """尚未完成的初始化階段"""
+        return [phase for phase in ("embeddings", "vectorstore", "index") if phase not in self.timings]
+
+    def _ensure_initialized(self):
+        """確保向量數據庫可用；預熱進行中時只等待剩餘階段"""
+        if self._initialized:
+            return
+
+        warmup = self._warmup
+        if warmup is not None:
+            waiting = not warmup.done()
+            if waiting:
+                logger.info(f"⏳ 等待知識庫預熱完成: {', '.join(self.pending_phases)}")
+            start = time.perf_counter()
+            try:
+                warmup.result()
+            except Exception as e:
+                logger.warning(f"⚠️  知識庫預熱失敗，重新初始化: {e}")
+                self._warmup = None
+            else:
+                if waiting:
+                    logger.info(f"✅ 知識庫預熱完成（等待 {(time.perf_counter() - start) * 1000:.0f} ms）")
+                return
+
+        self._initialize_vectorstore()
 
     def _initialize_vectorstore(self):
         """初始化向量數據庫"""
-        try:
-            # 創建嵌入模型
-            embeddings = HuggingFaceEmbeddings(
-                model_name=self.embed_model,
-                model_kwargs={'device': 'cpu'},
-                encode_kwargs={'normalize_embeddings': True}
-            )
-
-            # 嘗試加載現有的向量數據庫
-            if self.knowledge_base_path.exists():
-                logger.info(f"📂 加載現有的向量數據庫: {self.knowledge_base_path}")
+        with self._init_lock:
+            if self._initialized:
+                return
+            try:
+                # 創建嵌入模型
+                start = time.perf_counter()
+                embeddings = HuggingFaceEmbeddings(
+                    model_name=self.embed_model,
+                    model_kwargs={'device': 'cpu'},
+                    encode_kwargs={'normalize_embeddings': True}
+                )
+                self._embeddings = embeddings
+                self._query_cache = QueryEmbeddingCache(
+                    self.query_cache_size,
+                    str(self.query_cache_path) if self.query_cache_path else None,
+                    model=self.embed_model
+                )
+                self.timings["embeddings"] = (time.perf_counter() - start) * 1000
+                logger.info(f"🧠 嵌入模型加載完成: {self.embed_model} ({self.timings['embeddings']:.0f} ms)")
+
+                # 加載或創建向量數據庫
+                start = time.perf_counter()
+                logger.info(f"📂 打開向量數據庫: {self.knowledge_base_path}")
+                self.knowledge_base_path.mkdir(parents=True, exist_ok=True)
                 self._vectorstore = Chroma(
                     persist_directory=str(self.knowledge_base_path),
                     embedding_function=embeddings
                 )
-                logger.info("✅ 向量數據庫加載成功")
-            else:
-                # 創建新的向量數據庫
-                logger.info("📝 創建新的向量數據庫")
-                self._vectorstore = self._create_vectorstore(embeddings)
-                logger.info("✅ 向量數據庫創建成功")
+                self.timings["vectorstore"] = (time.perf_counter() - start) * 1000
+                logger.info(f"📚 向量數據庫就緒 ({self.timings['vectorstore']:.0f} ms)")
 
-            self._initialized = True
+                # 只嵌入新增或修改的文本塊
+                start = time.perf_counter()
+                self._sync_index()
+                self.timings["index"] = (time.perf_counter() - start) * 1000
 
-        except Exception as e:
-            logger.error(f"❌ 初始化向量數據庫失敗: {e}")
-            raise
-
-    def _create_vectorstore(self, embeddings) -> Chroma:
-        """創建新的向量數據庫"""
-        # 創建文檔
-        documents = []
-        for i, text in enumerate(SECURITY_KNOWLEDGE_BASE):
-            doc = Document(
-                page_content=text,
-                metadata={"source": f"security_knowledge_{i+1}", "type": "best_practices"}
-            )
-            documents.append(doc)
-
-        # 文本分割
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50,
-            length_function=len,
+                self._initialized = True
+
+            except Exception as e:
+                logger.error(f"❌ 初始化向量數據庫失敗: {e}")
+                raise
+
+    def _indexer(self) -> KnowledgeBaseIndexer:
+        """知識庫增量索引器"""
+        return KnowledgeBaseIndexer(
+            str(self.source_dir) if self.source_dir else None,
+            builtin_texts=SECURITY_KNOWLEDGE_BASE
         )
 
-        splits = text_splitter.split_documents(documents)
-        logger.info(f"📄 分割文檔為 {len(splits)} 個文本塊")
+    def reindex(self) -> Dict[str, Any]:
+        """
+        重新掃描知識庫目錄，只嵌入新增或修改的文本塊並刪除已移除的文本塊
 
-        # 創建向量數據庫
-        self.knowledge_base_path.mkdir(parents=True, exist_ok=True)
+        Returns:
+            {"chunks", "added", "removed", "elapsed_ms"}
+        """
+        self._ensure_initialized()
+        with self._init_lock:
+            return self._sync_index()
+
+    def _sync_index(self) -> Dict[str, Any]:
+        """同步向量庫並重建內存混合索引（調用方持有 _init_lock）"""
+        stats = self._indexer().sync(self._vectorstore)
+        if self.hybrid:
+            self._hybrid_index = HybridIndex.from_vectorstore(self._vectorstore)
+        return stats
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """獲取異步檢索使用的有界線程池"""
+        # 不能用 _init_lock：預熱期間它會被長時間持有，而這裡在事件循環上調用
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rag-query")
+            return self._executor
+
+    def batch_search(self, queries: Sequence[str], k: Optional[int] = None) -> List[List[Document]]:
+        """
+        批量檢索
 
-        vectorstore = Chroma.from_documents(
-            documents=splits,
-            embedding=embeddings,
-            persist_directory=str(self.knowledge_base_path)
-        )
+        命中查詢向量緩存的查詢跳過編碼，其餘查詢一次性送入嵌入模型，再逐個檢索：
+        混合模式下 BM25 與向量相似度的排名按倒數排名融合，否則只按向量搜索。
+
+        Args:
+            queries: 查詢文本列表
+            k: 每個查詢返回的文檔數量（默認使用 self.k）
 
-        return vectorstore
+        Returns:
+            與 queries 一一對應的文檔列表
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        self._ensure_initialized()
+
+        try:
+            vectors = self._query_cache.embed(queries, self._embeddings.embed_documents)
+            hybrid_index = self._hybrid_index
+            if hybrid_index is not None:
+                results = [
+                    hybrid_index.search(query, vector, k or self.k)
+                    for query, vector in zip(queries, vectors)
+                ]
+            else:
+                results = [
+                    self._vectorstore.similarity_search_by_vector(vector, k=k or self.k)
+                    for vector in vectors
+                ]
+            logger.debug(f"🔍 {len(queries)} 個查詢共檢索到 {sum(len(docs) for docs in results)} 個相關文檔")
+            return results
+
+        except Exception as e:
+            logger.error(f"❌ 檢索失敗: {e}")
+            return [[] for _ in queries]
+
+    async def abatch_search(self, queries: Sequence[str], k: Optional[int] = None) -> List[List[Document]]:
+        """
+        異步批量檢索，在有界線程池中執行 batch_search
+
+        Args:
+            queries: 查詢文本列表
+            k: 每個查詢返回的文檔數量（默認使用 self.k）
+
+        Returns:
+            與 queries 一一對應的文檔列表
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), partial(self.batch_search, list(queries), k))
 
     def _get_relevant_documents(self, query: str, **kwargs) -> List[Document]:
         """
@@ -320,24 +486,55 @@ class SecurityKnowledgeRetriever(BaseRetriever):
         Returns:
             相關文檔列表
         """
-        if not self._initialized:
-            self._initialize_vectorstore()
+        return self.batch_search([query])[0]
 
-        try:
-            # 搜索相關文檔
-            results = self._vectorstore.similarity_search(query, k=self.k)
-            logger.debug(f"🔍 檢索到 {len(results)} 個相關文檔")
-            return results
+    async def _aget_relevant_documents(self, query: str, **kwargs) -> List[Document]:
+        """
+        異步檢索相關文檔
 
-        except Exception as e:
-            logger.error(f"❌ 檢索失敗: {e}")
-            return []
+        Args:
+            query: 查詢文本
+
+        Returns:
+            相關文檔列表
+        """
+        return (await self.abatch_search([query]))[0]
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        查詢向量緩存統計
+
+        Returns:
+            {"entries", "max_entries", "hits", "misses", "hit_rate"}，尚未初始化時返回 None
+        """
+        return self._query_cache.stats() if self._query_cache is not None else None
+
+    def close(self):
+        """關閉異步檢索線程池並保存查詢向量緩存"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+        if self._query_cache is not None:
+            stats = self._query_cache.stats()
+            if stats["hits"] or stats["misses"]:
+                logger.info(
+                    f"💾 查詢向量緩存: 命中 {stats['hits']}，未命中 {stats['misses']}"
+                    f"（命中率 {stats['hit_rate']:.0%}）"
+                )
+            try:
+                self._query_cache.save()
+            except OSError as e:
+                logger.warning(f"⚠️  保存查詢向量緩存失敗: {e}")
 
 
 def create_security_retriever(
     knowledge_base_path: str = "rag/chroma_db",
     embed_model: Optional[str] = None,
-    k: int = 3
+    k: int = 3,
+    source_dir: Optional[str] = None,
+    query_cache_path: Optional[str] = None
 ) -> SecurityKnowledgeRetriever:
     """
     創建安全知識檢索器的便捷函數
@@ -346,6 +543,8 @@ def create_security_retriever(
         knowledge_base_path: 向量數據庫路徑
         embed_model: 嵌入模型名稱
         k: 返回的文檔數量
+        source_dir: 知識庫文檔目錄
+        query_cache_path: 查詢向量緩存的持久化路徑
 
     Returns:
         SecurityKnowledgeRetriever 實例
@@ -353,5 +552,7 @@ def create_security_retriever(
     return SecurityKnowledgeRetriever(
         knowledge_base_path=knowledge_base_path,
         embed_model=embed_model,
-        k=k
+        k=k,
+        source_dir=source_dir,
+        query_cache_path=query_cache_path
     )
@@ -0,0 +1,77 @@
+"""
+跨代理關聯索引單元測試
+驗證鍵提取、位圖倒排表的替換和共享鍵查找
+"""
+from mcp.correlation import CorrelationIndex, cmdline_hash, extract_keys
+
+
+PORTS = "get_wazuh_agent_ports"
+PROCESSES = "get_wazuh_agent_processes"
+
+
+def connection(remote: str, process: str = "curl") -> dict:
+    """構造一條端口記錄"""
+    return {"Protocol": "tcp", "Local": "10.0.0.5:51000", "Remote": remote, "Process": f"{process} (PID: 7)"}
+
+
+def test_extract_keys():
+    """提取遠程主機、進程名和 CVE，忽略本地和通配地址"""
+    keys = extract_keys(PORTS, [connection("1.2.3.4:443"), connection("0.0.0.0:0", "sshd"), connection("[2001:db8::1]:80")])
+    assert keys == {("ip", "1.2.3.4"), ("ip", "2001:db8::1"), ("process", "curl"), ("process", "sshd")}
+
+    keys = extract_keys("get_wazuh_vulnerability_summary", [{"CVE": "cve-2024-3094", "Title": "xz backdoor"}])
+    assert keys == {("cve", "CVE-2024-3094")}
+
+
+def test_lookup_and_intersect():
+    """按字段查詢和多條件求交集"""
+    index = CorrelationIndex()
+    index.add(PORTS, {"agent_id": "001"}, [connection("1.2.3.4:443")])
+    index.add(PORTS, {"agent_id": "002"}, [connection("1.2.3.4:443", "wget")])
+    index.add(PROCESSES, {"agent_id": "002"}, [{"Name": "wget", "Command": "wget  http://x/y"}])
+
+    assert index.lookup("ip", "1.2.3.4") == ["001", "002"]
+    assert index.lookup("process", "WGET") == ["002"]
+    assert index.lookup("cmdline", "wget http://x/y") == ["002"]
+    assert index.lookup("cmdline", cmdline_hash("wget http://x/y")) == ["002"]
+    assert index.intersect({"ip": "1.2.3.4", "process": "curl"}) == ["001"]
+    assert index.intersect({}) == []
+
+
+def test_add_replaces_previous_source():
+    """同一來源重新採集時替換舊鍵，其他來源仍提供的鍵保留"""
+    index = CorrelationIndex()
+    index.add(PORTS, {"agent_id": "001"}, [connection("1.2.3.4:443")])
+    index.add(PROCESSES, {"agent_id": "001"}, [{"Name": "curl"}])
+
+    index.add(PORTS, {"agent_id": "001"}, [connection("5.6.7.8:443", "nc")])
+    assert index.lookup("ip", "1.2.3.4") == []
+    assert index.lookup("ip", "5.6.7.8") == ["001"]
+    assert index.lookup("process", "curl") == ["001"]
+
+    # 後續分頁追加到同一來源
+    index.add(PORTS, {"agent_id": "001", "offset": 100}, [connection("9.9.9.9:53", "dig")])
+    assert index.lookup("ip", "5.6.7.8") == ["001"] and index.lookup("ip", "9.9.9.9") == ["001"]
+
+
+def test_related_skips_common_keys():
+    """按共享鍵數排序，超過 max_share 的普遍鍵不計入"""
+    index = CorrelationIndex()
+    for agent_id in ("001", "002", "003", "004"):
+        index.add(PROCESSES, {"agent_id": agent_id}, [{"Name": "sshd"}])
+    index.add(PORTS, {"agent_id": "001"}, [connection("1.2.3.4:443", "nc"), connection("5.6.7.8:443", "nc")])
+    index.add(PORTS, {"agent_id": "002"}, [connection("1.2.3.4:443", "nc"), connection("5.6.7.8:443", "nc")])
+    index.add(PORTS, {"agent_id": "003"}, [connection("1.2.3.4:443")])
+
+    related = index.related("001")
+    assert [(agent_id, count) for agent_id, count, _ in related] == [("002", 3), ("003", 1)]
+    assert ("ip", "1.2.3.4") in related[0][2]
+    assert all(("process", "sshd") not in keys for _, _, keys in related)
+    assert index.related("999") == []
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
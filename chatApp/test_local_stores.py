@@ -0,0 +1,146 @@
+"""
+本地存儲單元測試
+驗證警報高水位去重、時間聚合順序、列式聚合的增量載入，以及快照比較和展示文本回收
+"""
+import asyncio
+from datetime import datetime, timezone
+
+from mcp.alert_analytics import AlertAnalytics
+from mcp.alert_store import AlertStore
+from mcp.snapshot_store import SnapshotStore, fingerprint
+
+
+def make_alert(index: int, hour: int, minute: int = 0) -> dict:
+    """構造一條警報工具記錄"""
+    return {
+        "Alert ID": f"a{index}",
+        "Time": f"2025-01-01T{hour:02d}:{minute:02d}:00.000+0000",
+        "Agent": f"web-01 (00{index % 3})",
+        "Level": str(3 + index % 10),
+        "Rule ID": str(5700 + index % 2),
+        "Description": "sshd: authentication failed",
+    }
+
+
+def alert_text(records: list) -> str:
+    """把記錄拼成警報工具返回的文本"""
+    return "\n\n".join("\n".join(f"{key}: {value}" for key, value in record.items()) for record in records)
+
+
+def test_insert_records_high_water_mark():
+    """只寫入不早於高水位的新警報，重複的警報 ID 被忽略"""
+    store = AlertStore(":memory:")
+    assert store.insert_records([make_alert(i, 10, i) for i in range(5)]) == 5
+    assert store.high_water_mark == datetime(2025, 1, 1, 10, 4, tzinfo=timezone.utc).timestamp()
+
+    older = [make_alert(100, 9)]
+    again = [make_alert(4, 10, 4), make_alert(5, 10, 5)]
+    assert store.insert_records(older + again) == 1
+    assert store.count() == 6
+    assert store.query(limit=1)[0]["timestamp"].startswith("2025-01-01T10:05")
+    store.close()
+
+
+def test_agent_id_from_name():
+    """代理字段為 "web-01 (003)" 形式時拆分為名稱和 ID"""
+    store = AlertStore(":memory:")
+    store.insert_records([make_alert(1, 10)])
+    row = store.query(limit=1)[0]
+    assert row["agent_id"] == "001" and row["agent_name"] == "web-01"
+    store.close()
+
+
+def test_sync_stops_at_high_water_mark():
+    """增量同步從小 limit 開始，覆蓋到高水位後停止加倍"""
+    alerts = [make_alert(i, 1 + i // 60, i % 60) for i in range(300)]
+    limits = []
+
+    async def fetch_alerts(limit: int) -> str:
+        limits.append(limit)
+        return alert_text(sorted(alerts, key=lambda a: a["Time"], reverse=True)[:limit])
+
+    store = AlertStore(":memory:", initial_sync_limit=10, max_sync_limit=1000)
+    asyncio.run(store.sync(fetch_alerts))
+    assert limits == [1000] and store.count() == 300
+
+    alerts.extend(make_alert(300 + i, 7, i) for i in range(25))
+    limits.clear()
+    stats = asyncio.run(store.sync(fetch_alerts))
+    assert limits == [10, 20, 40]
+    assert stats["inserted"] == 25 and store.count() == 325
+    store.close()
+
+
+def test_aggregate_latest_hours_in_order():
+    """按小時聚合取最近的 top 個時段，按時間順序返回"""
+    store = AlertStore(":memory:")
+    store.insert_records([make_alert(i, i % 8, i) for i in range(40)])
+    groups = store.aggregate(group_by="hour", top=3)
+    assert [group["key"] for group in groups] == ["2025-01-01 05:00", "2025-01-01 06:00", "2025-01-01 07:00"]
+
+    by_rule = store.aggregate(group_by="rule", top=1)
+    assert by_rule[0]["count"] == 20
+    store.close()
+
+
+def test_alert_analytics_matches_store():
+    """列式聚合增量載入新警報，結果與 SQL 聚合一致"""
+    store = AlertStore(":memory:")
+    store.insert_records([make_alert(i, i % 8, i) for i in range(40)])
+    analytics = AlertAnalytics(store)
+    assert analytics.refresh() == 40
+
+    store.insert_records([make_alert(100 + i, 8, i) for i in range(5)])
+    assert analytics.refresh() == 5 and analytics.refresh() == 0
+
+    columns = analytics.columns
+    mask = columns.mask(min_level=8)
+    expected = {group["key"]: group["count"] for group in store.aggregate(group_by="agent", min_level=8)}
+    assert {group["key"]: group["count"] for group in columns.top_k("agent", 10, mask)} == expected
+
+    since = datetime(2025, 1, 1, 6, tzinfo=timezone.utc).timestamp()
+    starts, counts = columns.histogram(3600, columns.mask(since=since), since=since, until=since + 3 * 3600)
+    assert len(starts) == 3 and counts.tolist() == [5, 5, 5]
+    store.close()
+
+
+def test_fingerprint_ignores_volatile_fields():
+    """PID 和狀態變化不改變進程身份"""
+    a = fingerprint({"PID": "100", "Name": "nginx", "State": "S", "Command": "nginx -g daemon off;"})
+    b = fingerprint({"PID": "200", "Name": "nginx", "State": "R", "Command": "nginx -g daemon off;"})
+    c = fingerprint({"PID": "100", "Name": "nc", "Command": "nc -lvp 4444"})
+    assert a == b and a != c
+
+
+def test_snapshot_diff():
+    """首次採集建立基線，之後返回新增和消失的條目"""
+    store = SnapshotStore(":memory:")
+    base = [{"Name": "sshd"}, {"Name": "nginx"}]
+    assert store.record("001", "processes", base)["baseline"]
+    assert store.record("001", "processes", base)["unchanged"]
+
+    diff = store.record("001", "processes", [{"Name": "sshd"}, {"Name": "nc"}])
+    assert not diff["baseline"] and not diff["unchanged"]
+    assert diff["added"] == ["name=nc"] and diff["removed"] == ["name=nginx"]
+    assert diff["count"] == 2
+    store.close()
+
+
+def test_snapshot_items_released_with_history():
+    """超出歷史上限的快照被刪除後，不再被引用的展示文本隨之刪除，共享的文本保留"""
+    store = SnapshotStore(":memory:", history=2)
+    for i in range(6):
+        store.record("001", "processes", [{"Name": "sshd"}, {"Name": f"p{i}"}])
+        store.record("002", "processes", [{"Name": "sshd"}, {"Name": f"q{i}"}])
+
+    texts = {row["text"]: row["refs"] for row in store._conn.execute("SELECT text, refs FROM snapshot_items")}
+    assert texts == {"name=sshd": 4, "name=p4": 1, "name=p5": 1, "name=q4": 1, "name=q5": 1}
+    assert store.record("001", "processes", [{"Name": "sshd"}])["removed"] == ["name=p5"]
+    store.close()
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
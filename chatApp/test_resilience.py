@@ -0,0 +1,75 @@
+"""
+彈性控制單元測試
+驗證熔斷器狀態轉換和延遲分位數
+"""
+import time
+
+from mcp.resilience import CircuitBreaker, LatencyTracker
+
+
+def test_breaker_opens_after_threshold():
+    """連續失敗達到閾值後熔斷，成功會重置計數"""
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.failures == 0
+
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_after() <= 60
+
+
+def test_breaker_half_open_probe():
+    """恢復時間後只放行一個探測請求，探測結果決定關閉或重新打開"""
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_release_probe():
+    """未發出的探測請求歸還名額"""
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_latency_percentiles():
+    """分位數只基於最近 window 個樣本"""
+    tracker = LatencyTracker(window=5)
+    assert tracker.percentile("t", 95) is None
+
+    for seconds in (10.0, 1.0, 2.0, 3.0, 4.0, 5.0):
+        tracker.record("t", seconds)
+    assert tracker.count("t") == 5
+    assert tracker.percentile("t", 0) == 1.0
+    assert tracker.percentile("t", 50) == 3.0
+    assert tracker.percentile("t", 100) == 5.0
+    assert tracker.snapshot()["t"]["p99"] == 5.0
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,120 @@
+"""
+知識庫檢索單元測試
+驗證分詞、倒數排名融合、BM25 和混合索引、查詢向量緩存，以及規則文件解析
+"""
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from rag.embedding_cache import QueryEmbeddingCache, normalize_query
+from rag.hybrid import BM25Index, HybridIndex, reciprocal_rank_fusion, tokenize
+from rag.ingest import chunk_id, parse_wazuh_rules
+
+
+def test_tokenize():
+    """中文切為相鄰雙字，標識符保留完整詞和子詞"""
+    assert tokenize("代理斷線") == ["代理", "理斷", "斷線"]
+    assert tokenize("查") == ["查"]
+    assert tokenize("Check CVE-2024-3094") == ["check", "cve-2024-3094", "cve", "2024", "3094"]
+    assert tokenize("ＳＳＨ") == ["ssh"]
+
+
+def test_reciprocal_rank_fusion():
+    """出現在多個排名中的文檔排在前面，同分按編號排序"""
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]], k=60)
+    assert [doc for doc, _ in fused] == [1, 3, 2, 4]
+    assert fused[0][1] == 1 / 61 + 1 / 62
+    assert reciprocal_rank_fusion([]) == []
+
+
+def test_bm25_search():
+    """包含查詢詞的文檔按 BM25 分數排序"""
+    index = BM25Index(["sshd brute force", "nginx access log", "sshd sshd config hardening"])
+    results = index.search("sshd", limit=5)
+    assert [doc for doc, _ in results] == [2, 0]
+    assert index.search("kernel", limit=5) == []
+
+
+def test_hybrid_search():
+    """詞面和向量兩路結果融合；沒有共同詞的語義匹配也能返回"""
+    documents = [Document(page_content=text) for text in ("sshd brute force", "nginx access log", "firewall rules")]
+    embeddings = np.eye(3, dtype=np.float32)
+    index = HybridIndex(documents, embeddings)
+
+    assert [doc.page_content for doc in index.search("sshd", [0, 0, 1], k=2)] == ["sshd brute force", "firewall rules"]
+    assert [doc.page_content for doc in index.search("unmatched", [0, 1, 0], k=1)] == ["nginx access log"]
+    assert HybridIndex([], np.zeros((0, 3))).search("sshd", [1, 0, 0], k=3) == []
+
+
+def test_normalize_query():
+    """全形、大小寫和空白差異規範化為同一文本"""
+    assert normalize_query("  Wazuh   ＡＧＥＮＴ\tDisconnected ") == "wazuh agent disconnected"
+
+
+def test_query_embedding_cache():
+    """重複和近似重複的查詢只編碼一次，超出容量按 LRU 淘汰"""
+    encoded = []
+
+    def embed(queries):
+        encoded.extend(queries)
+        return [[float(len(query))] for query in queries]
+
+    cache = QueryEmbeddingCache(max_entries=2)
+    assert cache.embed(["abc", "ABC ", "de"], embed) == [[3.0], [3.0], [2.0]]
+    assert encoded == ["abc", "de"]
+
+    cache.embed(["abc"], embed)
+    cache.embed(["fghi"], embed)
+    cache.embed(["de"], embed)
+    assert encoded == ["abc", "de", "fghi", "de"]
+    assert cache.stats()["entries"] == 2
+
+
+def test_query_embedding_cache_persistence():
+    """持久化後重新載入，模型名稱變化時舊緩存失效"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "queries.npz")
+        cache = QueryEmbeddingCache(path=path, model="m1")
+        cache.embed(["abc"], lambda queries: [[1.0, 2.0] for _ in queries])
+        assert cache.save()
+        assert not cache.save()
+
+        assert QueryEmbeddingCache(path=path, model="m1").stats()["entries"] == 1
+        assert QueryEmbeddingCache(path=path, model="m2").stats()["entries"] == 0
+
+
+def test_parse_wazuh_rules():
+    """每條規則一個文檔，帶級別、描述和組信息"""
+    text = """<?xml version="1.0"?>
+<group name="syslog,sshd,">
+  <rule id="5710" level="5">
+    <if_sid>5700</if_sid>
+    <description>sshd: Attempt to login using a non-existent user</description>
+    <mitre><id>T1110</id></mitre>
+    <group>authentication_failed,</group>
+  </rule>
+</group>"""
+    documents = parse_wazuh_rules(text, "rules/sshd.xml")
+    assert len(documents) == 1
+    doc = documents[0]
+    assert doc.metadata == {"source": "rules/sshd.xml", "type": "wazuh_rule", "rule_id": "5710", "level": 5}
+    assert "描述: sshd: Attempt to login using a non-existent user" in doc.page_content
+    assert "MITRE ATT&CK: T1110" in doc.page_content
+    assert "組: syslog, sshd, authentication_failed" in doc.page_content
+    assert parse_wazuh_rules("<group><rule>", "broken.xml") is None
+
+
+def test_chunk_id():
+    """文本塊 ID 由來源和內容共同決定"""
+    assert chunk_id("a.md", "text") == chunk_id("a.md", "text")
+    assert chunk_id("a.md", "text") != chunk_id("b.md", "text")
+    assert chunk_id("a.md", "text") != chunk_id("a.md", "text2")
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
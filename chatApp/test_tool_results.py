@@ -0,0 +1,104 @@
+"""
+工具結果緩存與壓縮單元測試
+驗證規範化調用鍵、TTL 過期、LRU 淘汰，以及按 token 預算壓縮和完整結果句柄
+"""
+import re
+import time
+
+from mcp.cache import ToolResultCache, canonical_call_key
+from mcp.compaction import ResultCompactor, parse_records, record_field
+
+
+def test_canonical_call_key():
+    """參數順序和值為 None 的參數不影響調用鍵"""
+    assert canonical_call_key("get_wazuh_agents", {"limit": 10, "status": None}) == \
+        canonical_call_key("get_wazuh_agents", {"limit": 10})
+    assert canonical_call_key("t", {"a": 1, "b": 2}) == canonical_call_key("t", {"b": 2, "a": 1})
+    assert canonical_call_key("t", {"a": 1}) != canonical_call_key("t", {"a": 2})
+    assert canonical_call_key("t", {"a": 1}) != canonical_call_key("u", {"a": 1})
+    assert canonical_call_key("t", None) == canonical_call_key("t", {})
+
+
+def test_ttl_expiry():
+    """過期條目不再命中，ttl <= 0 時不緩存"""
+    cache = ToolResultCache()
+    cache.set("t", {"a": 1}, {"content": []}, ttl=0.05)
+    cache.set("t", {"a": 2}, {"content": []}, ttl=0)
+    assert cache.get("t", {"a": 1}) == {"content": []}
+    assert cache.get("t", {"a": 2}) is None
+
+    time.sleep(0.06)
+    assert cache.get("t", {"a": 1}) is None
+    assert cache.stats()["size"] == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_lru_eviction():
+    """超出容量時淘汰最久未使用的條目"""
+    cache = ToolResultCache(max_entries=2)
+    cache.set("t", {"a": 1}, {"n": 1}, ttl=60)
+    cache.set("t", {"a": 2}, {"n": 2}, ttl=60)
+    assert cache.get("t", {"a": 1}) == {"n": 1}  # a=1 變為最近使用
+
+    cache.set("t", {"a": 3}, {"n": 3}, ttl=60)
+    assert cache.get("t", {"a": 2}) is None
+    assert cache.get("t", {"a": 1}) == {"n": 1}
+    assert cache.get("t", {"a": 3}) == {"n": 3}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate():
+    """按工具或按參數清除條目"""
+    cache = ToolResultCache()
+    cache.set("t", {"a": 1}, {}, ttl=60)
+    cache.set("t", {"a": 2}, {}, ttl=60)
+    cache.set("u", {"a": 1}, {}, ttl=60)
+
+    assert cache.invalidate("t", {"a": 1}) == 1
+    assert cache.invalidate("t") == 1
+    assert cache.get("u", {"a": 1}) == {}
+    assert cache.invalidate() == 1
+
+
+def test_parse_records():
+    """空行分隔記錄，續行併入上一字段，不含字段的文本塊單獨返回"""
+    preamble, records = parse_records(
+        "Found 2 agents\n\nID: 001\nName: web-01\n  (primary)\n\nID: 002\nName: db-01"
+    )
+    assert preamble == ["Found 2 agents"]
+    assert records == [{"ID": "001", "Name": "web-01 (primary)"}, {"ID": "002", "Name": "db-01"}]
+    assert record_field(records[0], "agent id", "id") == "001"
+    assert record_field(records[0], "missing") is None
+
+
+def test_compact_within_budget():
+    """未超出預算的結果原樣返回"""
+    compactor = ResultCompactor(default_budget=500)
+    text = "ID: 001\nName: web-01"
+    assert compactor.compact("get_wazuh_agents", {}, text) == text
+    assert len(compactor.store) == 0
+
+
+def test_compact_ranks_and_keeps_full_result():
+    """超出預算時按嚴重性排序並匯總省略的記錄，完整結果可通過句柄取回"""
+    severities = ["Low", "Medium", "High", "Critical"]
+    text = "\n\n".join(
+        f"CVE: CVE-2024-{i:04d}\nSeverity: {severities[i % 4]}\nTitle: vuln {i} {'x' * 80}" for i in range(200)
+    )
+    compactor = ResultCompactor(default_budget=500)
+    compacted = compactor.compact("get_wazuh_vulnerability_summary", {"agent_id": "001"}, text)
+
+    rows = [line for line in compacted.splitlines() if line.startswith("| CVE-")]
+    assert rows and all("| Critical |" in row for row in rows)
+    assert "已省略" in compacted
+
+    handle = re.search(r"res-[0-9a-f]{12}", compacted).group()
+    assert compactor.store.get(handle)["text"] == text
+    assert len(compactor.store.records(handle)) == 200
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
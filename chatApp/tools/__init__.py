@@ -1,12 +1,14 @@
 """
 工具模塊
-包含聯網搜索和系統工具
+包含聯網搜索、系統工具和知識庫檢索工具
 """
 from .web_search import create_tavily_tool, create_web_search_tool
 from .system_tools import calculator_tool
+from .knowledge_base import create_knowledge_base_tool
 
 __all__ = [
     'create_tavily_tool',
     'create_web_search_tool',
-    'calculator_tool'
+    'calculator_tool',
+    'create_knowledge_base_tool'
 ]
@@ -0,0 +1,78 @@
+"""
+知識庫檢索工具
+把 SecurityKnowledgeRetriever 暴露給 Agent，支持一次檢索多個查詢
+"""
+from typing import List, Optional
+from langchain_core.documents import Document
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, Field
+
+from mcp.wazuh_tools import make_structured_tool
+from rag.retriever import SecurityKnowledgeRetriever
+
+
+class KnowledgeBaseSearchInput(BaseModel):
+    """search_security_knowledge 的參數"""
+    queries: List[str] = Field(
+        min_length=1,
+        max_length=5,
+        description="查詢列表（1-5 個），例如 ['代理 disconnected 排查', '關鍵漏洞響應流程']"
+    )
+    k: Optional[int] = Field(default=None, ge=1, le=10, description="每個查詢返回的文檔數量（默認 3）")
+
+
+def format_results(queries: List[str], results: List[List[Document]], max_chars: int = 800) -> str:
+    """
+    把檢索結果格式化為文本
+
+    Args:
+        queries: 查詢列表
+        results: 與查詢對應的文檔列表
+        max_chars: 每個文檔最多保留的字符數
+
+    Returns:
+        格式化後的文本
+    """
+    sections = []
+    for query, docs in zip(queries, results):
+        lines = [f"### 查詢: {query}"]
+        if not docs:
+            lines.append("未找到相關文檔")
+        for doc in docs:
+            source = doc.metadata.get("source", "unknown")
+            content = " ".join(doc.page_content.split())
+            if len(content) > max_chars:
+                content = content[:max_chars] + "…"
+            lines.append(f"[{source}] {content}")
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections)
+
+
+def create_knowledge_base_tool(retriever: SecurityKnowledgeRetriever) -> BaseTool:
+    """
+    創建知識庫檢索工具
+
+    同步調用直接檢索；異步調用在檢索器的有界線程池中執行，不阻塞事件循環和其他工具調用。
+
+    Args:
+        retriever: 安全知識庫檢索器
+
+    Returns:
+        LangChain 工具
+    """
+    def search(queries: List[str], k: Optional[int] = None) -> str:
+        return format_results(queries, retriever.batch_search(queries, k))
+
+    async def asearch(queries: List[str], k: Optional[int] = None) -> str:
+        return format_results(queries, await retriever.abatch_search(queries, k))
+
+    # 檢索不使用 MCP 連接，異步調用直接在調用方的事件循環中等待線程池
+    return make_structured_tool(
+        "search_security_knowledge",
+        "檢索本地安全知識庫（Wazuh 最佳實踐、事件響應流程、故障排除指南、合規要求）。"
+        "可一次傳入多個查詢，適合在調查前查找處置步驟或工具用法。",
+        KnowledgeBaseSearchInput,
+        coro_fn=asearch,
+        func=search,
+        bridge=False
+    )